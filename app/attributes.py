@@ -0,0 +1,303 @@
+import re
+
+# Ключи нормализованных атрибутов товара
+STORAGE_GB = "storage_gb"
+RAM_GB = "ram_gb"
+SCREEN_INCHES = "screen_in"
+MODEL_CODE = "model_code"
+COLOR = "color"
+
+# Атрибуты, которыми различаются модификации одного товара: офферы с разными значениями — разные товары
+VARIANT_KEYS = (STORAGE_GB, RAM_GB, SCREEN_INCHES)
+# Атрибуты, по которым ищутся офферы того же товара (цвет не учитывается)
+MATCH_KEYS = (MODEL_CODE, *VARIANT_KEYS)
+# Все извлекаемые атрибуты
+ATTRIBUTE_KEYS = (*MATCH_KEYS, COLOR)
+
+# Кандидат в код модели — слово вместе с дефисами, точками и слешами внутри ("TF-LED32S71T2")
+MODEL_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+# Код модели после нормализации: латиница и цифры, причем после буквы есть цифра ("B210D", "55E7KQ"),
+# поэтому единицы измерения ("60HZ", "4K") и чистые числа кодом модели не считаются
+MODEL_CODE_RE = re.compile(r"^(?=[A-Z0-9]{4,}$)[A-Z0-9]*[A-Z][A-Z0-9]*\d[A-Z0-9]*$")
+# Кириллические буквы, которые в кодах моделей пишут вместо одинаковых по начертанию латинских
+LOOKALIKES = str.maketrans("АВЕКМНОРСТУХаеорсух", "ABEKMHOPCTYXaeopcyx")
+
+# Множители единиц объема памяти к гигабайтам
+SIZE_UNITS = {"тб": 1024, "tb": 1024, "гб": 1, "gb": 1, "мб": 1 / 1024, "mb": 1 / 1024}
+# Объем памяти: "256 ГБ", "1TB", "0,5 Тб"
+SIZE_RE = re.compile(r"(?<![\w.,])(\d+(?:[.,]\d+)?)\s*(тб|tb|гб|gb|мб|mb)(?!\w)", re.IGNORECASE)
+# Оперативная и встроенная память через слеш или плюс: "8/256 ГБ", "12 + 512GB"
+MEMORY_PAIR_RE = re.compile(
+    r"(?<![\w.,])(\d{1,3})\s*(?:гб|gb)?\s*[/+]\s*(\d{1,5})\s*(тб|tb|гб|gb)(?!\w)", re.IGNORECASE
+)
+# Единица измерения в названии характеристики: "Встроенная память, ГБ"
+UNIT_RE = re.compile(r"(?<!\w)(тб|tb|гб|gb|мб|mb)(?!\w)", re.IGNORECASE)
+# Число без единицы измерения
+NUMBER_RE = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*$")
+# Диагональ в дюймах: 55", 6.1'', 15,6 дюйма
+INCHES_RE = re.compile(r"(?<![\w.,])(\d{1,3}(?:[.,]\d{1,2})?)\s*(?:\"|”|″|''|дюйм\w*|inch\w*)", re.IGNORECASE)
+# Диагональ в сантиметрах: 139 см. Ищется только в характеристике диагонали: в названии сантиметры —
+# обычно длина или ширина товара ("Кабель HDMI 150 см")
+CENTIMETERS_RE = re.compile(r"(?<![\w.,])(\d{2,3}(?:[.,]\d)?)\s*см(?!\w)", re.IGNORECASE)
+# Допустимый диапазон диагонали в дюймах
+SCREEN_RANGE = (1.0, 120.0)
+# Товары с экраном: только в их названиях размер в дюймах считается диагональю
+# (у колонок, дисков и колес это размер динамика или диаметр)
+SCREEN_PRODUCT_RE = re.compile(
+    r"телевизор|монитор|смартфон|телефон|ноутбук|планшет|моноблок|электронн\w* книг|экран|дисплей"
+    r"|(?<![a-z])(?:tv|monitor|display|laptop|notebook|smartphone|iphone|ipad|macbook)(?![a-z])",
+    re.IGNORECASE,
+)
+
+# Названия характеристик, из которых извлекаются атрибуты
+RAM_KEY_RE = re.compile(r"оперативн|(?<!\w)(?:озу|ram)(?!\w)")
+STORAGE_KEY_RE = re.compile(r"встроенн\w* памят|объем памяти|^память$|накопител|(?<!\w)(?:ssd|hdd)(?!\w)|жестк\w* диск")
+SCREEN_KEY_RE = re.compile(r"диагональ|размер (?:экрана|дисплея)")
+COLOR_KEY_RE = re.compile(r"^цвет(?: товара| корпуса)?$")
+MODEL_KEY_RE = re.compile(r"^(?:модель|код модели|артикул производителя|model)$")
+
+# Основы названий цветов -> нормализованный цвет. Русские основы совпадают только с окончанием
+# прилагательного ("синий", "синяя"), поэтому "сервер" и "синтезатор" цветом не считаются.
+COLOR_STEMS = {
+    "черн": "черный",
+    "бел": "белый",
+    "сер": "серый",
+    "графитов": "серый",
+    "серебрист": "серебристый",
+    "серебрян": "серебристый",
+    "золот": "золотой",
+    "золотист": "золотой",
+    "син": "синий",
+    "голуб": "голубой",
+    "красн": "красный",
+    "зелен": "зеленый",
+    "розов": "розовый",
+    "фиолетов": "фиолетовый",
+    "желт": "желтый",
+    "оранжев": "оранжевый",
+    "коричнев": "коричневый",
+    "бежев": "бежевый",
+}
+COLOR_WORDS = {
+    "black": "черный",
+    "white": "белый",
+    "gray": "серый",
+    "grey": "серый",
+    "silver": "серебристый",
+    "gold": "золотой",
+    "blue": "синий",
+    "red": "красный",
+    "green": "зеленый",
+    "pink": "розовый",
+    "purple": "фиолетовый",
+    "yellow": "желтый",
+    "orange": "оранжевый",
+    "brown": "коричневый",
+    "beige": "бежевый",
+}
+COLOR_RE = re.compile(
+    r"^(" + "|".join(sorted(COLOR_STEMS, key=len, reverse=True)) + r")(?:ый|ий|ой|ая|яя|ое|ее|ые|ие|ого|его)$"
+)
+WORD_RE = re.compile(r"\w+")
+
+
+def _number(text: str) -> float:
+    """
+    Преобразует число с точкой или запятой в float.
+    """
+    return float(text.replace(",", "."))
+
+
+def _normalize(value: float) -> int | float:
+    """
+    Округляет значение атрибута, чтобы одинаковые значения из разных источников совпадали точно.
+    """
+    value = round(value, 3)
+    return int(value) if value.is_integer() else value
+
+
+def parse_size_gb(text: str | None, default_unit: str | None = None) -> int | float | None:
+    """
+    Извлекает объем памяти в гигабайтах: "256 ГБ" -> 256, "1 ТБ" -> 1024, "512 МБ" -> 0.5.
+
+    Args:
+        text (str | None): Значение характеристики.
+        default_unit (str | None): Единица измерения для числа без единицы (из названия характеристики).
+
+    Returns:
+        int | float | None: Объем в гигабайтах или None, если объем не найден.
+    """
+    if not text:
+        return None
+    match = SIZE_RE.search(text)
+    if match:
+        return _normalize(_number(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+    match = NUMBER_RE.match(text)
+    if match and default_unit:
+        return _normalize(_number(match.group(1)) * SIZE_UNITS[default_unit.lower()])
+    return None
+
+
+def parse_memory_pair(text: str | None) -> tuple[int | float, int | float] | None:
+    """
+    Извлекает оперативную и встроенную память из записи вида "8/256 ГБ" или "12 + 1 ТБ".
+
+    Args:
+        text (str | None): Название товара или значение характеристики.
+
+    Returns:
+        tuple[int | float, int | float] | None: Оперативная и встроенная память в гигабайтах.
+    """
+    match = MEMORY_PAIR_RE.search(text or "")
+    if not match:
+        return None
+    ram, storage, unit = match.groups()
+    return _normalize(_number(ram)), _normalize(_number(storage) * SIZE_UNITS[unit.lower()])
+
+
+def parse_screen_inches(text: str | None, centimeters: bool = False) -> int | float | None:
+    """
+    Извлекает диагональ экрана в дюймах: 55", 6.1 дюйма, 139 см -> 54.7.
+
+    Args:
+        text (str | None): Название товара или значение характеристики.
+        centimeters (bool): Переводить в дюймы значение в сантиметрах. Только для характеристики диагонали.
+
+    Returns:
+        int | float | None: Диагональ в дюймах с точностью до десятой или None.
+    """
+    if not text:
+        return None
+    match = INCHES_RE.search(text)
+    inches = _number(match.group(1)) if match else None
+    if inches is None and centimeters:
+        match = CENTIMETERS_RE.search(text)
+        inches = _number(match.group(1)) / 2.54 if match else None
+    if inches is None or not SCREEN_RANGE[0] <= inches <= SCREEN_RANGE[1]:
+        return None
+    return _normalize(round(inches, 1))
+
+
+def parse_color(text: str | None) -> str | None:
+    """
+    Извлекает нормализованный цвет: "Серый титан" -> "серый", "темно-синяя" -> "синий", "Black" -> "черный".
+
+    Args:
+        text (str | None): Название товара или значение характеристики.
+
+    Returns:
+        str | None: Первый найденный цвет или None.
+    """
+    for word in WORD_RE.findall((text or "").lower().replace("ё", "е")):
+        color = COLOR_WORDS.get(word)
+        if color is not None:
+            return color
+        match = COLOR_RE.match(word)
+        if match:
+            return COLOR_STEMS[match.group(1)]
+    return None
+
+
+def extract_model_codes(title: str | None) -> set[str]:
+    """
+    Извлекает из названия кандидатов в код модели: слова из латиницы и цифр длиной от 4 символов,
+    в которых после буквы есть цифра. Регистр, дефисы, точки и слеши не учитываются.
+
+    Args:
+        title (str | None): Название товара.
+
+    Returns:
+        set[str]: Нормализованные коды моделей.
+    """
+    codes = set()
+    for token in MODEL_TOKEN_RE.findall((title or "").upper().translate(LOOKALIKES)):
+        # Большинство слов названия — обычные слова без цифр, их отбрасываем без регулярных выражений
+        if len(token) < 4 or token.isalpha():
+            continue
+        code = token.replace("-", "").replace(".", "").replace("/", "").replace("_", "")
+        if MODEL_CODE_RE.match(code):
+            codes.add(code)
+    return codes
+
+
+def pick_model_code(text: str | None) -> str | None:
+    """
+    Выбирает один код модели из текста: самый длинный из кандидатов (см. extract_model_codes).
+
+    Args:
+        text (str | None): Название товара или значение характеристики.
+
+    Returns:
+        str | None: Нормализованный код модели или None.
+    """
+    codes = extract_model_codes(text)
+    if not codes:
+        return None
+    return min(codes, key=lambda code: (-len(code), code))
+
+
+def extract_attributes(title: str | None, features: dict[str, str] | None) -> dict[str, int | float | str]:
+    """
+    Извлекает из характеристик и названия товара нормализованные атрибуты для точного сопоставления:
+
+    - storage_gb: встроенная память (накопитель) в гигабайтах;
+    - ram_gb: оперативная память в гигабайтах;
+    - screen_in: диагональ экрана в дюймах (из названия — только у товаров с экраном, см. SCREEN_PRODUCT_RE);
+    - model_code: код модели (см. extract_model_codes);
+    - color: цвет из словаря COLOR_STEMS/COLOR_WORDS.
+
+    Значения характеристик важнее названия: из названия берутся только атрибуты, которых нет
+    в характеристиках. Если в названии несколько объемов памяти без записи вида "8/256 ГБ",
+    наибольший считается встроенной памятью, а наименьший — оперативной.
+
+    Args:
+        title (str | None): Название товара.
+        features (dict[str, str] | None): Характеристики товара.
+
+    Returns:
+        dict[str, int | float | str]: Найденные атрибуты; ненайденных ключей в словаре нет.
+    """
+    attributes: dict[str, int | float | str] = {}
+
+    def put(key: str, value) -> None:
+        if value is not None and key not in attributes:
+            attributes[key] = value
+
+    for name, value in (features or {}).items():
+        name = name.lower().replace("ё", "е").strip()
+        unit = UNIT_RE.search(name)
+        unit = unit.group(1) if unit else None
+        if RAM_KEY_RE.search(name):
+            put(RAM_GB, parse_size_gb(value, unit))
+        elif STORAGE_KEY_RE.search(name) and "карт" not in name and "видео" not in name:
+            pair = parse_memory_pair(value)
+            if pair is not None:
+                put(RAM_GB, pair[0])
+                put(STORAGE_GB, pair[1])
+            else:
+                put(STORAGE_GB, parse_size_gb(value, unit))
+        elif SCREEN_KEY_RE.search(name):
+            put(SCREEN_INCHES, parse_screen_inches(value, centimeters=True))
+        elif COLOR_KEY_RE.match(name):
+            put(COLOR, parse_color(value))
+        elif MODEL_KEY_RE.match(name):
+            put(MODEL_CODE, pick_model_code(value))
+
+    if title:
+        pair = parse_memory_pair(title)
+        if pair is not None:
+            put(RAM_GB, pair[0])
+            put(STORAGE_GB, pair[1])
+        elif STORAGE_GB not in attributes:
+            sizes = sorted(
+                {_normalize(_number(size) * SIZE_UNITS[unit.lower()]) for size, unit in SIZE_RE.findall(title)}
+            )
+            if sizes:
+                put(STORAGE_GB, sizes[-1])
+            if len(sizes) > 1:
+                put(RAM_GB, sizes[0])
+        if SCREEN_PRODUCT_RE.search(title):
+            put(SCREEN_INCHES, parse_screen_inches(title))
+        put(MODEL_CODE, pick_model_code(title))
+        put(COLOR, parse_color(title))
+    return attributes
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Кэш в памяти процесса с вытеснением давно не использованных записей (LRU) и временем жизни записей (TTL).
+
+    Кэш не потокобезопасен и рассчитан на один цикл событий asyncio.
+
+    Запись, прочитанная из источника до инвалидации, не должна попасть в кэш после нее. Для этого
+    каждая инвалидация увеличивает generation: читающий запоминает generation до обращения к источнику
+    и передает его в set, и запись с устаревшим поколением отбрасывается.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._clock = clock
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> V | None:
+        """
+        Возвращает значение по ключу или None, если записи нет или ее время жизни истекло.
+
+        Args:
+            key (K): Ключ.
+
+        Returns:
+            V | None: Значение из кэша.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, generation: int | None = None, ttl: float | None = None) -> None:
+        """
+        Сохраняет значение, вытесняя самую давно использованную запись при переполнении.
+
+        Args:
+            key (K): Ключ.
+            value (V): Значение.
+            generation (int | None): Поколение кэша на момент чтения значения из источника.
+                Если после чтения была инвалидация, значение не сохраняется.
+            ttl (float | None): Время жизни записи в секундах, если оно отличается от ttl кэша.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[K]) -> None:
+        """
+        Удаляет записи по ключам.
+
+        Args:
+            keys (Iterable[K]): Ключи удаляемых записей.
+        """
+        self.generation += 1
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Удаляет все записи.
+        """
+        self.generation += 1
+        self._entries.clear()
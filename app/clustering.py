@@ -0,0 +1,311 @@
+import logging
+import re
+import uuid
+import zlib
+from array import array
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+
+from app.attributes import LOOKALIKES, VARIANT_KEYS, extract_model_codes
+
+logger = logging.getLogger(__name__)
+
+# Слово названия — последовательность букв и цифр
+TOKEN_RE = re.compile(r"\w+")
+LATIN_RE = re.compile(r"[a-z]")
+# Разделители нескольких штрихкодов в одном поле
+BARCODE_SEPARATORS_RE = re.compile(r"[,;\s]+")
+
+# Параметры хеш-функций MinHash: h(x) = ((a * x + b) mod p) & 0xFFFFFFFF
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Множитель для свертки строк полосы LSH в один ключ
+_BAND_MULTIPLIER = np.uint64(1_000_003)
+# Ограничение на количество элементов матрицы хешей, вычисляемой за один шаг
+_SIGNATURE_CHUNK = 4_000_000
+
+
+class ClusteringOptions(NamedTuple):
+    """
+    Параметры кластеризации офферов одного товара.
+
+    - enabled: Вычислять product_cluster_id.
+    - title_threshold: Минимальный коэффициент Жаккара слов названий, при котором офферы считаются одним товаром.
+    - lsh_bands, lsh_rows: Количество полос LSH и строк в полосе. Пары с коэффициентом Жаккара
+      около (1 / lsh_bands) ** (1 / lsh_rows) и выше становятся кандидатами с высокой вероятностью.
+    - max_bucket_size: Ключ бренд + модель или корзина LSH, в которую попало больше офферов,
+      считается неразличающим (общее слово, стандарт, серия) и не объединяет офферы.
+    - variant_keys: Атрибуты модификации товара. Офферы с разными
+      значениями не объединяются по модели и названию, даже если модель или название совпадают.
+    """
+
+    enabled: bool = True
+    title_threshold: float = 0.8
+    lsh_bands: int = 16
+    lsh_rows: int = 8
+    max_bucket_size: int = 50
+    variant_keys: tuple[str, ...] = VARIANT_KEYS
+
+
+def _gtin_check_digit_ok(digits: str) -> bool:
+    """
+    Проверяет контрольную цифру GTIN (EAN-8, UPC-A, EAN-13, GTIN-14).
+    """
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+
+def normalize_barcodes(barcode: str | None) -> list[str]:
+    """
+    Приводит штрихкоды оффера к GTIN-14.
+
+    В поле может быть несколько штрихкодов через запятую, точку с запятой или пробел.
+    Штрихкоды неподходящей длины, с неверной контрольной цифрой и из одних нулей отбрасываются.
+    UPC-A и EAN-13 одного товара после дополнения нулями до 14 цифр совпадают.
+
+    Args:
+        barcode (str | None): Значение поля barcode.
+
+    Returns:
+        list[str]: Нормализованные штрихкоды.
+    """
+    codes = []
+    parts = [barcode] if barcode and barcode.isdigit() else BARCODE_SEPARATORS_RE.split(barcode or "")
+    for digits in parts:
+        if len(digits) not in (8, 12, 13, 14) or not digits.isdigit() or not digits.strip("0"):
+            continue
+        if _gtin_check_digit_ok(digits):
+            codes.append(digits.zfill(14))
+    return codes
+
+
+def title_shingles(title: str | None) -> set[int]:
+    """
+    Возвращает хеши слов названия без учета регистра и различия "е"/"ё". В словах, где есть
+    латиница, кириллические буквы заменяются одинаковыми по начертанию латинскими ("еSIM" и "eSIM").
+
+    Args:
+        title (str | None): Название товара.
+
+    Returns:
+        set[int]: 32-битные хеши слов.
+    """
+    text = (title or "").lower().replace("ё", "е")
+    tokens = (token.translate(LOOKALIKES) if LATIN_RE.search(token) else token for token in TOKEN_RE.findall(text))
+    return {zlib.crc32(token.encode()) for token in tokens}
+
+
+class ProductClusterer:
+    """
+    Кластеризация офферов одного физического товара.
+
+    Офферы объединяются, если у них совпадает нормализованный штрихкод, совпадают бренд и код
+    модели или почти совпадают названия. Почти совпадающие названия ищутся через MinHash LSH:
+    кандидатами становятся офферы, у которых совпала хотя бы одна полоса сигнатуры, и пара
+    объединяется, только если точный коэффициент Жаккара слов названий не меньше порога.
+    Модификации одного товара (iPhone 15 Pro 128 и 256 ГБ) по модели и названию не объединяются:
+    у каждой группы хранятся известные значения атрибутов options.variant_keys, и объединение
+    групп с разными значениями отклоняется. Совпадение штрихкода объединяет офферы всегда.
+    Связные группы собираются системой непересекающихся множеств, поэтому время работы
+    почти линейно по количеству офферов.
+
+    Офферы добавляются по одному. В памяти хранятся только ключи и хеши слов, а не тексты.
+    """
+
+    def __init__(self, options: ClusteringOptions = ClusteringOptions(), seed: int = 1) -> None:
+        self.options = options
+        self.sku_ids: list[uuid.UUID] = []
+        # Ключ штрихкода или бренда и модели -> номера офферов
+        self._keys: dict[str, array] = defaultdict(lambda: array("q"))
+        # Хеши слов названий всех офферов подряд и границы офферов в этом массиве
+        self._shingles = array("I")
+        self._indptr = array("q", [0])
+        # Номер оффера -> значения атрибутов модификации (только для офферов, у которых они есть)
+        self._variants: dict[int, dict[str, int | float]] = {}
+
+        rng = np.random.default_rng(seed)
+        num_perm = options.lsh_bands * options.lsh_rows
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.sku_ids)
+
+    def add(
+        self,
+        sku_id: uuid.UUID,
+        barcode: str | None,
+        brand: str | None,
+        title: str | None,
+        attributes: dict | None = None,
+    ) -> None:
+        """
+        Добавляет оффер.
+
+        Args:
+            sku_id (uuid.UUID): UUID SKU.
+            barcode (str | None): Штрихкод.
+            brand (str | None): Бренд.
+            title (str | None): Название.
+            attributes (dict | None): Нормализованные атрибуты (см. app.attributes.extract_attributes):
+                код модели дополняет коды из названия, атрибуты модификации запрещают объединение.
+        """
+        attributes = attributes or {}
+        index = len(self.sku_ids)
+        self.sku_ids.append(sku_id)
+        for code in normalize_barcodes(barcode):
+            self._keys[f"barcode:{code}"].append(index)
+        brand_key = " ".join(TOKEN_RE.findall((brand or "").lower()))
+        if brand_key:
+            codes = extract_model_codes(title)
+            if attributes.get("model_code"):
+                codes.add(attributes["model_code"])
+            for code in codes:
+                self._keys[f"model:{brand_key}:{code}"].append(index)
+        variants = {key: attributes[key] for key in self.options.variant_keys if attributes.get(key) is not None}
+        if variants:
+            self._variants[index] = variants
+        self._shingles.extend(sorted(title_shingles(title)))
+        self._indptr.append(len(self._shingles))
+
+    def _band_keys(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Вычисляет сигнатуры MinHash названий и сворачивает каждую полосу сигнатуры в один ключ.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Номера офферов с непустым названием и матрица ключей
+                полос размером (lsh_bands, количество таких офферов).
+        """
+        bands, rows = self.options.lsh_bands, self.options.lsh_rows
+        indptr = np.frombuffer(self._indptr, dtype=np.int64)
+        shingles = np.frombuffer(self._shingles, dtype=np.uint32).astype(np.uint64)
+        offers = np.flatnonzero(np.diff(indptr))
+        keys = np.empty((bands, len(offers)), dtype=np.uint64)
+
+        # Хеши считаются кусками офферов, чтобы матрица (количество хеш-функций, количество слов) помещалась в память
+        words_per_offer = max(len(shingles) // max(len(offers), 1), 1)
+        step = max(_SIGNATURE_CHUNK // (bands * rows * words_per_offer), 1)
+        for start in range(0, len(offers), step):
+            end = start + step
+            chunk = offers[start:end]
+            lo, hi = indptr[chunk[0]], indptr[chunk[-1] + 1]
+            with np.errstate(over="ignore"):
+                hashes = (self._a[:, None] * shingles[None, lo:hi] + self._b[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+            # Пустых офферов в куске нет, поэтому границы строго возрастают
+            signatures = np.minimum.reduceat(hashes, indptr[chunk] - lo, axis=1)
+            for band in range(bands):
+                key = np.zeros(len(chunk), dtype=np.uint64)
+                with np.errstate(over="ignore"):
+                    for row in range(band * rows, (band + 1) * rows):
+                        key = key * _BAND_MULTIPLIER + signatures[row]
+                keys[band, start:end] = key
+        return offers, keys
+
+    def _jaccard(self, left: int, right: int) -> float:
+        """
+        Точный коэффициент Жаккара слов названий двух офферов.
+        """
+        indptr, shingles = self._indptr, self._shingles
+        left_start, left_end = indptr[left], indptr[left + 1]
+        right_start, right_end = indptr[right], indptr[right + 1]
+        left_words = set(shingles[left_start:left_end])
+        right_words = set(shingles[right_start:right_end])
+        return len(left_words & right_words) / len(left_words | right_words)
+
+    def clusters(self) -> dict[uuid.UUID, uuid.UUID]:
+        """
+        Объединяет офферы в кластеры.
+
+        Идентификатор кластера — наименьший UUID среди SKU кластера, поэтому он не зависит
+        от порядка офферов в фиде. Оффер без пары образует кластер из себя самого.
+
+        Returns:
+            dict[uuid.UUID, uuid.UUID]: UUID SKU -> product_cluster_id.
+        """
+        parent = list(range(len(self.sku_ids)))
+        # Корень группы -> известные значения атрибутов модификации группы
+        variants = dict(self._variants)
+        conflicts = 0
+
+        def find(node: int) -> int:
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        def union(left: int, right: int, check_variants: bool = True) -> bool:
+            nonlocal conflicts
+            left, right = find(left), find(right)
+            if left == right:
+                return False
+            left_variants, right_variants = variants.get(left, {}), variants.get(right, {})
+            if check_variants and any(
+                left_variants[key] != value for key, value in right_variants.items() if key in left_variants
+            ):
+                conflicts += 1
+                return False
+            root, child = min(left, right), max(left, right)
+            parent[child] = root
+            variants.pop(child, None)
+            if left_variants or right_variants:
+                variants[root] = {**left_variants, **right_variants}
+            return True
+
+        # Точные ключи: штрихкод и бренд + модель
+        merged = {"barcode": 0, "model": 0, "title": 0}
+        for key, members in self._keys.items():
+            kind = key.split(":", 1)[0]
+            if len(members) < 2 or (kind == "model" and len(members) > self.options.max_bucket_size):
+                continue
+            if kind == "barcode":
+                for member in members[1:]:
+                    merged[kind] += union(members[0], member, check_variants=False)
+                continue
+            # Разные модификации одной модели образуют разные группы: оффер присоединяется
+            # к первой группе без конфликта атрибутов или начинает новую
+            heads = [members[0]]
+            for member in members[1:]:
+                for head in heads:
+                    if find(head) == find(member):
+                        break
+                    if union(head, member):
+                        merged[kind] += 1
+                        break
+                else:
+                    heads.append(member)
+
+        # Почти совпадающие названия: кандидаты из одинаковых корзин полос LSH
+        offers, keys = self._band_keys()
+        for band_keys in keys:
+            order = np.argsort(band_keys, kind="stable")
+            starts = np.flatnonzero(np.diff(band_keys[order], prepend=band_keys[order[:1]] + 1))
+            sizes = np.diff(starts, append=len(order))
+            # Перебираются только корзины, в которых больше одного оффера
+            candidates = (sizes >= 2) & (sizes <= self.options.max_bucket_size)
+            for start, size in zip(starts[candidates].tolist(), sizes[candidates].tolist()):
+                end = start + size
+                head, *members = offers[order[start:end]].tolist()
+                for member in members:
+                    if find(head) != find(member) and self._jaccard(head, member) >= self.options.title_threshold:
+                        merged["title"] += union(head, member)
+
+        # Идентификатор кластера — наименьший UUID среди его SKU
+        cluster_ids: dict[int, uuid.UUID] = {}
+        for index, sku_id in enumerate(self.sku_ids):
+            root = find(index)
+            if root not in cluster_ids or sku_id < cluster_ids[root]:
+                cluster_ids[root] = sku_id
+
+        logger.info(
+            "Clustered %d SKUs into %d products (merged by barcode %d, by brand and model %d, by title %d, "
+            "%d merges refused for different variants)",
+            len(self.sku_ids),
+            len(cluster_ids),
+            merged["barcode"],
+            merged["model"],
+            merged["title"],
+            conflicts,
+        )
+        return {sku_id: cluster_ids[find(index)] for index, sku_id in enumerate(self.sku_ids)}
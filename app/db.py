@@ -1,5 +1,67 @@
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncEngine
+import json
+import uuid
+from datetime import timedelta
+from typing import AsyncGenerator, Iterable
+
+import asyncpg
+from sqlalchemy import Row, and_, case, delete, func, or_, select, text, true, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.metrics import STAGE_DB_WRITE, track
+from app.models import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    SIMILARITY_CHANNEL,
+    SKU,
+    SKU_DELETED_CHANNEL,
+    Category,
+    IngestCheckpoint,
+    SimilarityJob,
+    SkuSimilarity,
+)
+from app.parser import CategoryPath
+
+# Колонки таблицы sku, заполняемые при загрузке через COPY.
+# inserted_at и updated_at заполняются значениями по умолчанию на стороне БД.
+SKU_COPY_COLUMNS = (
+    "uuid",
+    "marketplace_id",
+    "product_id",
+    "title",
+    "description",
+    "brand",
+    "seller_id",
+    "seller_name",
+    "first_image_url",
+    "category_id",
+    "category_lvl_1",
+    "category_lvl_2",
+    "category_lvl_3",
+    "category_remaining",
+    "features",
+    "attributes",
+    "rating_count",
+    "rating_value",
+    "price_before_discounts",
+    "discount",
+    "price_after_discounts",
+    "bonuses",
+    "sales",
+    "currency",
+    "barcode",
+    "content_hash",
+)
+
+# Колонки, которые обновляются при повторной загрузке измененного оффера (uuid сохраняется)
+SKU_UPSERT_COLUMNS = tuple(column for column in SKU_COPY_COLUMNS if column != "uuid")
+
+# Колонки таблицы sku_similarity, заполняемые через COPY (computed_at заполняется на стороне БД)
+SIMILARITY_COPY_COLUMNS = ("src_uuid", "rank", "dst_uuid", "score")
+
+# Количество UUID в одном уведомлении (размер уведомления ограничен 8000 байтами)
+NOTIFY_BATCH_SIZE = 200
 
 
 async def create_table(engine: AsyncEngine) -> None:
@@ -32,6 +94,7 @@ async def create_table(engine: AsyncEngine) -> None:
             category_lvl_3         TEXT,
             category_remaining     TEXT,
             features               JSON,
+            attributes             JSONB DEFAULT '{}',
             rating_count           INTEGER,
             rating_value           DOUBLE PRECISION,
             price_before_discounts REAL,
@@ -43,7 +106,746 @@ async def create_table(engine: AsyncEngine) -> None:
             updated_at             TIMESTAMP DEFAULT NOW(),
             currency               TEXT,
             barcode                TEXT,
-            similar_sku            UUID[]
+            content_hash           TEXT,
+            deleted_at             TIMESTAMP,
+            product_cluster_id     UUID
         );
+        CREATE INDEX IF NOT EXISTS sku_product_cluster_id_index ON public.sku (product_cluster_id);
+        CREATE INDEX IF NOT EXISTS sku_attributes_index ON public.sku USING gin (attributes jsonb_path_ops);
+
+        CREATE TABLE IF NOT EXISTS public.sku_similarity
+        (
+            src_uuid    UUID,
+            rank        SMALLINT,
+            dst_uuid    UUID NOT NULL,
+            score       REAL,
+            computed_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (src_uuid, rank)
+        );
+        CREATE INDEX IF NOT EXISTS sku_similarity_dst_uuid_index ON public.sku_similarity (dst_uuid);
         """
         await conn.execute(text(create_table_sql))
+
+
+async def save_similar_skus(session: AsyncSession, similar: dict[uuid.UUID, list[tuple[uuid.UUID, float]]]) -> None:
+    """
+    Заменяет похожие SKU переданных товаров в таблице sku_similarity.
+
+    Прежние ребра товаров удаляются одним DELETE по первичному ключу, новые загружаются
+    через COPY. Запись выполняется в транзакции сессии, фиксация остается за вызывающим
+    кодом, чтобы ребра записывались вместе с чекпоинтом или отметкой о выполнении задачи.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - similar: Словарь, где ключ — UUID SKU, значение — список пар (UUID похожего SKU, оценка)
+      в порядке выдачи.
+
+    Исключения:
+    - Вызываются при ошибках соединения с базой данных или выполнения SQL-запроса.
+    """
+    if not similar:
+        return
+    records = [
+        (sku_id, rank, similar_id, score)
+        for sku_id, items in similar.items()
+        for rank, (similar_id, score) in enumerate(items, start=1)
+    ]
+    with track(STAGE_DB_WRITE, len(similar)):
+        # DELETE выполняется через сессию: asyncpg-адаптер SQLAlchemy открывает транзакцию только
+        # перед первым запросом, и без него DELETE, COPY и NOTIFY на соединении asyncpg
+        # фиксировались бы по отдельности
+        await session.execute(
+            text(f"DELETE FROM {SkuSimilarity.__tablename__} WHERE src_uuid = ANY(CAST(:ids AS uuid[]))"),
+            {"ids": list(similar)},
+        )
+        driver = await get_driver_connection(await session.connection())
+        if records:
+            await driver.copy_records_to_table(
+                SkuSimilarity.__tablename__, records=records, columns=SIMILARITY_COPY_COLUMNS
+            )
+        await notify_similarity_changed(driver, list(similar))
+
+
+async def delete_similar_skus(conn: AsyncConnection, sku_ids: list[uuid.UUID]) -> None:
+    """
+    Удаляет похожие SKU переданных товаров из таблицы sku_similarity.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    - sku_ids: Список UUID товаров.
+    """
+    if not sku_ids:
+        return
+    driver = await get_driver_connection(conn)
+    await driver.execute(f"DELETE FROM {SkuSimilarity.__tablename__} WHERE src_uuid = ANY($1::uuid[])", sku_ids)
+    await notify_similarity_changed(driver, sku_ids)
+
+
+async def notify_similarity_changed(driver: asyncpg.Connection, sku_ids: list[uuid.UUID]) -> None:
+    """
+    Уведомляет слушателей канала SIMILARITY_CHANNEL (сервис похожих товаров) об изменении
+    похожих SKU переданных товаров.
+
+    UUID передаются через запятую, пачками по NOTIFY_BATCH_SIZE. Уведомление, отправленное
+    внутри транзакции, доставляется только после ее фиксации и не доставляется при откате.
+
+    Параметры:
+    - driver: Соединение asyncpg.
+    - sku_ids: Список UUID товаров.
+    """
+    for start in range(0, len(sku_ids), NOTIFY_BATCH_SIZE):
+        end = start + NOTIFY_BATCH_SIZE
+        payload = ",".join(str(sku_id) for sku_id in sku_ids[start:end])
+        await driver.execute("SELECT pg_notify($1, $2)", SIMILARITY_CHANNEL, payload)
+
+
+async def notify_skus_deleted(driver: asyncpg.Connection, offers: list[tuple[int, int]]) -> None:
+    """
+    Уведомляет слушателей канала SKU_DELETED_CHANNEL (сервис похожих товаров) об удалении офферов,
+    чтобы сервис перестал находить их UUID по ключу оффера.
+
+    Ключи передаются в виде "marketplace_id:product_id" через запятую, пачками по NOTIFY_BATCH_SIZE.
+
+    Параметры:
+    - driver: Соединение asyncpg.
+    - offers: Список ключей офферов (marketplace_id, product_id).
+    """
+    for start in range(0, len(offers), NOTIFY_BATCH_SIZE):
+        end = start + NOTIFY_BATCH_SIZE
+        payload = ",".join(f"{marketplace_id}:{product_id}" for marketplace_id, product_id in offers[start:end])
+        await driver.execute("SELECT pg_notify($1, $2)", SKU_DELETED_CHANNEL, payload)
+
+
+async def iter_cluster_inputs(
+    session: AsyncSession, batch_size: int = 10000
+) -> AsyncGenerator[list[tuple[uuid.UUID, str, str, str, dict]], None]:
+    """
+    Постранично выбирает поля активных SKU, по которым строятся кластеры офферов одного товара.
+
+    Используется keyset-пагинация по первичному ключу, поэтому каждая страница читается
+    отдельным коротким запросом и в памяти одновременно находится не более batch_size строк.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - batch_size: Количество SKU на одной странице.
+
+    Возвращает:
+    - Асинхронный генератор списков кортежей (uuid, barcode, brand, title, attributes).
+    """
+    last_id = None
+    while True:
+        query = (
+            select(SKU.uuid, SKU.barcode, SKU.brand, SKU.title, SKU.attributes)
+            .where(SKU.deleted_at.is_(None))
+            .order_by(SKU.uuid)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            query = query.where(SKU.uuid > last_id)
+        rows = [tuple(row) for row in (await session.execute(query)).all()]
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+async def save_product_clusters(conn: AsyncConnection, clusters: dict[uuid.UUID, uuid.UUID]) -> int:
+    """
+    Записывает product_cluster_id товаров.
+
+    Пары загружаются через COPY во временную таблицу и переносятся в 'sku' одним UPDATE.
+    Строки, у которых кластер не изменился, не перезаписываются.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    - clusters: Словарь UUID SKU -> product_cluster_id.
+
+    Возвращает:
+    - Количество товаров, у которых изменился кластер.
+    """
+    if not clusters:
+        return 0
+    driver = await get_driver_connection(conn)
+    with track(STAGE_DB_WRITE, len(clusters)):
+        async with driver.transaction():
+            await driver.execute(
+                "CREATE TEMP TABLE sku_clusters (uuid UUID PRIMARY KEY, product_cluster_id UUID) ON COMMIT DROP"
+            )
+            await driver.copy_records_to_table("sku_clusters", records=list(clusters.items()))
+            status = await driver.execute(
+                """
+                UPDATE public.sku AS sku
+                SET product_cluster_id = clusters.product_cluster_id
+                FROM sku_clusters AS clusters
+                WHERE sku.uuid = clusters.uuid
+                  AND sku.product_cluster_id IS DISTINCT FROM clusters.product_cluster_id
+                """
+            )
+    return int(status.split()[-1])
+
+
+def sku_to_record(sku) -> tuple:
+    """
+    Преобразует SKU в кортеж значений в порядке SKU_COPY_COLUMNS.
+
+    Параметры:
+    - sku: Объект SKU.
+
+    Возвращает:
+    - Кортеж значений для COPY.
+    """
+    return (
+        sku.uuid,
+        sku.marketplace_id,
+        sku.product_id,
+        sku.title,
+        sku.description,
+        sku.brand,
+        sku.seller_id,
+        sku.seller_name,
+        sku.first_image_url,
+        sku.category_id,
+        sku.category_lvl_1,
+        sku.category_lvl_2,
+        sku.category_lvl_3,
+        sku.category_remaining,
+        json.dumps(sku.features, ensure_ascii=False),
+        json.dumps(sku.attributes or {}, ensure_ascii=False),
+        sku.rating_count,
+        sku.rating_value,
+        sku.price_before_discounts,
+        sku.discount,
+        sku.price_after_discounts,
+        sku.bonuses,
+        sku.sales,
+        sku.currency,
+        sku.barcode,
+        sku.content_hash,
+    )
+
+
+async def get_driver_connection(conn: AsyncConnection) -> asyncpg.Connection:
+    """
+    Возвращает соединение asyncpg, на котором работает асинхронное соединение SQLAlchemy.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+
+    Возвращает:
+    - Соединение asyncpg.
+    """
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def copy_skus(conn: AsyncConnection, skus: Iterable, checkpoint_path: str | None = None) -> int:
+    """
+    Записывает пачку SKU в таблицу 'sku' одной командой COPY в отдельной транзакции.
+
+    ORM-объекты не создаются и не регистрируются в сессии, поэтому после записи
+    на пачку не остается ссылок и расход памяти не зависит от размера фида.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    - skus: Пачка объектов SKU.
+    - checkpoint_path: Путь к фиду, чекпоинт которого обновляется в той же транзакции:
+      пачка и отметка о ней фиксируются вместе.
+
+    Возвращает:
+    - Количество записанных строк.
+
+    Исключения:
+    - Вызываются при ошибках соединения с базой данных или нарушении ограничений таблицы.
+    """
+    records = [sku_to_record(sku) for sku in skus]
+    if not records:
+        return 0
+    driver = await get_driver_connection(conn)
+    with track(STAGE_DB_WRITE, len(records)):
+        async with driver.transaction():
+            await driver.copy_records_to_table(SKU.__tablename__, records=records, columns=SKU_COPY_COLUMNS)
+            if checkpoint_path is not None:
+                await driver.execute(
+                    f"""
+                    UPDATE {IngestCheckpoint.__tablename__}
+                    SET offers_done = offers_done + $2,
+                        last_marketplace_id = $3,
+                        last_product_id = $4,
+                        updated_at = NOW()
+                    WHERE feed_path = $1
+                    """,
+                    checkpoint_path,
+                    len(records),
+                    records[-1][1],
+                    records[-1][2],
+                )
+    return len(records)
+
+
+async def create_staging_tables(conn: AsyncConnection) -> None:
+    """
+    Создает временные таблицы для инкрементальной загрузки.
+
+    - sku_stage: пачка офферов, загружаемая через COPY перед upsert в 'sku';
+    - sku_feed_keys: ключи (marketplace_id, product_id) всех офферов текущего фида.
+
+    Временные таблицы живут до закрытия соединения, поэтому вся инкрементальная
+    загрузка должна выполняться на одном соединении.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    """
+    driver = await get_driver_connection(conn)
+    await driver.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS sku_stage (LIKE public.sku INCLUDING DEFAULTS);
+        CREATE TEMP TABLE IF NOT EXISTS sku_feed_keys
+        (
+            marketplace_id INTEGER,
+            product_id     BIGINT,
+            PRIMARY KEY (marketplace_id, product_id)
+        );
+        TRUNCATE sku_stage, sku_feed_keys;
+        """
+    )
+
+
+async def upsert_skus(conn: AsyncConnection, skus: list) -> dict[tuple[int, int], uuid.UUID]:
+    """
+    Записывает пачку SKU в таблицу 'sku' с upsert по (marketplace_id, product_id).
+
+    Пачка загружается через COPY во временную таблицу sku_stage, затем одним запросом
+    переносится в 'sku'. Строки с неизменным content_hash не перезаписываются. Существующие
+    товары сохраняют свой uuid, а ранее мягко удаленные товары восстанавливаются.
+    Ключи всех офферов пачки запоминаются в sku_feed_keys для последующей пометки удаленных.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy, на котором вызывалась create_staging_tables.
+    - skus: Пачка объектов SKU.
+
+    Возвращает:
+    - Словарь (marketplace_id, product_id) -> uuid для новых и измененных товаров.
+
+    Исключения:
+    - Вызываются при ошибках соединения с базой данных или выполнения SQL-запроса.
+    """
+    records = [sku_to_record(sku) for sku in skus]
+    if not records:
+        return {}
+
+    columns = ", ".join(SKU_COPY_COLUMNS)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in SKU_UPSERT_COLUMNS)
+    driver = await get_driver_connection(conn)
+    with track(STAGE_DB_WRITE, len(records)):
+        async with driver.transaction():
+            await driver.execute("TRUNCATE sku_stage")
+            await driver.copy_records_to_table("sku_stage", records=records, columns=SKU_COPY_COLUMNS)
+            await driver.execute(
+                """
+                INSERT INTO sku_feed_keys (marketplace_id, product_id)
+                SELECT marketplace_id, product_id FROM sku_stage
+                ON CONFLICT DO NOTHING
+                """
+            )
+            rows = await driver.fetch(
+                f"""
+                INSERT INTO public.sku AS sku ({columns})
+                SELECT DISTINCT ON (marketplace_id, product_id) {columns} FROM sku_stage
+                ON CONFLICT (marketplace_id, product_id) DO UPDATE
+                SET {updates}, deleted_at = NULL, updated_at = NOW()
+                WHERE sku.content_hash IS DISTINCT FROM EXCLUDED.content_hash OR sku.deleted_at IS NOT NULL
+                RETURNING sku.marketplace_id, sku.product_id, sku.uuid
+                """
+            )
+    return {(row["marketplace_id"], row["product_id"]): row["uuid"] for row in rows}
+
+
+async def soft_delete_missing_skus(conn: AsyncConnection) -> list[uuid.UUID]:
+    """
+    Помечает удаленными товары, которых нет в текущем фиде (нет в sku_feed_keys), и уведомляет
+    об этом слушателей канала SKU_DELETED_CHANNEL (см. notify_skus_deleted).
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy, на котором выполнялись upsert_skus.
+
+    Возвращает:
+    - Список UUID помеченных товаров.
+    """
+    driver = await get_driver_connection(conn)
+    rows = await driver.fetch(
+        """
+        UPDATE public.sku AS sku
+        SET deleted_at = NOW()
+        WHERE sku.deleted_at IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM sku_feed_keys AS k
+              WHERE k.marketplace_id = sku.marketplace_id AND k.product_id = sku.product_id
+          )
+        RETURNING sku.uuid, sku.marketplace_id, sku.product_id
+        """
+    )
+    await notify_skus_deleted(driver, [(row["marketplace_id"], row["product_id"]) for row in rows])
+    return [row["uuid"] for row in rows]
+
+
+async def find_referencing_skus(conn: AsyncConnection, sku_ids: list[uuid.UUID]) -> list[uuid.UUID]:
+    """
+    Находит активные товары, у которых среди похожих есть хотя бы один из переданных UUID.
+
+    UUID загружаются через COPY во временную таблицу и соединяются с таблицей sku_similarity
+    по индексу dst_uuid, поэтому просматриваются только ребра, ведущие к переданным товарам.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    - sku_ids: Список UUID товаров.
+
+    Возвращает:
+    - Список UUID товаров, ссылающихся на переданные.
+    """
+    if not sku_ids:
+        return []
+    driver = await get_driver_connection(conn)
+    async with driver.transaction():
+        await driver.execute("CREATE TEMP TABLE sku_lookup_ids (uuid UUID PRIMARY KEY) ON COMMIT DROP")
+        await driver.copy_records_to_table("sku_lookup_ids", records=[(sku_id,) for sku_id in set(sku_ids)])
+        rows = await driver.fetch(
+            """
+            SELECT DISTINCT sku.uuid
+            FROM sku_lookup_ids AS lookup
+            JOIN public.sku_similarity AS similarity ON similarity.dst_uuid = lookup.uuid
+            JOIN public.sku AS sku ON sku.uuid = similarity.src_uuid
+            WHERE sku.deleted_at IS NULL
+            """
+        )
+    return [row["uuid"] for row in rows]
+
+
+async def save_category_paths(
+    conn: AsyncConnection,
+    categories: dict[int, str],
+    parent_map: dict[int, int],
+    category_paths: dict[int, CategoryPath],
+) -> None:
+    """
+    Сохраняет таблицу путей категорий в таблицу 'category', полностью заменяя ее содержимое.
+
+    Параметры:
+    - conn: Асинхронное соединение SQLAlchemy.
+    - categories: Словарь с категориями.
+    - parent_map: Словарь с родительскими категориями.
+    - category_paths: Таблица путей категорий.
+    """
+    records = [
+        (category_id, categories.get(category_id), parent_map.get(category_id), *path)
+        for category_id, path in category_paths.items()
+    ]
+    driver = await get_driver_connection(conn)
+    async with driver.transaction():
+        await driver.execute(f"DELETE FROM {Category.__tablename__}")
+        await driver.copy_records_to_table(
+            Category.__tablename__,
+            records=records,
+            columns=("id", "name", "parent_id", "lvl_1", "lvl_2", "lvl_3", "remaining"),
+        )
+
+
+async def load_checkpoint(
+    session: AsyncSession, feed_path: str, feed_size: int, feed_mtime: float
+) -> IngestCheckpoint | None:
+    """
+    Загружает незавершенный чекпоинт загрузки фида.
+
+    Чекпоинт возвращается, только если файл фида не изменился с момента начала загрузки.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - feed_path: Путь к файлу фида.
+    - feed_size: Текущий размер файла фида.
+    - feed_mtime: Текущее время изменения файла фида.
+
+    Возвращает:
+    - Чекпоинт или None, если продолжать нечего.
+    """
+    # Таблицы еще нет при самом первом запуске
+    if await session.scalar(text(f"SELECT to_regclass('public.{IngestCheckpoint.__tablename__}')")) is None:
+        return None
+    return await session.scalar(
+        select(IngestCheckpoint).where(
+            IngestCheckpoint.feed_path == feed_path,
+            IngestCheckpoint.feed_size == feed_size,
+            IngestCheckpoint.feed_mtime == feed_mtime,
+            IngestCheckpoint.completed_at.is_(None),
+        )
+    )
+
+
+async def load_checkpoint_indices(session: AsyncSession, feed_path: str | None = None) -> list[str]:
+    """
+    Возвращает индексы Elasticsearch незавершенных чекпоинтов загрузки.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - feed_path: Путь к файлу фида. Если не задан, возвращаются индексы чекпоинтов всех фидов.
+
+    Возвращает:
+    - Список имен индексов.
+    """
+    if await session.scalar(text(f"SELECT to_regclass('public.{IngestCheckpoint.__tablename__}')")) is None:
+        return []
+    query = select(IngestCheckpoint.es_index).where(
+        IngestCheckpoint.completed_at.is_(None), IngestCheckpoint.es_index.is_not(None)
+    )
+    if feed_path is not None:
+        query = query.where(IngestCheckpoint.feed_path == feed_path)
+    return list(await session.scalars(query))
+
+
+async def start_checkpoint(
+    session: AsyncSession, feed_path: str, feed_size: int, feed_mtime: float, es_index: str | None = None
+) -> IngestCheckpoint:
+    """
+    Создает чекпоинт новой загрузки фида, заменяя чекпоинт предыдущей.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - feed_path: Путь к файлу фида.
+    - feed_size: Размер файла фида.
+    - feed_mtime: Время изменения файла фида.
+    - es_index: Индекс Elasticsearch, в который загружается фид.
+
+    Возвращает:
+    - Созданный чекпоинт.
+    """
+    await session.execute(delete(IngestCheckpoint).where(IngestCheckpoint.feed_path == feed_path))
+    checkpoint = IngestCheckpoint(
+        feed_path=feed_path, feed_size=feed_size, feed_mtime=feed_mtime, es_index=es_index, offers_done=0
+    )
+    session.add(checkpoint)
+    await session.commit()
+    return checkpoint
+
+
+async def save_checkpoint(session: AsyncSession, feed_path: str, **values) -> None:
+    """
+    Обновляет поля чекпоинта загрузки фида. Фиксация транзакции остается за вызывающим кодом,
+    чтобы чекпоинт записывался вместе с данными, которые он отмечает.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - feed_path: Путь к файлу фида.
+    - values: Новые значения полей IngestCheckpoint.
+    """
+    await session.execute(
+        update(IngestCheckpoint)
+        .where(IngestCheckpoint.feed_path == feed_path)
+        .values(updated_at=func.now(), **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def enqueue_similarity_jobs(session: AsyncSession, run_id: str, unit_size: int) -> int:
+    """
+    Разбивает активные товары на задачи поиска похожих по unit_size UUID подряд.
+
+    Диапазоны вычисляются одним запросом по первичному ключу sku. Если задачи прохода уже
+    созданы (продолжение прерванной загрузки), новые не создаются, а задачи, исчерпавшие
+    попытки, возвращаются в очередь.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - run_id: Проход поиска похожих.
+    - unit_size: Количество товаров в одной задаче.
+
+    Возвращает:
+    - Количество задач прохода.
+    """
+    total = await session.scalar(select(func.count()).where(SimilarityJob.run_id == run_id))
+    if total:
+        await session.execute(
+            update(SimilarityJob)
+            .where(SimilarityJob.run_id == run_id, SimilarityJob.status == JOB_FAILED)
+            .values(status=JOB_PENDING, attempts=0, worker_id=None, heartbeat_at=None)
+        )
+    else:
+        result = await session.execute(
+            text(
+                f"""
+                INSERT INTO {SimilarityJob.__tablename__} (run_id, first_uuid, last_uuid)
+                -- У uuid нет min/max, текстовая запись UUID упорядочена так же, как сам UUID
+                SELECT :run_id, min(uuid::text)::uuid, max(uuid::text)::uuid
+                FROM (
+                    SELECT uuid, (row_number() OVER (ORDER BY uuid) - 1) / :unit_size AS unit
+                    FROM {SKU.__tablename__}
+                    WHERE deleted_at IS NULL
+                ) AS units
+                GROUP BY unit
+                ORDER BY unit
+                """
+            ),
+            {"run_id": run_id, "unit_size": unit_size},
+        )
+        total = result.rowcount
+    await session.commit()
+    return total
+
+
+async def claim_similarity_job(
+    session: AsyncSession, worker_id: str, lease_timeout: float, max_attempts: int, run_id: str | None = None
+) -> Row | None:
+    """
+    Забирает следующую задачу поиска похожих.
+
+    Задача выбирается запросом FOR UPDATE SKIP LOCKED, поэтому воркеры не ждут друг друга
+    и не забирают одну задачу дважды. Кроме новых задач забираются задачи, воркер которых
+    не обновлял heartbeat_at дольше lease_timeout (упал или завис). Такие задачи, исчерпавшие
+    max_attempts попыток, помечаются failed.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - worker_id: Идентификатор воркера.
+    - lease_timeout: Таймаут аренды задачи в секундах.
+    - max_attempts: Максимальное количество попыток выполнения задачи.
+    - run_id: Забирать только задачи этого прохода. None — задачи любого прохода.
+
+    Возвращает:
+    - Строка (id, run_id, first_uuid, last_uuid, attempts) или None, если свободных задач нет.
+    """
+    stale = and_(
+        SimilarityJob.status == JOB_RUNNING, SimilarityJob.heartbeat_at < func.now() - timedelta(seconds=lease_timeout)
+    )
+    same_run = SimilarityJob.run_id == run_id if run_id is not None else true()
+    await session.execute(
+        update(SimilarityJob)
+        .where(stale, same_run, SimilarityJob.attempts >= max_attempts)
+        .values(status=JOB_FAILED, error="Heartbeat lost", finished_at=func.now())
+    )
+    candidate = (
+        select(SimilarityJob.id)
+        .where(or_(SimilarityJob.status == JOB_PENDING, stale), same_run, SimilarityJob.attempts < max_attempts)
+        .order_by(SimilarityJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job = (
+        await session.execute(
+            update(SimilarityJob)
+            .where(SimilarityJob.id == candidate)
+            .values(
+                status=JOB_RUNNING,
+                worker_id=worker_id,
+                attempts=SimilarityJob.attempts + 1,
+                heartbeat_at=func.now(),
+                error=None,
+            )
+            .returning(
+                SimilarityJob.id,
+                SimilarityJob.run_id,
+                SimilarityJob.first_uuid,
+                SimilarityJob.last_uuid,
+                SimilarityJob.attempts,
+            )
+        )
+    ).one_or_none()
+    await session.commit()
+    return job
+
+
+async def heartbeat_similarity_job(session: AsyncSession, job_id: int, worker_id: str) -> bool:
+    """
+    Продлевает аренду задачи воркером.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - job_id: ID задачи.
+    - worker_id: Идентификатор воркера.
+
+    Возвращает:
+    - False, если задачу уже забрал другой воркер.
+    """
+    result = await session.execute(
+        update(SimilarityJob)
+        .where(SimilarityJob.id == job_id, SimilarityJob.worker_id == worker_id, SimilarityJob.status == JOB_RUNNING)
+        .values(heartbeat_at=func.now())
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def complete_similarity_job(session: AsyncSession, job_id: int, worker_id: str) -> bool:
+    """
+    Отмечает задачу выполненной. Фиксация транзакции остается за вызывающим кодом, чтобы
+    задача отмечалась вместе с записью похожих товаров.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - job_id: ID задачи.
+    - worker_id: Идентификатор воркера.
+
+    Возвращает:
+    - False, если задачу уже забрал другой воркер: результат нужно откатить.
+    """
+    result = await session.execute(
+        update(SimilarityJob)
+        .where(SimilarityJob.id == job_id, SimilarityJob.worker_id == worker_id, SimilarityJob.status == JOB_RUNNING)
+        .values(status=JOB_DONE, finished_at=func.now())
+    )
+    return result.rowcount == 1
+
+
+async def fail_similarity_job(
+    session: AsyncSession, job_id: int, worker_id: str, error: str, max_attempts: int
+) -> None:
+    """
+    Возвращает задачу в очередь после ошибки или помечает ее failed, если попытки исчерпаны.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - job_id: ID задачи.
+    - worker_id: Идентификатор воркера.
+    - error: Описание ошибки.
+    - max_attempts: Максимальное количество попыток выполнения задачи.
+    """
+    failed = SimilarityJob.attempts >= max_attempts
+    await session.execute(
+        update(SimilarityJob)
+        .where(SimilarityJob.id == job_id, SimilarityJob.worker_id == worker_id, SimilarityJob.status == JOB_RUNNING)
+        .values(
+            status=case((failed, JOB_FAILED), else_=JOB_PENDING),
+            finished_at=case((failed, func.now()), else_=None),
+            error=error,
+        )
+    )
+    await session.commit()
+
+
+async def count_similarity_jobs(session: AsyncSession, run_id: str) -> dict[str, int]:
+    """
+    Считает задачи прохода поиска похожих по статусам.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - run_id: Проход поиска похожих.
+
+    Возвращает:
+    - Словарь статус -> количество задач.
+    """
+    rows = await session.execute(
+        select(SimilarityJob.status, func.count()).where(SimilarityJob.run_id == run_id).group_by(SimilarityJob.status)
+    )
+    return {status: count for status, count in rows.all()}
+
+
+async def get_sku_ids_in_range(session: AsyncSession, first_uuid: uuid.UUID, last_uuid: uuid.UUID) -> list[uuid.UUID]:
+    """
+    Выбирает UUID активных SKU из диапазона задачи поиска похожих.
+
+    Параметры:
+    - session: Асинхронная сессия SQLAlchemy.
+    - first_uuid, last_uuid: Границы диапазона включительно.
+
+    Возвращает:
+    - Список UUID по возрастанию.
+    """
+    query = select(SKU.uuid).where(SKU.uuid.between(first_uuid, last_uuid), SKU.deleted_at.is_(None)).order_by(SKU.uuid)
+    return list((await session.scalars(query)).all())
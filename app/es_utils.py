@@ -1,7 +1,120 @@
+import asyncio
+import logging
+import time
 import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterable, NamedTuple, Sequence
 
 from elasticsearch import AsyncElasticsearch
 
+from app.attributes import ATTRIBUTE_KEYS
+from app.metrics import BLOCK_LEVELS, STAGE_ES_INDEX, STAGE_ES_SEARCH, in_flight, observe, record_errors, track
+from app.utils import abatched
+
+logger = logging.getLogger(__name__)
+
+# Алиас, через который приложение читает индекс товаров. Сами данные лежат
+# в версионированных индексах sku_<дата и время загрузки>.
+SKU_ALIAS = "sku"
+
+# Настройки индекса товаров в обычном режиме работы
+SKU_INDEX_SETTINGS = {"number_of_shards": 1}
+
+# Явная схема индекса с русским анализатором для текстовых полей. Характеристики хранятся
+# одним текстовым полем, а неизвестные поля не индексируются, поэтому количество полей
+# не растет вместе с каталогом. Для текстовых полей, по которым работает "more_like_this",
+# хранятся векторы терминов: запросу не нужно заново анализировать исходный текст документа.
+SKU_INDEX_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "marketplace_id": {"type": "integer"},
+        "product_id": {"type": "long"},
+        "title": {"type": "text", "analyzer": "russian", "term_vector": "yes"},
+        "description": {"type": "text", "analyzer": "russian", "term_vector": "yes"},
+        "brand": {
+            "type": "text",
+            "analyzer": "russian",
+            "term_vector": "yes",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+        },
+        "features": {"type": "text", "analyzer": "russian", "term_vector": "yes"},
+        "seller_id": {"type": "integer"},
+        "seller_name": {"type": "keyword", "ignore_above": 256},
+        "first_image_url": {"type": "keyword", "index": False},
+        "category_id": {"type": "integer"},
+        "category_lvl_1": {"type": "keyword"},
+        "category_lvl_2": {"type": "keyword"},
+        "category_lvl_3": {"type": "keyword"},
+        "category_remaining": {"type": "keyword"},
+        "rating_count": {"type": "integer"},
+        "rating_value": {"type": "float"},
+        "price_before_discounts": {"type": "float"},
+        "discount": {"type": "float"},
+        "price_after_discounts": {"type": "float"},
+        "bonuses": {"type": "integer"},
+        "sales": {"type": "integer"},
+        "currency": {"type": "keyword"},
+        "barcode": {"type": "keyword"},
+        "attributes": {
+            "properties": {
+                "storage_gb": {"type": "float"},
+                "ram_gb": {"type": "float"},
+                "screen_in": {"type": "float"},
+                "model_code": {"type": "keyword"},
+                "color": {"type": "keyword"},
+            }
+        },
+    },
+}
+
+# Количество похожих товаров, которое ищется для каждого SKU
+SIMILAR_SKUS_LIMIT = 5
+
+# Поля документа, по которым строятся блоки кандидатов (см. build_block_levels) и сигналы совпадения атрибутов
+BLOCK_FIELDS = ["category_lvl_1", "category_lvl_2", "category_lvl_3", "brand", "price_after_discounts", "attributes"]
+
+
+class BlockingOptions(NamedTuple):
+    """
+    Параметры блокировки при поиске похожих товаров.
+
+    - enabled: Искать похожие среди товаров того же блока (категория, бренд, ценовой диапазон),
+      а не по всему индексу.
+    - price_band: Во сколько раз цена кандидата может отличаться от цены товара (больше 1).
+    - min_hits: Если в блоке найдено меньше похожих товаров, поиск повторяется в более широком блоке.
+    """
+
+    enabled: bool = True
+    price_band: float = 2.0
+    min_hits: int = SIMILAR_SKUS_LIMIT
+
+
+class MltOptions(NamedTuple):
+    """
+    Параметры запроса "more_like_this" (см. документацию Elasticsearch).
+
+    - fields: Поля, по которым отбираются термины и ищутся похожие товары.
+    - size: Количество похожих товаров, которое ищется для каждого SKU.
+    - min_term_freq: Минимальная частота термина в документе SKU.
+    - min_doc_freq: Минимальное количество документов индекса с термином.
+    - max_doc_freq: Максимальное количество документов индекса с термином (None — без ограничения).
+    - max_query_terms: Максимальное количество терминов с наибольшим tf-idf в запросе.
+    - minimum_should_match: Доля терминов запроса, которые должны быть в похожем товаре.
+    - attribute_boost: Прибавка к оценке кандидата за каждый совпавший атрибут товара (память, диагональ,
+      код модели, цвет; см. app.attributes). 0 — атрибуты не учитываются.
+
+    Подобрать параметры под качество и пропускную способность помогает benchmarks.tune_similarity.
+    """
+
+    fields: tuple[str, ...] = ("title", "description", "brand", "features")
+    size: int = SIMILAR_SKUS_LIMIT
+    min_term_freq: int = 1
+    min_doc_freq: int = 5
+    max_doc_freq: int | None = None
+    max_query_terms: int = 12
+    minimum_should_match: str = "30%"
+    attribute_boost: float = 5.0
+
 
 async def init_es(es_url: str) -> AsyncElasticsearch:
     """
@@ -18,20 +131,31 @@ async def init_es(es_url: str) -> AsyncElasticsearch:
     return es_client
 
 
-async def index_in_elasticsearch(es_client: AsyncElasticsearch, sku) -> None:
+def features_to_text(features: dict | None) -> str:
     """
-    Индексирует SKU (товар) в Elasticsearch.
+    Объединяет характеристики товара в один текст "название значение; ...".
+
+    Args:
+        features (dict | None): Характеристики товара.
+
+    Returns:
+        str: Текст характеристик.
+    """
+    return "; ".join(f"{key} {value}" for key, value in (features or {}).items())
+
+
+def sku_to_document(sku) -> dict:
+    """
+    Преобразует SKU в документ для индексации в Elasticsearch.
 
     Args:
-        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
         sku: Объект SKU, содержащий данные для индексации, включая такие поля, как marketplace_id,
         title, description и т.д.
 
     Returns:
-        None
+        dict: Тело документа Elasticsearch.
     """
-    # Подготавливаем данные для индексации
-    data = {
+    return {
         "marketplace_id": sku.marketplace_id,
         "product_id": sku.product_id,
         "title": sku.title,
@@ -45,7 +169,7 @@ async def index_in_elasticsearch(es_client: AsyncElasticsearch, sku) -> None:
         "category_lvl_2": sku.category_lvl_2,
         "category_lvl_3": sku.category_lvl_3,
         "category_remaining": sku.category_remaining,
-        "features": sku.features,
+        "features": features_to_text(sku.features),
         "rating_count": sku.rating_count,
         "rating_value": sku.rating_value,
         "price_before_discounts": sku.price_before_discounts,
@@ -55,49 +179,592 @@ async def index_in_elasticsearch(es_client: AsyncElasticsearch, sku) -> None:
         "sales": sku.sales,
         "currency": sku.currency,
         "barcode": sku.barcode,
+        "attributes": sku.attributes or {},
     }
 
+
+async def index_in_elasticsearch(es_client: AsyncElasticsearch, sku) -> None:
+    """
+    Индексирует SKU (товар) в Elasticsearch.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        sku: Объект SKU, содержащий данные для индексации, включая такие поля, как marketplace_id,
+        title, description и т.д.
+
+    Returns:
+        None
+    """
+    # Подготавливаем данные для индексации
+    data = sku_to_document(sku)
+
     try:
         # Индексация документа в Elasticsearch
-        await es_client.index(index="sku", id=str(sku.uuid), document=data)
-        print(f"{'_' * 29} Successfully indexed SKU {sku.uuid}")
+        with track(STAGE_ES_INDEX):
+            await es_client.index(index=SKU_ALIAS, id=str(sku.uuid), document=data)
+        logger.debug("Successfully indexed SKU %s", sku.uuid)
     except Exception as e:
         # Обработка ошибок при индексации
-        print(f"Failed to index SKU {sku.uuid}: {e}")
+        logger.warning("Failed to index SKU %s: %s", sku.uuid, e)
 
 
-async def find_similar_skus(es_client: AsyncElasticsearch, sku) -> list[uuid.UUID]:
+async def bulk_index_in_elasticsearch(
+    es_client: AsyncElasticsearch,
+    skus: AsyncIterable,
+    chunk_size: int = 500,
+    max_concurrency: int = 4,
+    index: str = SKU_ALIAS,
+) -> tuple[int, int]:
     """
-    Находит похожие SKU с помощью запроса "more_like_this" в Elasticsearch.
+    Индексирует поток SKU в Elasticsearch пачками через Bulk API.
+
+    Пачки отправляются параллельно, но одновременно в полёте находится не более max_concurrency
+    запросов: пока все слоты заняты, чтение следующих SKU из потока приостанавливается.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        skus (AsyncIterable): Асинхронный поток объектов SKU.
+        chunk_size (int): Количество документов в одном bulk-запросе.
+        max_concurrency (int): Максимальное количество одновременных bulk-запросов.
+        index (str): Индекс или алиас, в который записываются документы.
+
+    Returns:
+        tuple[int, int]: Количество успешно проиндексированных и количество неудачных документов.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: set[asyncio.Task] = set()
+    indexed = 0
+    failed = 0
+
+    async def send(operations: list[dict], size: int) -> None:
+        nonlocal indexed, failed
+        started = time.perf_counter()
+        try:
+            with in_flight("es_bulk"):
+                response = await es_client.bulk(index=index, operations=operations)
+            errors = 0
+            if response.get("errors"):
+                for item in response["items"]:
+                    result = item.get("index", {})
+                    if "error" in result:
+                        errors += 1
+                        logger.warning("Failed to index SKU %s: %s", result.get("_id"), result["error"])
+            indexed += size - errors
+            failed += errors
+            observe(STAGE_ES_INDEX, time.perf_counter() - started, size - errors)
+            record_errors(STAGE_ES_INDEX, errors)
+        except Exception as e:
+            # Ошибка всего запроса: считаем неудачными все документы пачки
+            failed += size
+            record_errors(STAGE_ES_INDEX, size)
+            logger.error("Failed to bulk index %d SKUs: %r", size, e)
+        finally:
+            semaphore.release()
+
+    async for chunk in abatched(skus, chunk_size):
+        operations = []
+        for sku in chunk:
+            operations.append({"index": {"_id": str(sku.uuid)}})
+            operations.append(sku_to_document(sku))
+
+        # Ждем свободный слот, прежде чем читать дальше
+        await semaphore.acquire()
+        task = asyncio.create_task(send(operations, len(chunk)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    logger.info("Bulk indexed %d SKUs, failed %d", indexed, failed)
+    return indexed, failed
+
+
+async def delete_from_elasticsearch(
+    es_client: AsyncElasticsearch, sku_ids: Sequence[uuid.UUID], chunk_size: int = 500
+) -> None:
+    """
+    Удаляет SKU из индекса Elasticsearch пачками через Bulk API.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        sku_ids (Sequence[uuid.UUID]): UUID удаляемых SKU.
+        chunk_size (int): Количество операций в одном bulk-запросе.
+
+    Returns:
+        None
+    """
+    for start in range(0, len(sku_ids), chunk_size):
+        end = start + chunk_size
+        operations = [{"delete": {"_id": str(sku_id)}} for sku_id in sku_ids[start:end]]
+        try:
+            response = await es_client.bulk(index=SKU_ALIAS, operations=operations)
+            if response.get("errors"):
+                for item in response["items"]:
+                    result = item.get("delete", {})
+                    if "error" in result:
+                        logger.warning("Failed to delete SKU %s: %s", result.get("_id"), result["error"])
+        except Exception as e:
+            logger.error("Failed to bulk delete %d SKUs: %r", len(operations), e)
+
+
+async def refresh_index(es_client: AsyncElasticsearch, index: str = SKU_ALIAS) -> None:
+    """
+    Делает проиндексированные документы доступными для поиска.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        index (str): Индекс или алиас.
+
+    Returns:
+        None
+    """
+    await es_client.indices.refresh(index=index)
+
+
+def new_sku_index_name() -> str:
+    """
+    Формирует имя нового версионированного индекса товаров.
+
+    Returns:
+        str: Имя вида sku_20241003114157.
+    """
+    return f"{SKU_ALIAS}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+
+
+async def create_sku_index(es_client: AsyncElasticsearch, index: str, loading: bool = False) -> None:
+    """
+    Создает индекс товаров с явной схемой.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        index (str): Имя индекса.
+        loading (bool): Создать индекс для массовой загрузки: без реплик и без периодического refresh.
+            После загрузки настройки возвращаются finish_index_load.
+
+    Returns:
+        None
+    """
+    settings = dict(SKU_INDEX_SETTINGS)
+    if loading:
+        settings.update({"number_of_replicas": 0, "refresh_interval": "-1"})
+    await es_client.indices.create(index=index, settings=settings, mappings=SKU_INDEX_MAPPINGS)
+    logger.info("Created index %s", index)
+
+
+async def ensure_sku_index(es_client: AsyncElasticsearch) -> None:
+    """
+    Создает индекс товаров с явной схемой и алиасом sku, если алиаса еще нет.
+
+    Индекс sku, созданный до перехода на алиасы, переносится в новый версионированный индекс
+    через _reindex и заменяется алиасом (см. swap_alias), иначе инкрементальная и поточная загрузки
+    продолжили бы писать в индекс без схемы загрузки.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+
+    Returns:
+        None
+    """
+    if await es_client.indices.exists_alias(name=SKU_ALIAS):
+        return
+    index = new_sku_index_name()
+    await create_sku_index(es_client, index)
+    if await es_client.indices.exists(index=SKU_ALIAS):
+        logger.info("Migrating index %s to %s behind alias %s", SKU_ALIAS, index, SKU_ALIAS)
+        response = await es_client.reindex(
+            source={"index": SKU_ALIAS}, dest={"index": index}, wait_for_completion=True, refresh=True
+        )
+        if response.get("failures"):
+            await es_client.indices.delete(index=index)
+            raise RuntimeError(f"Failed to migrate index {SKU_ALIAS} to {index}: {response['failures'][:5]}")
+    await swap_alias(es_client, index)
+
+
+async def finish_index_load(es_client: AsyncElasticsearch, index: str, replicas: int = 0) -> None:
+    """
+    Готовит индекс после массовой загрузки к чтению: возвращает периодический refresh и реплики,
+    делает документы видимыми и сливает сегменты в один.
+
+    Слитый индекс больше не меняется до следующей полной загрузки, поэтому один сегмент
+    ускоряет поисковые запросы и не приводит к повторным слияниям.
 
     Args:
         es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
-        sku: Объект SKU, для которого необходимо найти похожие элементы.
+        index (str): Имя индекса.
+        replicas (int): Количество реплик индекса после загрузки.
 
     Returns:
-        list[uuid.UUID]: Список UUID похожих SKU.
+        None
+    """
+    await es_client.indices.put_settings(
+        index=index, settings={"index": {"refresh_interval": None, "number_of_replicas": replicas}}
+    )
+    await refresh_index(es_client, index)
+    started = time.perf_counter()
+    await es_client.options(request_timeout=3600).indices.forcemerge(index=index, max_num_segments=1)
+    logger.info("Force-merged index %s in %.1f s", index, time.perf_counter() - started)
+
+
+async def swap_alias(es_client: AsyncElasticsearch, index: str, delete_old: bool = True) -> list[str]:
     """
-    # Формируем запрос "more_like_this" для поиска похожих товаров
-    query = {
-        "size": 5,
-        "query": {
-            "more_like_this": {
-                "fields": ["title", "description", "brand", "features"],
-                "like": [{"_id": str(sku.uuid)}],
-                "min_term_freq": 1,
-                "max_query_terms": 12,
+    Атомарно переключает алиас sku на индекс index.
+
+    Индексы, на которые алиас указывал раньше, убираются из алиаса тем же запросом, поэтому
+    читатели всегда видят ровно один полный индекс. Индекс sku, созданный до перехода
+    на алиасы, удаляется тем же запросом (remove_index).
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        index (str): Имя индекса, на который переключается алиас.
+        delete_old (bool): Удалить индексы, на которые алиас указывал раньше.
+
+    Returns:
+        list[str]: Имена индексов, на которые алиас указывал раньше.
+    """
+    actions = [{"add": {"index": index, "alias": SKU_ALIAS}}]
+    old_indices = []
+    if await es_client.indices.exists_alias(name=SKU_ALIAS):
+        response = await es_client.indices.get_alias(name=SKU_ALIAS)
+        old_indices = [name for name in response.keys() if name != index]
+        actions = [{"remove": {"index": name, "alias": SKU_ALIAS}} for name in old_indices] + actions
+    elif await es_client.indices.exists(index=SKU_ALIAS):
+        actions.insert(0, {"remove_index": {"index": SKU_ALIAS}})
+
+    await es_client.indices.update_aliases(actions=actions)
+    logger.info("Switched alias %s to %s", SKU_ALIAS, index)
+
+    if delete_old and old_indices:
+        await es_client.indices.delete(index=",".join(old_indices))
+        logger.info("Deleted old indices %s", ", ".join(old_indices))
+    return old_indices
+
+
+async def delete_stale_indices(es_client: AsyncElasticsearch, indices: list[str]) -> list[str]:
+    """
+    Удаляет индексы брошенных загрузок. Индексы, на которые указывает алиас sku, и несуществующие
+    индексы пропускаются.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        indices (list[str]): Имена индексов.
+
+    Returns:
+        list[str]: Имена удаленных индексов.
+    """
+    aliased = set()
+    if await es_client.indices.exists_alias(name=SKU_ALIAS):
+        aliased = set((await es_client.indices.get_alias(name=SKU_ALIAS)).keys())
+    stale = [index for index in dict.fromkeys(indices) if index not in aliased]
+    stale = [index for index in stale if await es_client.indices.exists(index=index)]
+    if stale:
+        await es_client.indices.delete(index=",".join(stale))
+        logger.info("Deleted indices of abandoned loads %s", ", ".join(stale))
+    return stale
+
+
+def build_block_levels(document: dict | None, options: BlockingOptions = BlockingOptions()) -> list[list[dict]]:
+    """
+    Формирует фильтры блоков кандидатов для товара, от самого узкого блока к самому широкому:
+
+    1. самая глубокая известная категория товара, бренд и ценовой диапазон;
+    2. категория и ценовой диапазон;
+    3. категория;
+    4. категория первого уровня.
+
+    Категория задается всем путем category_lvl_1..3, поэтому одноименные подкатегории разных
+    разделов не смешиваются. Признаки, которых у товара нет, в фильтры не попадают, а одинаковые
+    уровни объединяются. Пустой список фильтров означает поиск по всему индексу: так ищутся
+    похожие для товаров без категории, бренда и цены, а также при выключенной блокировке.
+
+    Args:
+        document (dict | None): Документ товара (достаточно полей BLOCK_FIELDS) или None, если он неизвестен.
+        options (BlockingOptions): Параметры блокировки.
+
+    Returns:
+        list[list[dict]]: Списки filter-условий запроса для каждого уровня.
+    """
+    if not options.enabled or document is None:
+        return [[]]
+
+    categories = []
+    for field in ("category_lvl_1", "category_lvl_2", "category_lvl_3"):
+        if not document.get(field):
+            break
+        categories.append({"term": {field: document[field]}})
+    brand = [{"term": {"brand.keyword": document["brand"]}}] if document.get("brand") else []
+    price = document.get("price_after_discounts")
+    band = []
+    if price and price > 0:
+        band = [
+            {
+                "range": {
+                    "price_after_discounts": {
+                        "gte": round(price / options.price_band, 2),
+                        "lte": round(price * options.price_band, 2),
+                    }
+                }
             }
-        },
+        ]
+
+    levels: list[list[dict]] = []
+    for filters in (categories + brand + band, categories + band, categories, categories[:1]):
+        if filters not in levels:
+            levels.append(filters)
+    return levels
+
+
+def build_mlt_query(
+    sku_id: uuid.UUID,
+    filters: list[dict] | None = None,
+    mlt: MltOptions = MltOptions(),
+    attributes: dict | None = None,
+) -> dict:
+    """
+    Формирует запрос "more_like_this" для поиска товаров, похожих на заданный SKU.
+
+    Атрибуты товара добавляются необязательными условиями: кандидат с тем же объемом памяти,
+    диагональю, кодом модели или цветом получает mlt.attribute_boost за каждое совпадение,
+    но кандидаты без совпадений не отбрасываются.
+
+    Args:
+        sku_id (uuid.UUID): UUID SKU, для которого необходимо найти похожие элементы.
+        filters (list[dict] | None): Фильтры блока кандидатов (см. build_block_levels). Фильтры
+            не влияют на оценку и сужают множество документов, которые оценивает "more_like_this".
+        mlt (MltOptions): Параметры запроса "more_like_this".
+        attributes (dict | None): Нормализованные атрибуты SKU (см. app.attributes.extract_attributes).
+
+    Returns:
+        dict: Тело поискового запроса.
+    """
+    more_like_this = {
+        "fields": list(mlt.fields),
+        "like": [{"_id": str(sku_id)}],
+        "min_term_freq": mlt.min_term_freq,
+        "min_doc_freq": mlt.min_doc_freq,
+        "max_query_terms": mlt.max_query_terms,
+        "minimum_should_match": mlt.minimum_should_match,
     }
+    if mlt.max_doc_freq is not None:
+        more_like_this["max_doc_freq"] = mlt.max_doc_freq
+    query = {"more_like_this": more_like_this}
+    should = []
+    if attributes and mlt.attribute_boost > 0:
+        should = [
+            {"constant_score": {"filter": {"term": {f"attributes.{key}": value}}, "boost": mlt.attribute_boost}}
+            for key, value in attributes.items()
+            if key in ATTRIBUTE_KEYS
+        ]
+    if filters or should:
+        query = {"bool": {"must": query}}
+        if filters:
+            query["bool"]["filter"] = filters
+        if should:
+            query["bool"]["should"] = should
+    return {"size": mlt.size, "query": query}
+
+
+def _merge_hits(
+    similar: list[tuple[uuid.UUID, float]], hits: list[dict], limit: int = SIMILAR_SKUS_LIMIT
+) -> list[tuple[uuid.UUID, float]]:
+    """
+    Дополняет похожие товары из более узкого блока результатами поиска в более широком блоке.
+    """
+    merged = list(similar)
+    seen = {sku_id for sku_id, _ in similar}
+    for hit in hits:
+        sku_id = uuid.UUID(hit["_id"])
+        if len(merged) >= limit:
+            break
+        if sku_id not in seen:
+            merged.append((sku_id, hit.get("_score") or 0.0))
+            seen.add(sku_id)
+    return merged
+
+
+async def get_block_documents(es_client: AsyncElasticsearch, sku_ids: Sequence[uuid.UUID]) -> dict[uuid.UUID, dict]:
+    """
+    Получает из индекса поля, по которым строятся блоки кандидатов, одним запросом _mget.
 
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        sku_ids (Sequence[uuid.UUID]): UUID SKU.
+
+    Returns:
+        dict[uuid.UUID, dict]: UUID SKU -> поля BLOCK_FIELDS документа. Отсутствующих в индексе SKU в словаре нет.
+    """
+    response = await es_client.mget(
+        index=SKU_ALIAS, ids=[str(sku_id) for sku_id in sku_ids], source_includes=BLOCK_FIELDS
+    )
+    return {uuid.UUID(doc["_id"]): doc.get("_source", {}) for doc in response["docs"] if doc.get("found")}
+
+
+async def find_similar_skus(
+    es_client: AsyncElasticsearch,
+    sku_id: uuid.UUID,
+    document: dict | None = None,
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+) -> list[tuple[uuid.UUID, float]]:
+    """
+    Находит похожие SKU с помощью запроса "more_like_this" в Elasticsearch.
+
+    Поиск начинается в самом узком блоке кандидатов и расширяется, пока не найдено
+    blocking.min_hits похожих товаров (см. build_block_levels). Совпадающие атрибуты товара
+    повышают оценку кандидатов (см. build_mlt_query).
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        sku_id (uuid.UUID): UUID SKU, для которого необходимо найти похожие элементы.
+        document (dict | None): Документ SKU для построения блоков и атрибутов. Если не задан,
+            поля BLOCK_FIELDS читаются из индекса.
+        blocking (BlockingOptions): Параметры блокировки.
+        mlt (MltOptions): Параметры запроса "more_like_this".
+
+    Returns:
+        list[tuple[uuid.UUID, float]]: Список пар (UUID похожего SKU, _score) в порядке выдачи.
+    """
     try:
-        # Выполнение поиска по индексу
-        response = await es_client.search(index="sku", body=query)
-        hits = response.get("hits", {}).get("hits", [])
-        similar = [uuid.UUID(hit["_id"]) for hit in hits]
-        print(f"{'_' * 29} Found {len(similar)} similar SKUs for {sku.uuid}")
+        if (blocking.enabled or mlt.attribute_boost > 0) and document is None:
+            document = (await get_block_documents(es_client, [sku_id])).get(sku_id)
+        attributes = document.get("attributes") if document else None
+
+        similar: list[tuple[uuid.UUID, float]] = []
+        for level, filters in enumerate(build_block_levels(document, blocking)):
+            # Формируем запрос "more_like_this" для поиска похожих товаров в блоке
+            query = build_mlt_query(sku_id, filters, mlt, attributes)
+
+            # Выполнение поиска по индексу
+            with track(STAGE_ES_SEARCH):
+                response = await es_client.search(index=SKU_ALIAS, body=query)
+            similar = _merge_hits(similar, response.get("hits", {}).get("hits", []), mlt.size)
+            if len(similar) >= blocking.min_hits:
+                break
+        BLOCK_LEVELS.labels(str(level)).inc()
+        logger.debug("Found %d similar SKUs for %s", len(similar), sku_id)
         return similar
     except Exception as e:
         # Обработка ошибок при поиске похожих товаров
-        print(f"Failed to search similar SKUs for {sku.uuid}: {e.__repr__()}")
+        logger.warning("Failed to search similar SKUs for %s: %r", sku_id, e)
         return []
+
+
+async def find_similar_skus_batch(
+    es_client: AsyncElasticsearch,
+    sku_ids: Sequence[uuid.UUID],
+    batch_size: int = 100,
+    max_concurrency: int = 4,
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+) -> tuple[dict[uuid.UUID, list[tuple[uuid.UUID, float]]], dict[uuid.UUID, str]]:
+    """
+    Находит похожие SKU для списка товаров, отправляя запросы "more_like_this" пачками через _msearch.
+
+    Поиск идет по блокам кандидатов (см. build_block_levels): сначала все SKU ищутся в самом
+    узком блоке, затем SKU, для которых найдено меньше blocking.min_hits похожих товаров, —
+    в следующем, более широком блоке, и так далее. Поля блоков читаются из индекса через _mget.
+
+    Пачки выполняются параллельно, одновременно в полёте находится не более max_concurrency запросов.
+
+    Args:
+        es_client (AsyncElasticsearch): Клиент Elasticsearch для взаимодействия с сервером.
+        sku_ids (Sequence[uuid.UUID]): UUID SKU, для которых необходимо найти похожие элементы.
+        batch_size (int): Количество поисковых запросов в одном _msearch.
+        max_concurrency (int): Максимальное количество одновременных _msearch-запросов.
+        blocking (BlockingOptions): Параметры блокировки.
+        mlt (MltOptions): Параметры запроса "more_like_this".
+
+    Returns:
+        tuple[dict[uuid.UUID, list[tuple[uuid.UUID, float]]], dict[uuid.UUID, str]]: Кортеж из двух словарей:
+            - similar: UUID SKU -> список пар (UUID похожего SKU, _score) в порядке выдачи
+              (только для успешных запросов);
+            - failed: UUID SKU -> описание ошибки для запросов, завершившихся неудачей.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    similar: dict[uuid.UUID, list[tuple[uuid.UUID, float]]] = {}
+    failed: dict[uuid.UUID, str] = {}
+    levels: dict[uuid.UUID, list[list[dict]]] = {}
+    attributes: dict[uuid.UUID, dict] = {}
+
+    async def fetch_levels(batch: Sequence[uuid.UUID]) -> None:
+        async with semaphore:
+            try:
+                documents = await get_block_documents(es_client, batch)
+            except Exception as e:
+                record_errors(STAGE_ES_SEARCH, len(batch))
+                for sku_id in batch:
+                    failed[sku_id] = e.__repr__()
+                return
+        for sku_id in batch:
+            document = documents.get(sku_id)
+            levels[sku_id] = build_block_levels(document, blocking)
+            if document and document.get("attributes"):
+                attributes[sku_id] = document["attributes"]
+
+    async def search(batch: Sequence[tuple[uuid.UUID, dict]]) -> None:
+        searches = []
+        for _, query in batch:
+            searches.append({})
+            searches.append(query)
+
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                with in_flight("es_search"):
+                    response = await es_client.msearch(index=SKU_ALIAS, searches=searches)
+            except Exception as e:
+                # Ошибка всего запроса: неудачными считаются все поиски пачки
+                record_errors(STAGE_ES_SEARCH, len(batch))
+                for sku_id, _ in batch:
+                    failed[sku_id] = e.__repr__()
+                    similar.pop(sku_id, None)
+                return
+
+        errors = 0
+        for (sku_id, _), result in zip(batch, response["responses"]):
+            if "error" in result:
+                failed[sku_id] = str(result["error"])
+                similar.pop(sku_id, None)
+                errors += 1
+                continue
+            hits = result.get("hits", {}).get("hits", [])
+            similar[sku_id] = _merge_hits(similar.get(sku_id, []), hits, mlt.size)
+        observe(STAGE_ES_SEARCH, time.perf_counter() - started, len(batch) - errors)
+        record_errors(STAGE_ES_SEARCH, errors)
+
+    def batched(items: Sequence) -> list[Sequence]:
+        batches = []
+        for start in range(0, len(items), batch_size):
+            end = start + batch_size
+            batches.append(items[start:end])
+        return batches
+
+    if blocking.enabled or mlt.attribute_boost > 0:
+        await asyncio.gather(*(fetch_levels(batch) for batch in batched(sku_ids)))
+    else:
+        levels = {sku_id: [[]] for sku_id in sku_ids}
+
+    # Каждый проход расширяет блок для SKU, которым не хватило похожих товаров в предыдущем
+    pending = [sku_id for sku_id in sku_ids if sku_id in levels and sku_id not in failed]
+    level = 0
+    while pending:
+        queries = [
+            (sku_id, build_mlt_query(sku_id, levels[sku_id][level], mlt, attributes.get(sku_id))) for sku_id in pending
+        ]
+        await asyncio.gather(*(search(batch) for batch in batched(queries)))
+
+        widen = []
+        for sku_id in pending:
+            if sku_id in failed:
+                continue
+            if len(similar[sku_id]) >= blocking.min_hits or level + 1 >= len(levels[sku_id]):
+                BLOCK_LEVELS.labels(str(level)).inc()
+            else:
+                widen.append(sku_id)
+        if widen:
+            logger.debug("Widening block to level %d for %d SKUs", level + 1, len(widen))
+        pending = widen
+        level += 1
+
+    logger.info("Found similar SKUs for %d SKUs, failed %d", len(similar), len(failed))
+    return similar, failed
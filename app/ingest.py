@@ -0,0 +1,589 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import AsyncGenerator, AsyncIterable
+
+from elasticsearch import AsyncElasticsearch
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.clustering import ClusteringOptions, ProductClusterer
+from app.db import (
+    copy_skus,
+    create_staging_tables,
+    delete_similar_skus,
+    enqueue_similarity_jobs,
+    find_referencing_skus,
+    iter_cluster_inputs,
+    load_checkpoint,
+    load_checkpoint_indices,
+    save_checkpoint,
+    save_product_clusters,
+    save_similar_skus,
+    soft_delete_missing_skus,
+    start_checkpoint,
+    upsert_skus,
+)
+from app.es_utils import (
+    BlockingOptions,
+    MltOptions,
+    bulk_index_in_elasticsearch,
+    create_sku_index,
+    delete_from_elasticsearch,
+    delete_stale_indices,
+    ensure_sku_index,
+    find_similar_skus_batch,
+    finish_index_load,
+    new_sku_index_name,
+    refresh_index,
+    swap_alias,
+)
+from app.metrics import STAGE_CLUSTERING, STAGE_SIMILARITY, track
+from app.models import IngestCheckpoint
+from app.parser import CategoryPath, OfferRecord, ParseOptions, iter_offer_batches, parse_xml_batches
+from app.pipeline import PipelineOptions, Stage, run_pipeline
+from app.tfidf import MAX_DF, TfidfIndex, find_similar_skus_tfidf, sku_to_text
+from app.utils import aiterate
+from app.worker import WorkerOptions, run_similarity_jobs
+
+logger = logging.getLogger(__name__)
+
+
+async def ingest_stream(
+    engine: AsyncEngine,
+    es_client: AsyncElasticsearch,
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    chunk_size: int = 500,
+    db_batch_size: int = 1000,
+    search_batch_size: int = 100,
+    parse_options: ParseOptions = ParseOptions(),
+    pipeline_options: PipelineOptions = PipelineOptions(),
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+) -> None:
+    """
+    Поточная загрузка: пачки офферов проходят конвейер этапов, и похожие для пачки ищутся сразу
+    после ее индексации, не дожидаясь загрузки всего фида.
+
+    Этапы работают одновременно и соединены ограниченными очередями (см. run_pipeline):
+    1. Парсинг фида в отдельном потоке (или в процессах при parse_options.workers > 0).
+    2. Запись пачки в БД через COPY.
+    3. Индексация пачки в Elasticsearch bulk-запросами.
+    4. Поиск похожих для пачки через _msearch и запись их в sku_similarity.
+
+    Пока БД пишет одну пачку, Elasticsearch индексирует предыдущую и ищет похожие для еще более
+    ранней, а парсер готовит следующую. Если какой-то этап не успевает, очереди перед ним
+    заполняются и парсер ждет.
+
+    Похожие для пачки ищутся среди уже проиндексированных товаров, поэтому результат, как и раньше,
+    зависит от порядка офферов в фиде.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - es_client: Клиент Elasticsearch.
+    - file_path: Путь к XML-файлу.
+    - category_paths: Таблица путей категорий (см. build_category_paths).
+    - chunk_size: Количество документов в одном bulk-запросе.
+    - db_batch_size: Количество офферов в пачке конвейера.
+    - search_batch_size: Количество поисковых запросов в одном _msearch.
+    - parse_options: Параметры парсинга фида.
+    - pipeline_options: Количество одновременных операций каждого этапа и вместимость очередей.
+    - blocking: Параметры блокировки при поиске похожих.
+    - mlt: Параметры запроса "more_like_this".
+    """
+    await ensure_sku_index(es_client)
+
+    async def write_db(batch: list[OfferRecord]) -> list[OfferRecord]:
+        async with engine.connect() as conn:
+            await copy_skus(conn, batch)
+        return batch
+
+    index_failures = 0
+
+    async def index_es(batch: list[OfferRecord]) -> list[OfferRecord]:
+        nonlocal index_failures
+        _, failed = await bulk_index_in_elasticsearch(
+            es_client, aiterate(batch), chunk_size=chunk_size, max_concurrency=1
+        )
+        if failed:
+            index_failures += failed
+            logger.warning("Failed to index %d SKUs of batch, %d in total", failed, index_failures)
+        return batch
+
+    async def search_similar(batch: list[OfferRecord]) -> None:
+        # Пачка становится видимой для поиска после refresh
+        await refresh_index(es_client)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            await _search_and_save_similar(
+                session, es_client, [sku.uuid for sku in batch], search_batch_size, 1, blocking=blocking, mlt=mlt
+            )
+
+    if parse_options.workers > 0:
+        batches = parse_xml_batches(file_path, category_paths, db_batch_size, parse_options)
+    else:
+        batches = iter_offer_batches(file_path, category_paths, db_batch_size)
+
+    await run_pipeline(
+        batches,
+        [
+            Stage("db_write", write_db, pipeline_options.db_writers),
+            Stage("es_index", index_es, pipeline_options.es_writers),
+            Stage("similarity", search_similar, pipeline_options.similarity_workers),
+        ],
+        queue_size=pipeline_options.queue_size,
+    )
+    if index_failures:
+        logger.warning("Stream ingest finished, %d SKUs are missing from the index", index_failures)
+
+
+async def _copy_skus(
+    conn: AsyncConnection, batches: AsyncIterable[list[OfferRecord]]
+) -> AsyncGenerator[OfferRecord, None]:
+    """
+    Записывает пачки SKU в БД через COPY (одна транзакция на пачку) и передает SKU дальше по потоку.
+    """
+    total = 0
+    async for batch in batches:
+        total += await copy_skus(conn, batch)
+        logger.info("Copied %d SKUs to database", total)
+        for sku in batch:
+            yield sku
+
+
+async def _copy_and_index_skus(
+    conn: AsyncConnection,
+    es_client: AsyncElasticsearch,
+    batches: AsyncIterable[list[OfferRecord]],
+    checkpoint_path: str,
+    index: str,
+    chunk_size: int,
+    max_concurrency: int,
+) -> None:
+    """
+    Индексирует пачки SKU в Elasticsearch и записывает их в БД, отмечая каждую пачку в чекпоинте.
+
+    Пачка фиксируется в БД вместе с чекпоинтом только после индексации, поэтому все офферы
+    до отметки чекпоинта гарантированно есть и в БД, и в индексе. Если часть документов пачки
+    не проиндексирована, загрузка прерывается до записи пачки в БД, и при продолжении пачка
+    индексируется повторно под тем же _id.
+    """
+    async for batch in batches:
+        _, failed = await bulk_index_in_elasticsearch(
+            es_client, aiterate(batch), chunk_size=chunk_size, max_concurrency=max_concurrency, index=index
+        )
+        if failed:
+            raise RuntimeError(
+                f"Failed to index {failed} SKUs of batch up to offer "
+                f"{batch[-1].marketplace_id}/{batch[-1].product_id}, checkpoint is not advanced"
+            )
+        await copy_skus(conn, batch, checkpoint_path=checkpoint_path)
+        logger.info("Committed batch up to offer %d/%d", batch[-1].marketplace_id, batch[-1].product_id)
+
+
+async def _search_and_save_similar(
+    session: AsyncSession,
+    es_client: AsyncElasticsearch,
+    sku_ids: list[uuid.UUID],
+    search_batch_size: int,
+    search_concurrency: int,
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+) -> dict[uuid.UUID, list[tuple[uuid.UUID, float]]]:
+    """
+    Ищет похожие SKU для страницы товаров через Elasticsearch, сохраняет и возвращает результат.
+    """
+    similar, failed = await find_similar_skus_batch(
+        es_client,
+        sku_ids,
+        batch_size=search_batch_size,
+        max_concurrency=search_concurrency,
+        blocking=blocking,
+        mlt=mlt,
+    )
+    for sku_id, error in failed.items():
+        logger.warning("Failed to search similar SKUs for %s: %s", sku_id, error)
+    await save_similar_skus(session, similar)
+    await session.commit()
+    return similar
+
+
+async def _similarity_pass_es(
+    engine: AsyncEngine,
+    es_client: AsyncElasticsearch,
+    run_id: str,
+    unit_size: int,
+    workers: int,
+    options: WorkerOptions,
+) -> None:
+    """
+    Ищет похожие SKU для всех товаров БД через Elasticsearch.
+
+    Товары разбиваются на задачи в таблице similarity_job, которые выполняют локальные воркеры
+    и воркеры других процессов (см. app.worker). Задачи прохода создаются один раз, поэтому
+    продолжение прерванной загрузки выполняет только невыполненные задачи.
+    """
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        total = await enqueue_similarity_jobs(session, run_id, unit_size)
+    logger.info("Similarity pass %s: %d jobs of up to %d SKUs", run_id, total, unit_size)
+    await run_similarity_jobs(engine, es_client, run_id, workers, options)
+
+
+def _feed_stat(file_path: str) -> tuple[int, float]:
+    """
+    Возвращает размер и время изменения файла фида, по которым чекпоинт привязывается к версии файла.
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+
+async def discard_checkpoint_indices(
+    engine: AsyncEngine, es_client: AsyncElasticsearch, file_path: str | None = None
+) -> list[str]:
+    """
+    Удаляет индексы Elasticsearch незавершенных загрузок, которые не будут продолжены.
+
+    Вызывается перед тем, как чекпоинты прерванных загрузок теряются: перед удалением таблиц
+    и перед созданием нового чекпоинта фида. Иначе каждый прерванный запуск оставлял бы
+    полный индекс sku_<дата и время>, на который не указывает алиас.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - es_client: Клиент Elasticsearch.
+    - file_path: Путь к файлу фида. Если не задан, удаляются индексы чекпоинтов всех фидов.
+
+    Возвращает:
+    - Имена удаленных индексов.
+    """
+    async with AsyncSession(engine) as session:
+        indices = await load_checkpoint_indices(session, file_path)
+    return await delete_stale_indices(es_client, indices)
+
+
+async def find_resumable_checkpoint(engine: AsyncEngine, file_path: str) -> IngestCheckpoint | None:
+    """
+    Ищет чекпоинт прерванной загрузки того же файла фида.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - file_path: Путь к файлу фида.
+
+    Возвращает:
+    - Чекпоинт или None, если загрузку нужно начать заново.
+    """
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        checkpoint = await load_checkpoint(session, file_path, *_feed_stat(file_path))
+    if checkpoint is not None:
+        logger.info(
+            "Resuming ingest of %s: %d offers done, loaded=%s", file_path, checkpoint.offers_done, checkpoint.loaded
+        )
+    return checkpoint
+
+
+async def _save_similar(
+    engine: AsyncEngine, similar: dict[uuid.UUID, list[tuple[uuid.UUID, float]]], page_size: int
+) -> None:
+    """
+    Сохраняет заранее вычисленные похожие SKU в БД постранично.
+    """
+    items = list(similar.items())
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        for start in range(0, len(items), page_size):
+            end = start + page_size
+            await save_similar_skus(session, dict(items[start:end]))
+            await session.commit()
+
+
+async def ingest_bulk(
+    engine: AsyncEngine,
+    es_client: AsyncElasticsearch | None,
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    chunk_size: int = 500,
+    max_concurrency: int = 4,
+    db_batch_size: int = 5000,
+    search_batch_size: int = 100,
+    search_concurrency: int = 4,
+    similarity_backend: str = "es",
+    tfidf_block_size: int = 256,
+    tfidf_workers: int | None = None,
+    tfidf_max_df: float = MAX_DF,
+    parse_options: ParseOptions = ParseOptions(),
+    checkpoint: IngestCheckpoint | None = None,
+    es_replicas: int = 0,
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+    similarity_workers: int = 1,
+    worker_options: WorkerOptions = WorkerOptions(),
+) -> None:
+    """
+    Двухфазная загрузка.
+
+    1. Все офферы записываются в БД через COPY и индексируются для поиска похожих.
+    2. После загрузки всего фида для каждого SKU ищутся похожие товары.
+
+    Поиск похожих выполняется по полностью загруженному индексу, поэтому результат
+    не зависит от порядка офферов в фиде.
+
+    Бэкенд поиска похожих задается параметром similarity_backend:
+    - es: офферы индексируются в Elasticsearch bulk-запросами, после единственного refresh
+      похожие ищутся запросами "more_like_this" через _msearch;
+    - tfidf: Elasticsearch не используется, похожие вычисляются в процессе по матрице TF-IDF.
+
+    С бэкендом es загрузка возобновляемая: прогресс обеих фаз записывается в таблицу
+    ingest_checkpoint в тех же транзакциях, что и данные. Если передан чекпоинт прерванного
+    запуска (см. find_resumable_checkpoint), загрузка продолжается с последней записанной пачки.
+    Офферы при этом парсятся строго в порядке файла. Бэкенд tfidf всегда считает весь каталог заново.
+
+    Бэкенд es загружает офферы в новый версионированный индекс без реплик и без периодического
+    refresh. После загрузки индекс сливается в один сегмент, и алиас sku атомарно переключается
+    на него: до этого момента читатели работают с индексом предыдущей загрузки.
+
+    Поиск похожих бэкендом es разбит на задачи по db_batch_size товаров в таблице similarity_job:
+    их выполняют similarity_workers воркеров этого процесса и любое количество воркеров
+    в других процессах и контейнерах (python -m app.worker).
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - es_client: Клиент Elasticsearch. Не используется бэкендом tfidf.
+    - file_path: Путь к XML-файлу.
+    - category_paths: Таблица путей категорий (см. build_category_paths).
+    - chunk_size: Количество документов в одном bulk-запросе.
+    - max_concurrency: Максимальное количество одновременных bulk-запросов.
+    - db_batch_size: Количество строк в одной транзакции COPY.
+    - search_batch_size: Количество поисковых запросов в одном _msearch.
+    - search_concurrency: Максимальное количество одновременных _msearch-запросов.
+    - similarity_backend: Бэкенд поиска похожих: es или tfidf.
+    - tfidf_block_size: Количество строк матрицы TF-IDF в одной задаче воркера.
+    - tfidf_workers: Количество процессов для вычисления TF-IDF. По умолчанию — количество ядер.
+    - tfidf_max_df: Доля документов, при превышении которой термин не учитывается в TF-IDF.
+    - parse_options: Параметры парсинга фида.
+    - checkpoint: Чекпоинт прерванной загрузки этого фида (только для бэкенда es).
+    - es_replicas: Количество реплик индекса после загрузки.
+    - blocking: Параметры блокировки при поиске похожих (только для бэкенда es).
+    - mlt: Параметры запроса "more_like_this" (только для бэкенда es).
+    - similarity_workers: Количество воркеров поиска похожих в этом процессе (только для бэкенда es).
+    - worker_options: Параметры воркеров поиска похожих. Параметры поиска берутся из search_batch_size,
+      search_concurrency, blocking и mlt.
+    """
+    if similarity_backend == "es":
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            if checkpoint is None:
+                await discard_checkpoint_indices(engine, es_client, file_path)
+                es_index = new_sku_index_name()
+                await create_sku_index(es_client, es_index, loading=True)
+                checkpoint = await start_checkpoint(session, file_path, *_feed_stat(file_path), es_index=es_index)
+
+            # Фаза 1: загрузка всех офферов
+            if not checkpoint.loaded:
+                batches = parse_xml_batches(
+                    file_path,
+                    category_paths,
+                    db_batch_size,
+                    parse_options._replace(ordered=True),
+                    resume_after=checkpoint.resume_after,
+                )
+                async with engine.connect() as conn:
+                    await _copy_and_index_skus(
+                        conn, es_client, batches, checkpoint.feed_path, checkpoint.es_index, chunk_size, max_concurrency
+                    )
+                await finish_index_load(es_client, checkpoint.es_index, replicas=es_replicas)
+                await swap_alias(es_client, checkpoint.es_index)
+                await save_checkpoint(session, checkpoint.feed_path, loaded=True)
+                await session.commit()
+
+            # Фаза 2: поиск похожих товаров по полному индексу
+            worker_options = worker_options._replace(
+                search_batch_size=search_batch_size, search_concurrency=search_concurrency, blocking=blocking, mlt=mlt
+            )
+            await _similarity_pass_es(
+                engine, es_client, checkpoint.es_index, db_batch_size, similarity_workers, worker_options
+            )
+            await save_checkpoint(session, checkpoint.feed_path, completed_at=func.now())
+            await session.commit()
+
+    elif similarity_backend == "tfidf":
+        # Фаза 1: загрузка всех офферов и накопление текстов для TF-IDF
+        batches = parse_xml_batches(file_path, category_paths, db_batch_size, parse_options)
+        index = TfidfIndex()
+        async with engine.connect() as conn:
+            async for sku in _copy_skus(conn, batches):
+                index.add(sku.uuid, sku_to_text(sku))
+
+        # Фаза 2: вычисление похожих товаров по всему каталогу
+        with track(STAGE_SIMILARITY, len(index)):
+            similar = await asyncio.to_thread(
+                find_similar_skus_tfidf,
+                index,
+                block_size=tfidf_block_size,
+                workers=tfidf_workers,
+                max_df=tfidf_max_df,
+            )
+        await _save_similar(engine, similar, db_batch_size)
+
+    else:
+        raise ValueError(f"Unknown similarity backend: {similarity_backend}")
+
+
+async def _upsert_changed_skus(
+    conn: AsyncConnection, batches: AsyncIterable[list[OfferRecord]], changed_ids: list[uuid.UUID]
+) -> AsyncGenerator[OfferRecord, None]:
+    """
+    Выполняет upsert пачек SKU в БД и передает дальше по потоку только новые и измененные SKU.
+
+    SKU получают uuid, под которым товар хранится в БД, а их UUID добавляются в changed_ids.
+    """
+    total = 0
+    async for batch in batches:
+        changed = await upsert_skus(conn, batch)
+        total += len(batch)
+        for sku in batch:
+            sku_id = changed.get((sku.marketplace_id, sku.product_id))
+            if sku_id is None:
+                continue
+            if sku.uuid != sku_id:
+                sku = sku._replace(uuid=sku_id)
+            changed_ids.append(sku_id)
+            yield sku
+        logger.info("Processed %d SKUs, changed %d", total, len(changed_ids))
+
+
+async def ingest_incremental(
+    engine: AsyncEngine,
+    es_client: AsyncElasticsearch,
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    chunk_size: int = 500,
+    max_concurrency: int = 4,
+    db_batch_size: int = 5000,
+    search_batch_size: int = 100,
+    search_concurrency: int = 4,
+    parse_options: ParseOptions = ParseOptions(),
+    blocking: BlockingOptions = BlockingOptions(),
+    mlt: MltOptions = MltOptions(),
+    neighbours: int = 5,
+) -> None:
+    """
+    Инкрементальная загрузка фида поверх данных предыдущих запусков.
+
+    1. Офферы записываются в БД с upsert по (marketplace_id, product_id). Неизменные офферы
+       (совпадает content_hash) пропускаются, новые и измененные индексируются в Elasticsearch.
+    2. Товары, которых нет в фиде, мягко удаляются (deleted_at) и удаляются из индекса,
+       их собственные ребра в sku_similarity удаляются.
+    3. Похожие SKU пересчитываются только для измененных товаров и товаров, у которых
+       среди похожих есть измененные или удаленные товары.
+    4. Новый или измененный товар может попасть в похожие неизменных товаров, которые на него
+       не ссылаются. Поэтому похожие пересчитываются и для neighbours первых похожих каждого
+       нового и измененного товара: похожесть "more_like_this" почти симметрична, и именно у них
+       товар вероятнее всего попадет в выдачу. У более далеких неизменных товаров новый товар
+       появится только при следующей полной загрузке.
+
+    Требует бэкенд поиска похожих es: TF-IDF считается только по всему каталогу сразу.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - es_client: Клиент Elasticsearch.
+    - file_path: Путь к XML-файлу.
+    - category_paths: Таблица путей категорий (см. build_category_paths).
+    - chunk_size: Количество документов в одном bulk-запросе.
+    - max_concurrency: Максимальное количество одновременных bulk-запросов.
+    - db_batch_size: Количество строк в одной транзакции upsert.
+    - search_batch_size: Количество поисковых запросов в одном _msearch.
+    - search_concurrency: Максимальное количество одновременных _msearch-запросов.
+    - parse_options: Параметры парсинга фида.
+    - blocking: Параметры блокировки при поиске похожих.
+    - mlt: Параметры запроса "more_like_this".
+    - neighbours: Для скольких первых похожих нового или измененного товара пересчитываются похожие
+      (0 — не пересчитываются).
+    """
+    changed_ids: list[uuid.UUID] = []
+    batches = parse_xml_batches(file_path, category_paths, db_batch_size, parse_options)
+
+    await ensure_sku_index(es_client)
+    async with engine.connect() as conn:
+        # Этап 1: upsert офферов и индексация измененных
+        await create_staging_tables(conn)
+        skus = _upsert_changed_skus(conn, batches, changed_ids)
+        _, failed = await bulk_index_in_elasticsearch(
+            es_client, skus, chunk_size=chunk_size, max_concurrency=max_concurrency
+        )
+        if failed:
+            # content_hash уже записан в БД, поэтому следующий запуск не переиндексирует эти SKU
+            logger.warning("Failed to index %d changed SKUs, they stay stale until changed again", failed)
+
+        # Этап 2: мягкое удаление пропавших офферов
+        deleted_ids = await soft_delete_missing_skus(conn)
+        await delete_similar_skus(conn, deleted_ids)
+        await delete_from_elasticsearch(es_client, deleted_ids, chunk_size=chunk_size)
+        logger.info("Changed %d SKUs, deleted %d", len(changed_ids), len(deleted_ids))
+
+        await refresh_index(es_client)
+
+        # Этап 3: пересчет похожих для затронутых товаров
+        affected = set(changed_ids)
+        affected.update(await find_referencing_skus(conn, changed_ids + deleted_ids))
+
+    affected_ids = sorted(affected)
+    changed = set(changed_ids)
+    nearby: set[uuid.UUID] = set()
+    logger.info("Recomputing similar SKUs for %d SKUs", len(affected_ids))
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        for start in range(0, len(affected_ids), db_batch_size):
+            end = start + db_batch_size
+            similar = await _search_and_save_similar(
+                session,
+                es_client,
+                affected_ids[start:end],
+                search_batch_size,
+                search_concurrency,
+                blocking=blocking,
+                mlt=mlt,
+            )
+            for sku_id, items in similar.items():
+                if sku_id in changed:
+                    nearby.update(dst_id for dst_id, _ in items[:neighbours])
+
+        # Этап 4: пересчет похожих для ближайших соседей новых и измененных товаров
+        nearby_ids = sorted(nearby - affected)
+        logger.info("Recomputing similar SKUs for %d neighbours of changed SKUs", len(nearby_ids))
+        for start in range(0, len(nearby_ids), db_batch_size):
+            end = start + db_batch_size
+            await _search_and_save_similar(
+                session,
+                es_client,
+                nearby_ids[start:end],
+                search_batch_size,
+                search_concurrency,
+                blocking=blocking,
+                mlt=mlt,
+            )
+
+
+async def cluster_products(
+    engine: AsyncEngine, page_size: int = 10000, options: ClusteringOptions = ClusteringOptions()
+) -> None:
+    """
+    Объединяет активные товары БД в кластеры офферов одного физического товара и записывает
+    product_cluster_id (см. ProductClusterer).
+
+    Кластеры вычисляются по всему каталогу за один проход по таблице, поэтому этап выполняется
+    после загрузки в любом режиме. После него офферы того же товара с других маркетплейсов
+    находятся запросом по индексу product_cluster_id.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - page_size: Количество SKU, читаемых из БД одним запросом.
+    - options: Параметры кластеризации.
+    """
+    clusterer = ProductClusterer(options)
+    async with AsyncSession(engine) as session:
+        async for rows in iter_cluster_inputs(session, batch_size=page_size):
+            for sku_id, barcode, brand, title, attributes in rows:
+                clusterer.add(sku_id, barcode, brand, title, attributes)
+
+    with track(STAGE_CLUSTERING, len(clusterer)):
+        clusters = clusterer.clusters()
+    async with engine.connect() as conn:
+        updated = await save_product_clusters(conn, clusters)
+    logger.info("Updated product clusters of %d SKUs", updated)
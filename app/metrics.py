@@ -0,0 +1,158 @@
+import contextlib
+import logging
+import time
+from typing import Iterator
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server, write_to_textfile
+
+logger = logging.getLogger(__name__)
+
+# Этапы загрузки фида
+STAGE_CATEGORIES = "categories"
+STAGE_PARSE = "parse"
+STAGE_DB_WRITE = "db_write"
+STAGE_ES_INDEX = "es_index"
+STAGE_ES_SEARCH = "es_search"
+STAGE_SIMILARITY = "similarity"
+STAGE_CLUSTERING = "clustering"
+
+# Границы гистограмм: от долей миллисекунды (одна операция) до минут (вычисление по всему каталогу)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds",
+    "Длительность одной операции этапа загрузки (пачки, запроса)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ITEMS = Counter("ingest_stage_items", "Количество обработанных элементов этапа загрузки", ["stage"])
+STAGE_ERRORS = Counter("ingest_stage_errors", "Количество ошибок этапа загрузки", ["stage"])
+QUEUE_DEPTH = Gauge("ingest_queue_depth", "Количество операций в полёте или в очереди", ["queue"])
+CATEGORY_MISSES = Counter("ingest_category_misses", "Офферы с категорией, отсутствующей в дереве категорий")
+BLOCK_LEVELS = Counter(
+    "ingest_similarity_block_level",
+    "Товары по уровню блока кандидатов, на котором закончился поиск похожих (0 — самый узкий блок)",
+    ["level"],
+)
+
+# Сервис похожих товаров (app.service)
+SIMILAR_LOOKUPS = Counter(
+    "similar_service_lookups",
+    "Товары, для которых сервис вернул похожие SKU, по источнику: cache, db, mlt или none",
+    ["source"],
+)
+SIMILAR_REQUEST_SECONDS = Histogram(
+    "similar_service_request_seconds",
+    "Длительность обработки запроса сервисом",
+    ["endpoint"],
+    buckets=(0.0001, 0.00025) + LATENCY_BUCKETS,
+)
+
+
+def observe(stage: str, seconds: float, items: int = 1) -> None:
+    """
+    Записывает длительность одной операции этапа и количество обработанных в ней элементов.
+
+    Args:
+        stage (str): Название этапа.
+        seconds (float): Длительность операции в секундах.
+        items (int): Количество элементов, обработанных операцией.
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    STAGE_ITEMS.labels(stage).inc(items)
+
+
+def record_errors(stage: str, count: int = 1) -> None:
+    """
+    Увеличивает счетчик ошибок этапа.
+
+    Args:
+        stage (str): Название этапа.
+        count (int): Количество ошибок.
+    """
+    if count:
+        STAGE_ERRORS.labels(stage).inc(count)
+
+
+@contextlib.contextmanager
+def track(stage: str, items: int = 1) -> Iterator[None]:
+    """
+    Замеряет операцию этапа. Исключение внутри блока учитывается как ошибка и пробрасывается дальше.
+
+    Args:
+        stage (str): Название этапа.
+        items (int): Количество элементов, обрабатываемых операцией.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_errors(stage, items)
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+        raise
+    observe(stage, time.perf_counter() - started, items)
+
+
+@contextlib.contextmanager
+def in_flight(queue: str) -> Iterator[None]:
+    """
+    Учитывает операцию в глубине очереди queue на время выполнения блока.
+
+    Args:
+        queue (str): Название очереди.
+    """
+    gauge = QUEUE_DEPTH.labels(queue)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def start_metrics_server(port: int) -> None:
+    """
+    Запускает HTTP-сервер с метриками в текстовом формате Prometheus (/metrics) в фоновом потоке.
+
+    Args:
+        port (int): Порт сервера.
+    """
+    start_http_server(port)
+    logger.info("Serving metrics on port %d", port)
+
+
+def write_metrics(file_path: str) -> None:
+    """
+    Сохраняет текущие значения метрик в файл в текстовом формате Prometheus
+    (например, для textfile-коллектора node_exporter после завершения загрузки).
+
+    Args:
+        file_path (str): Путь к файлу.
+    """
+    write_to_textfile(file_path, REGISTRY)
+
+
+def log_summary() -> None:
+    """
+    Выводит в лог сводку по этапам: количество элементов, операций, ошибок и среднюю длительность операции.
+    """
+    items = {sample.labels["stage"]: sample.value for sample in _samples(STAGE_ITEMS, "_total")}
+    errors = {sample.labels["stage"]: sample.value for sample in _samples(STAGE_ERRORS, "_total")}
+    counts = {sample.labels["stage"]: sample.value for sample in _samples(STAGE_SECONDS, "_count")}
+    sums = {sample.labels["stage"]: sample.value for sample in _samples(STAGE_SECONDS, "_sum")}
+    for stage, count in counts.items():
+        logger.info(
+            "Stage %s: %d items, %d operations, %d errors, %.1f ms per operation, %.1f s total",
+            stage,
+            items.get(stage, 0),
+            count,
+            errors.get(stage, 0),
+            sums[stage] / count * 1000 if count else 0.0,
+            sums[stage],
+        )
+
+
+def _samples(metric, suffix: str):
+    for family in metric.collect():
+        for sample in family.samples:
+            if sample.name.endswith(suffix):
+                yield sample
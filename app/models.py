@@ -1,7 +1,23 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import ARRAY, JSON, REAL, TIMESTAMP, BigInteger, Column, Double, Index, UniqueConstraint, func
+from sqlalchemy import (
+    DDL,
+    JSON,
+    REAL,
+    TIMESTAMP,
+    BigInteger,
+    Boolean,
+    Column,
+    Double,
+    Index,
+    Integer,
+    SmallInteger,
+    UniqueConstraint,
+    event,
+    func,
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
@@ -35,6 +51,8 @@ class SKU(Base):
     - category_lvl_1, category_lvl_2, category_lvl_3: Разделы категории товара.
     - category_remaining: Остаток категорий товара.
     - features: Характеристики товара (JSON-формат).
+    - attributes: Нормализованные атрибуты, извлеченные из характеристик и названия (JSONB):
+      storage_gb, ram_gb, screen_in, model_code, color (см. app.attributes).
     - rating_count: Количество отзывов на товар.
     - rating_value: Рейтинг товара (0-5).
     - price_before_discounts: Цена до скидок.
@@ -46,7 +64,10 @@ class SKU(Base):
     - updated_at: Дата обновления записи.
     - currency: Валюта товара.
     - barcode: Штрихкод товара.
-    - similar_sku: Список UUID похожих товаров.
+    - content_hash: Хеш содержимого оффера, по которому инкрементальная загрузка определяет изменения.
+    - deleted_at: Дата мягкого удаления (оффер пропал из фида).
+    - product_cluster_id: Идентификатор физического товара: у офферов одного товара с разных
+      маркетплейсов и от разных продавцов он совпадает (см. app.clustering).
     """
 
     __tablename__ = "sku"
@@ -84,6 +105,9 @@ class SKU(Base):
 
     # Прочие поля
     features: Mapped[dict] = mapped_column(JSON, comment="Характеристики товара")
+    attributes: Mapped[dict] = mapped_column(
+        JSONB, nullable=True, server_default="{}", comment="Нормализованные атрибуты товара"
+    )
     rating_count: Mapped[int] = mapped_column(comment="Количество отзывов о товаре")
     rating_value: Mapped[float] = mapped_column(Double, comment="Рейтинг товара (0-5)")
     price_before_discounts: Mapped[float] = mapped_column(REAL, comment="Цена товара до скидок")
@@ -102,12 +126,28 @@ class SKU(Base):
         TIMESTAMP, server_default=func.now(), onupdate=func.now(), comment="Дата и время последнего обновления"
     )
 
-    # Поле для списка UUID похожих товаров
-    similar_sku: Mapped[list[PG_UUID]] = Column(ARRAY(PG_UUID(as_uuid=True)), comment="Список UUID похожих товаров")
+    # Поля для инкрементальной загрузки
+    content_hash: Mapped[str] = mapped_column(comment="Хеш содержимого оффера")
+    deleted_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, nullable=True, comment="Дата и время мягкого удаления (оффер пропал из фида)"
+    )
+
+    # Поле для кластера офферов одного товара
+    product_cluster_id: Mapped[PG_UUID] = Column(
+        PG_UUID(as_uuid=True), nullable=True, comment="Идентификатор кластера офферов одного товара"
+    )
 
     # Определение индексов и уникальных ограничений
     __table_args__ = (
         Index("sku_brand_index", "brand"),  # Индекс для ускорения поиска по бренду
+        Index("sku_product_cluster_id_index", "product_cluster_id"),  # Индекс для поиска офферов одного товара
+        # Индекс для поиска по атрибутам запросами attributes @> '{"storage_gb": 256}'
+        Index(
+            "sku_attributes_index",
+            "attributes",
+            postgresql_using="gin",
+            postgresql_ops={"attributes": "jsonb_path_ops"},
+        ),
         UniqueConstraint("marketplace_id", "product_id", name="sku_marketplace_id_sku_id_uindex"),
         # Уникальный индекс для marketplace_id и product_id
         UniqueConstraint("uuid", name="sku_uuid_uindex"),  # Уникальный индекс для uuid
@@ -117,7 +157,206 @@ class SKU(Base):
         """
         Возвращает строковое представление объекта SKU, которое удобно для отладки.
         """
+        return f"<SKU(uuid={self.uuid}, title={self.title}, price={self.price_after_discounts})>"
+
+
+# Канал LISTEN/NOTIFY, в который отправляются UUID товаров с изменившимися похожими SKU ("*" — все товары)
+SIMILARITY_CHANNEL = "sku_similarity_changed"
+# Канал LISTEN/NOTIFY, в который отправляются ключи удаленных офферов "marketplace_id:product_id" ("*" — все офферы)
+SKU_DELETED_CHANNEL = "sku_deleted"
+
+# Пересоздание таблицы при полной загрузке удаляет все офферы
+event.listen(SKU.__table__, "after_drop", DDL(f"NOTIFY {SKU_DELETED_CHANNEL}, '*'"))
+
+
+class SkuSimilarity(Base):
+    """
+    Ребро графа похожих товаров: товар dst_uuid похож на товар src_uuid.
+
+    Похожие товары хранятся компактными строками отдельно от широкой строки sku, поэтому
+    их пересчет не переписывает описание и характеристики товара. Первичный ключ
+    (src_uuid, rank) отдает похожие товары в порядке выдачи, индекс по dst_uuid находит
+    товары, у которых заданный товар есть среди похожих.
+
+    Поля:
+    - src_uuid: UUID товара.
+    - rank: Место похожего товара в выдаче, начиная с 1.
+    - dst_uuid: UUID похожего товара.
+    - score: Оценка похожести (_score Elasticsearch или косинусная близость TF-IDF).
+    - computed_at: Дата вычисления.
+    """
+
+    __tablename__ = "sku_similarity"
+
+    src_uuid: Mapped[PG_UUID] = Column(PG_UUID(as_uuid=True), primary_key=True, comment="UUID товара")
+    rank: Mapped[int] = mapped_column(SmallInteger, primary_key=True, comment="Место похожего товара в выдаче")
+    dst_uuid: Mapped[PG_UUID] = Column(PG_UUID(as_uuid=True), nullable=False, comment="UUID похожего товара")
+    score: Mapped[float] = mapped_column(REAL, comment="Оценка похожести")
+    computed_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, server_default=func.now(), comment="Дата и время вычисления"
+    )
+
+    __table_args__ = (Index("sku_similarity_dst_uuid_index", "dst_uuid"),)  # Индекс для обратного поиска
+
+    def __repr__(self):
+        """
+        Возвращает строковое представление объекта SkuSimilarity, которое удобно для отладки.
+        """
+        return (
+            f"<SkuSimilarity(src_uuid={self.src_uuid}, rank={self.rank}, dst_uuid={self.dst_uuid}, score={self.score})>"
+        )
+
+
+# Представление для совместимости с прежней колонкой sku.similar_sku: UUID похожих товаров массивом
+event.listen(
+    SkuSimilarity.__table__,
+    "after_create",
+    DDL(
+        "CREATE OR REPLACE VIEW similar_sku AS "
+        "SELECT src_uuid AS uuid, array_agg(dst_uuid ORDER BY rank) AS similar_sku "
+        "FROM sku_similarity GROUP BY src_uuid"
+    ),
+)
+event.listen(SkuSimilarity.__table__, "before_drop", DDL("DROP VIEW IF EXISTS similar_sku"))
+# Пересоздание таблицы при полной загрузке сбрасывает все похожие товары
+event.listen(SkuSimilarity.__table__, "after_drop", DDL(f"NOTIFY {SIMILARITY_CHANNEL}, '*'"))
+
+
+class Category(Base):
+    """
+    Материализованная таблица категорий фида с заранее вычисленными путями по уровням.
+
+    Поля:
+    - id: ID категории в фиде.
+    - name: Название категории.
+    - parent_id: ID родительской категории.
+    - lvl_1, lvl_2, lvl_3: Названия первых трех уровней пути категории.
+    - remaining: Остальные уровни пути через "/".
+    - updated_at: Дата последнего обновления таблицы.
+    """
+
+    __tablename__ = "category"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False, comment="ID категории в фиде")
+    name: Mapped[str] = mapped_column(nullable=True, comment="Название категории")
+    parent_id: Mapped[int] = mapped_column(nullable=True, comment="ID родительской категории")
+    lvl_1: Mapped[str] = mapped_column(comment="Первый уровень пути категории")
+    lvl_2: Mapped[str] = mapped_column(comment="Второй уровень пути категории")
+    lvl_3: Mapped[str] = mapped_column(comment="Третий уровень пути категории")
+    remaining: Mapped[str] = mapped_column(comment="Остальные уровни пути категории через '/'")
+    updated_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, server_default=func.now(), comment="Дата и время последнего обновления"
+    )
+
+    def __repr__(self):
+        """
+        Возвращает строковое представление объекта Category, которое удобно для отладки.
+        """
+        return f"<Category(id={self.id}, name={self.name}, path={self.lvl_1}/{self.lvl_2}/{self.lvl_3})>"
+
+
+class IngestCheckpoint(Base):
+    """
+    Прогресс загрузки фида в режиме bulk, по которому прерванная загрузка продолжается
+    с последней записанной пачки. Прогресс поиска похожих хранится в задачах similarity_job.
+
+    Поля:
+    - feed_path: Путь к файлу фида.
+    - feed_size, feed_mtime: Размер и время изменения файла. Если файл изменился,
+      чекпоинт не используется и загрузка начинается заново.
+    - offers_done: Количество офферов, записанных в БД.
+    - last_marketplace_id, last_product_id: Ключ последнего записанного оффера.
+    - es_index: Версионированный индекс Elasticsearch, в который загружается фид.
+    - loaded: Все офферы фида записаны в БД и проиндексированы, алиас sku переключен на es_index.
+    - started_at: Дата начала загрузки.
+    - updated_at: Дата последнего обновления чекпоинта.
+    - completed_at: Дата завершения загрузки.
+    """
+
+    __tablename__ = "ingest_checkpoint"
+
+    feed_path: Mapped[str] = mapped_column(primary_key=True, comment="Путь к файлу фида")
+    feed_size: Mapped[int] = mapped_column(BigInteger, comment="Размер файла фида в байтах")
+    feed_mtime: Mapped[float] = mapped_column(Double, comment="Время изменения файла фида")
+    offers_done: Mapped[int] = mapped_column(BigInteger, server_default="0", comment="Количество записанных офферов")
+    last_marketplace_id: Mapped[int] = mapped_column(nullable=True, comment="id маркетплейса последнего оффера")
+    last_product_id: Mapped[int] = mapped_column(BigInteger, nullable=True, comment="id последнего оффера")
+    es_index: Mapped[str] = mapped_column(nullable=True, comment="Индекс Elasticsearch загрузки")
+    loaded: Mapped[bool] = mapped_column(Boolean, server_default="false", comment="Все офферы записаны в БД")
+    started_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, server_default=func.now(), comment="Дата и время начала загрузки"
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, server_default=func.now(), comment="Дата и время последнего обновления"
+    )
+    completed_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, comment="Дата и время завершения")
+
+    @property
+    def resume_after(self) -> tuple[int, int] | None:
+        """
+        Ключ (marketplace_id, product_id) последнего записанного оффера или None, если офферов еще нет.
+        """
+        if not self.offers_done:
+            return None
+        return self.last_marketplace_id, self.last_product_id
+
+    def __repr__(self):
+        """
+        Возвращает строковое представление объекта IngestCheckpoint, которое удобно для отладки.
+        """
         return (
-            f"<SKU(uuid={self.uuid}, title={self.title}, price={self.price_after_discounts}, "
-            f"similar_sku={self.similar_sku})>"
+            f"<IngestCheckpoint(feed_path={self.feed_path}, offers_done={self.offers_done}, "
+            f"loaded={self.loaded}, completed_at={self.completed_at})>"
         )
+
+
+# Статусы задач поиска похожих
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class SimilarityJob(Base):
+    """
+    Задача поиска похожих: диапазон UUID товаров, для которых похожие ищутся одним воркером.
+
+    Таблица служит очередью задач: воркеры забирают задачи запросом FOR UPDATE SKIP LOCKED,
+    пока работают, обновляют heartbeat_at, а задачу воркера, не обновлявшего heartbeat_at
+    дольше таймаута аренды, забирает другой воркер (см. app.worker).
+
+    Поля:
+    - id: ID задачи, задачи забираются в порядке id.
+    - run_id: Проход поиска похожих, к которому относится задача (индекс Elasticsearch загрузки).
+    - first_uuid, last_uuid: Границы диапазона UUID товаров включительно.
+    - status: pending, running, done или failed.
+    - attempts: Количество попыток выполнения.
+    - worker_id: Воркер, выполняющий или выполнивший задачу.
+    - heartbeat_at: Время последнего подтверждения, что воркер работает.
+    - error: Ошибка последней неудачной попытки.
+    - created_at, finished_at: Даты создания и завершения.
+    """
+
+    __tablename__ = "similarity_job"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True, comment="ID задачи")
+    run_id: Mapped[str] = mapped_column(nullable=False, comment="Проход поиска похожих")
+    first_uuid: Mapped[PG_UUID] = Column(PG_UUID(as_uuid=True), nullable=False, comment="Первый UUID диапазона")
+    last_uuid: Mapped[PG_UUID] = Column(PG_UUID(as_uuid=True), nullable=False, comment="Последний UUID диапазона")
+    status: Mapped[str] = mapped_column(server_default=JOB_PENDING, nullable=False, comment="Статус задачи")
+    attempts: Mapped[int] = mapped_column(server_default="0", nullable=False, comment="Количество попыток")
+    worker_id: Mapped[str] = mapped_column(nullable=True, comment="Воркер, забравший задачу")
+    heartbeat_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, comment="Последний heartbeat воркера")
+    error: Mapped[str] = mapped_column(nullable=True, comment="Ошибка последней попытки")
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now(), comment="Дата и время создания")
+    finished_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, comment="Дата и время завершения")
+
+    __table_args__ = (
+        Index("similarity_job_run_id_status_index", "run_id", "status"),  # Индекс для выборки задач прохода
+    )
+
+    def __repr__(self):
+        """
+        Возвращает строковое представление объекта SimilarityJob, которое удобно для отладки.
+        """
+        return f"<SimilarityJob(id={self.id}, run_id={self.run_id}, status={self.status}, attempts={self.attempts})>"
@@ -1,16 +1,202 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import re
+import time
 import uuid
-from typing import AsyncGenerator
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncGenerator, BinaryIO, Iterator, NamedTuple
 
 import lxml.etree as ET
+import zstandard
 
+from app.attributes import extract_attributes
+from app.metrics import CATEGORY_MISSES, QUEUE_DEPTH, STAGE_PARSE, observe, record_errors
 from app.models import SKU
+from app.profiling import get_offer_profiler
+from app.utils import abatched, aiterate_in_thread, batched
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен для детерминированных UUID товаров
+SKU_UUID_NAMESPACE = uuid.UUID("8246eec4-5dc7-41fc-b595-03c10942bd9c")
+
+# Начало элемента <offer> (но не <offers>)
+OFFER_START_RE = re.compile(rb"<offer[\s>]")
+
+# Таблица путей категорий в процессе-воркере параллельного парсинга
+_worker_category_paths: dict = {}
+
+# Сколько офферов parse_offers разбирает в отдельном потоке за один переход между потоками
+THREAD_BATCH_SIZE = 1000
+
+# Поля оффера, изменение которых считается изменением товара
+SKU_CONTENT_FIELDS = (
+    "marketplace_id",
+    "product_id",
+    "title",
+    "description",
+    "brand",
+    "seller_id",
+    "seller_name",
+    "first_image_url",
+    "category_id",
+    "category_lvl_1",
+    "category_lvl_2",
+    "category_lvl_3",
+    "category_remaining",
+    "features",
+    "rating_count",
+    "rating_value",
+    "price_before_discounts",
+    "discount",
+    "price_after_discounts",
+    "bonuses",
+    "sales",
+    "currency",
+    "barcode",
+)
+
+
+def sku_uuid(marketplace_id: int, product_id: int) -> uuid.UUID:
+    """
+    Возвращает детерминированный UUID товара, одинаковый во всех запусках загрузки.
+
+    :param marketplace_id: ID маркетплейса.
+    :param product_id: ID товара в маркетплейсе.
+    :return: UUID товара.
+    """
+    return uuid.uuid5(SKU_UUID_NAMESPACE, f"{marketplace_id}:{product_id}")
+
+
+def _hash_content(values, attributes: dict) -> str:
+    """
+    Вычисляет хеш значений полей SKU_CONTENT_FIELDS, перечисленных в том же порядке, и атрибутов.
+
+    Атрибуты входят в хеш, чтобы исправления в app.attributes при инкрементальной загрузке
+    доходили до уже загруженных офферов с неизменным содержимым.
+    """
+    payload = json.dumps([*values, attributes], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def compute_content_hash(sku) -> str:
+    """
+    Вычисляет хеш содержимого оффера по полям SKU_CONTENT_FIELDS и атрибутам.
+
+    :param sku: Объект SKU или OfferRecord.
+    :return: Хеш в шестнадцатеричном виде.
+    """
+    return _hash_content((getattr(sku, field) for field in SKU_CONTENT_FIELDS), sku.attributes)
+
+
+class OfferRecord(NamedTuple):
+    """
+    Компактная запись об оффере, полученная при парсинге фида.
+
+    Поля совпадают с колонками модели SKU. Запись не несет накладных расходов ORM
+    и дешево передается между процессами, а объект SKU создается методом to_sku()
+    только там, где он действительно нужен.
+    """
+
+    uuid: uuid.UUID
+    marketplace_id: int
+    product_id: int
+    title: str
+    description: str
+    brand: str
+    seller_id: int
+    seller_name: str
+    first_image_url: str
+    category_id: int
+    category_lvl_1: str
+    category_lvl_2: str
+    category_lvl_3: str
+    category_remaining: str
+    features: dict[str, str]
+    rating_count: int
+    rating_value: float
+    price_before_discounts: float
+    discount: float
+    price_after_discounts: float
+    bonuses: int
+    sales: int
+    currency: str
+    barcode: str
+    content_hash: str
+    attributes: dict[str, int | float | str]
+
+    def to_sku(self) -> SKU:
+        """
+        Создает ORM-объект SKU с данными записи.
+
+        :return: Объект SKU.
+        """
+        return SKU(**self._asdict())
+
+
+# Тег дочернего элемента <offer> -> (поле OfferRecord, преобразование текста)
+OFFER_TAGS = {
+    "name": ("title", str),
+    "description": ("description", str),
+    "vendor": ("brand", str),
+    "sellerId": ("seller_id", int),
+    "sellerName": ("seller_name", str),
+    "picture": ("first_image_url", str),
+    "categoryId": ("category_id", int),
+    "rating_count": ("rating_count", int),
+    "rating_value": ("rating_value", float),
+    "price_before_discounts": ("price_before_discounts", float),
+    "discount": ("discount", float),
+    "price_after_discounts": ("price_after_discounts", float),
+    "bonuses": ("bonuses", int),
+    "sales": ("sales", int),
+    "currency": ("currency", str),
+    "barcode": ("barcode", str),
+}
+
+# Значения полей для отсутствующих или пустых тегов
+OFFER_DEFAULTS = {field: convert() for field, convert in OFFER_TAGS.values()}
+
+
+def is_compressed_feed(file_path: str) -> bool:
+    """
+    Проверяет, сжат ли фид (.xml.gz или .xml.zst).
+
+    :param file_path: Путь к файлу фида.
+    :return: True, если фид сжат.
+    """
+    return file_path.endswith((".gz", ".zst"))
+
+
+def open_feed(file_path: str) -> BinaryIO:
+    """
+    Открывает фид для потокового чтения, распаковывая .gz и .zst на лету.
+
+    :param file_path: Путь к файлу фида (.xml, .xml.gz или .xml.zst).
+    :return: Файловый объект с несжатым XML.
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    if file_path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+    return open(file_path, "rb")
 
 
 def build_category_hierarchy(file_path: str) -> (dict[int, str], dict[int, int]):
     """
     Строит иерархию категорий из XML-файла.
 
-    :param file_path: Путь к XML-файлу.
+    Категории в фиде идут перед офферами, поэтому чтение останавливается на начале
+    раздела <offers>: тело фида с офферами читается только один раз, при парсинге офферов.
+
+    :param file_path: Путь к XML-файлу (.xml, .xml.gz или .xml.zst).
     :return: Кортеж из двух словарей:
              - categories: словарь, где ключ — ID категории, значение — название категории.
              - parent_map: словарь, где ключ — ID категории, значение — ID родительской категории.
@@ -18,36 +204,108 @@ def build_category_hierarchy(file_path: str) -> (dict[int, str], dict[int, int])
     categories = {}
     parent_map = {}
 
-    # Парсим файл до раздела <categories> для извлечения категорий
-    context = ET.iterparse(file_path, events=("end",), tag="category")
-    for event, elem in context:
-        category_id = int(elem.get("id"))
-        parent_id = elem.get("parentId")
-        parent_id = int(parent_id) if parent_id else None
-        categories[category_id] = elem.text
-        parent_map[category_id] = parent_id
-        elem.clear()  # Очищаем элемент для освобождения памяти
+    # Парсим файл до раздела <offers> для извлечения категорий
+    with open_feed(file_path) as feed:
+        context = ET.iterparse(feed, events=("start", "end"), tag=("category", "offers", "offer"))
+        for event, elem in context:
+            if elem.tag != "category":
+                break
+            if event != "end":
+                continue
+            category_id = int(elem.get("id"))
+            parent_id = elem.get("parentId")
+            parent_id = int(parent_id) if parent_id else None
+            categories[category_id] = elem.text
+            parent_map[category_id] = parent_id
+            elem.clear()  # Очищаем элемент для освобождения памяти
 
     return categories, parent_map
 
 
-def get_category_path(category_id: int, categories: dict[int, str], parent_map: dict[int, int]) -> list[str]:
+class CategoryPath(NamedTuple):
+    """
+    Разложенный по уровням путь категории от корня.
+
+    - lvl_1, lvl_2, lvl_3: Названия первых трех уровней.
+    - remaining: Остальные уровни через "/".
     """
-    Получает путь к категории по ее ID.
 
-    :param category_id: ID категории.
+    lvl_1: str = ""
+    lvl_2: str = ""
+    lvl_3: str = ""
+    remaining: str = ""
+
+    @classmethod
+    def from_names(cls, names: tuple[str, ...]) -> "CategoryPath":
+        """
+        Раскладывает список названий категорий от корня по уровням.
+
+        :param names: Названия категорий от корня до заданной категории.
+        :return: Путь категории.
+        """
+        return cls(
+            names[0] if len(names) > 0 else "",
+            names[1] if len(names) > 1 else "",
+            names[2] if len(names) > 2 else "",
+            "/".join(names[3:]),
+        )
+
+
+# Путь для офферов без категории или с неизвестной категорией
+EMPTY_CATEGORY_PATH = CategoryPath()
+
+
+def build_category_paths(categories: dict[int, str], parent_map: dict[int, int]) -> dict[int, CategoryPath]:
+    """
+    Строит таблицу путей всех категорий: ID категории -> CategoryPath.
+
+    Каждая категория разрешается один раз: подъем к корню останавливается на первой уже
+    разрешенной категории, после чего пути всей цепочки вычисляются сверху вниз.
+    Циклы в parentId обнаруживаются, и категория, замыкающая цикл, считается корнем.
+
     :param categories: Словарь с категориями.
     :param parent_map: Словарь с родительскими категориями.
-    :return: Список названий категорий от корня до заданной категории.
+    :return: Словарь, где ключ — ID категории, значение — путь категории по уровням.
     """
-    path = []
-    current_id = category_id
-    while current_id:
-        category_name = categories.get(current_id)
-        if category_name:
-            path.insert(0, category_name)
-        current_id = parent_map.get(current_id)
-    return path
+    names: dict[int, tuple[str, ...]] = {}
+
+    for category_id in categories:
+        chain = []
+        on_chain = set()
+        current_id = category_id
+        while current_id and current_id not in names:
+            if current_id in on_chain:
+                logger.warning("Category cycle detected at category %s, treating it as a root", current_id)
+                break
+            chain.append(current_id)
+            on_chain.add(current_id)
+            current_id = parent_map.get(current_id)
+
+        prefix = () if current_id in on_chain else names.get(current_id, ())
+        for chain_id in reversed(chain):
+            category_name = categories.get(chain_id)
+            if category_name:
+                prefix = prefix + (category_name,)
+            names[chain_id] = prefix
+
+    return {category_id: CategoryPath.from_names(names[category_id]) for category_id in categories}
+
+
+def _parse_feature_list(features_elem: ET.Element) -> dict[str, str]:
+    """
+    Собирает характеристики из элемента <features> за один проход по дочерним элементам.
+    """
+    features = {}
+    for feature in features_elem:
+        key = value = None
+        for part in feature:
+            if part.tag == "name":
+                key = part.text
+            elif part.tag == "value":
+                value = part.text
+        if key and value:
+            features[key] = value
+    return features
 
 
 def parse_features(elem: ET.Element) -> dict[str, str]:
@@ -57,80 +315,382 @@ def parse_features(elem: ET.Element) -> dict[str, str]:
     :param elem: Элемент XML, содержащий характеристики товара.
     :return: Словарь характеристик, где ключ — название характеристики, значение — ее значение.
     """
-    features = {}
-    for feature in elem.findall(".//features/feature"):
-        key = feature.findtext("name")
-        value = feature.findtext("value")
-        if key and value:
-            features[key] = value
-    return features
+    for child in elem:
+        if child.tag == "features":
+            return _parse_feature_list(child)
+    return {}
+
+
+def parse_offer_record(elem: ET.Element, category_paths: dict[int, CategoryPath]) -> OfferRecord:
+    """
+    Извлекает информацию о товаре из XML-элемента <offer> за один проход по его дочерним элементам.
+
+    Для каждого поля используется первый встреченный тег, отсутствующие и пустые теги
+    заменяются значениями из OFFER_DEFAULTS.
+
+    :param elem: Элемент XML <offer>.
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :return: Запись OfferRecord с данными о товаре.
+    """
+    values = {}
+    features = None
+    for child in elem:
+        spec = OFFER_TAGS.get(child.tag)
+        if spec is None:
+            if child.tag == "features" and features is None:
+                features = _parse_feature_list(child)
+            continue
+        field, convert = spec
+        if field not in values:
+            text = child.text
+            values[field] = convert(text) if text else OFFER_DEFAULTS[field]
+
+    get = values.get
+    marketplace_id = elem.get("marketplace_id")
+    product_id = elem.get("id")
+    marketplace_id = int(marketplace_id) if marketplace_id is not None else 0
+    product_id = int(product_id) if product_id is not None else 0
+
+    # Получаем путь категории товара по уровням
+    category_id = get("category_id", 0)
+    category_path = category_paths.get(category_id, EMPTY_CATEGORY_PATH)
+
+    # Значения в порядке SKU_CONTENT_FIELDS
+    features = features or {}
+    content = (
+        marketplace_id,
+        product_id,
+        get("title", ""),
+        get("description", ""),
+        get("brand", ""),
+        get("seller_id", 0),
+        get("seller_name", ""),
+        get("first_image_url", ""),
+        category_id,
+        *category_path,
+        features,
+        get("rating_count", 0),
+        get("rating_value", 0.0),
+        get("price_before_discounts", 0.0),
+        get("discount", 0.0),
+        get("price_after_discounts", 0.0),
+        get("bonuses", 0),
+        get("sales", 0),
+        get("currency", ""),
+        get("barcode", ""),
+    )
+    attributes = extract_attributes(content[2], features)
+    return OfferRecord(sku_uuid(marketplace_id, product_id), *content, _hash_content(content, attributes), attributes)
+
+
+def parse_offer(elem: ET.Element, category_paths: dict[int, CategoryPath]) -> SKU:
+    """
+    Извлекает информацию о товаре из XML-элемента <offer> и создает объект SKU.
+
+    :param elem: Элемент XML <offer>.
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :return: Объект SKU с данными о товаре.
+    """
+    return parse_offer_record(elem, category_paths).to_sku()
+
+
+def iter_offers(
+    file_path: str, category_paths: dict[int, CategoryPath], resume_after: tuple[int, int] | None = None
+) -> Iterator[OfferRecord]:
+    """
+    Парсит XML-файл и извлекает информацию о товарах в виде записей OfferRecord.
+
+    Синхронная версия parse_offers для парсинга в отдельном потоке.
+
+    :param file_path: Путь к XML-файлу (.xml, .xml.gz или .xml.zst).
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+                         Офферы до него включительно пропускаются без извлечения полей.
+    :yield: Записи OfferRecord с данными о товарах.
+    """
+    profiler = get_offer_profiler()
+    with open_feed(file_path) as feed:
+        context = ET.iterparse(feed, events=("end",), tag="offer")
+
+        for _, elem in context:
+            try:
+                if resume_after is not None:
+                    if (int(elem.get("marketplace_id", 0)), int(elem.get("id", 0))) == resume_after:
+                        resume_after = None
+                    continue
+                if profiler is not None:
+                    yield profiler.call(parse_offer_record, elem, category_paths)
+                else:
+                    yield parse_offer_record(elem, category_paths)
+            except Exception as e:
+                record_errors(STAGE_PARSE)
+                logger.warning("Error parsing element: %s", e)
+            finally:
+                elem.clear()  # Очищаем элемент для экономии памяти
+
+
+async def parse_offers(
+    file_path: str, category_paths: dict[int, CategoryPath], resume_after: tuple[int, int] | None = None
+) -> AsyncGenerator[OfferRecord, None]:
+    """
+    Парсит XML-файл и извлекает информацию о товарах в виде записей OfferRecord.
+
+    :param file_path: Путь к XML-файлу (.xml, .xml.gz или .xml.zst).
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+                         Офферы до него включительно пропускаются без извлечения полей.
+    :yield: Записи OfferRecord с данными о товарах.
+    """
+    # Разбор идет в отдельном потоке пачками, чтобы не блокировать цикл событий
+    async for batch in aiterate_in_thread(
+        batched(iter_offers(file_path, category_paths, resume_after), THREAD_BATCH_SIZE)
+    ):
+        for record in batch:
+            yield record
 
 
-async def parse_xml(
-    file_path: str, categories: dict[int, str], parent_map: dict[int, int]
-) -> AsyncGenerator[SKU, None]:
+async def parse_xml(file_path: str, category_paths: dict[int, CategoryPath]) -> AsyncGenerator[SKU, None]:
     """
     Парсит XML-файл и извлекает информацию о товарах, создавая объекты SKU.
 
     :param file_path: Путь к XML-файлу.
-    :param categories: Словарь с категориями.
-    :param parent_map: Словарь с родительскими категориями.
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
     :yield: Объекты SKU с данными о товарах.
     """
-    context = ET.iterparse(file_path, events=("end",), tag="offer")
+    async for record in parse_offers(file_path, category_paths):
+        yield record.to_sku()
+
+
+class ParseOptions(NamedTuple):
+    """
+    Параметры парсинга фида.
+
+    - workers: Количество процессов для параллельного парсинга. 0 — парсинг в текущем процессе.
+    - chunk_bytes: Примерный размер куска файла, который парсит один воркер.
+    - ordered: Отдавать офферы в порядке файла (True) или по мере готовности кусков (False).
+    """
+
+    workers: int = 0
+    chunk_bytes: int = 16 * 1024 * 1024
+    ordered: bool = True
+
+
+def find_offer_chunks(file_path: str, chunk_bytes: int) -> tuple[bytes, list[tuple[int, int]]]:
+    """
+    Делит файл на куски, границы которых совпадают с началом элементов <offer>.
+
+    Файл отображается в память, и ищется только первый <offer> после каждой
+    отметки в chunk_bytes, поэтому разбиение не требует чтения файла целиком.
+
+    :param file_path: Путь к XML-файлу.
+    :param chunk_bytes: Примерный размер куска в байтах.
+    :return: Кортеж из XML-пролога (<?xml ...?>, может быть пустым) и списка
+             диапазонов (start, end) в байтах. Каждый диапазон содержит только целые офферы.
+    """
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        prolog = mm[: mm.find(b"?>") + 2] if mm[:5] == b"<?xml" else b""
+
+        first = OFFER_START_RE.search(mm)
+        if first is None:
+            return prolog, []
+        end = mm.rfind(b"</offers>")
+        if end < 0:
+            end = len(mm)
+
+        boundaries = [first.start()]
+        while True:
+            match = OFFER_START_RE.search(mm, boundaries[-1] + chunk_bytes)
+            if match is None or match.start() >= end:
+                break
+            boundaries.append(match.start())
+        boundaries.append(end)
 
-    for _, elem in context:
+    return prolog, list(zip(boundaries, boundaries[1:]))
+
+
+def _init_parse_worker(category_paths: dict[int, CategoryPath]) -> None:
+    """
+    Инициализирует процесс-воркер: сохраняет таблицу путей категорий, общую для всех кусков файла.
+    """
+    global _worker_category_paths
+    _worker_category_paths = category_paths
+
+
+def _parse_chunk(
+    file_path: str, prolog: bytes, start: int, end: int, resume_after: tuple[int, int] | None = None
+) -> tuple[list[OfferRecord], int, bool]:
+    """
+    Парсит офферы из диапазона байтов файла в процессе-воркере.
+
+    Диапазон оборачивается в <offers>...</offers> с исходным XML-прологом,
+    чтобы кодировка документа определялась так же, как при парсинге всего файла.
+
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+                         Офферы до него включительно пропускаются без извлечения полей.
+    :return: Записи офферов, количество офферов, которые не удалось разобрать
+             (метрики воркера не видны основному процессу, поэтому ошибки возвращаются),
+             и признак того, что оффер resume_after найден в куске (True, если он не задан).
+    """
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    records = []
+    errors = 0
+    document = io.BytesIO(prolog + b"<offers>" + data + b"</offers>")
+    for _, elem in ET.iterparse(document, events=("end",), tag="offer"):
         try:
-            # Извлекаем информацию о товаре
-            marketplace_id = elem.get("marketplace_id")
-            product_id = elem.get("id")
-            seller_id = elem.findtext("sellerId")
-            category_id = elem.findtext("categoryId")
-
-            # Получаем категорию товара и строим путь категорий
-            category_id = int(category_id) if category_id else 0
-            category_path = get_category_path(category_id, categories, parent_map)
-
-            # Разбираем категории по уровням
-            category_lvl_1 = category_path[0] if len(category_path) > 0 else ""
-            category_lvl_2 = category_path[1] if len(category_path) > 1 else ""
-            category_lvl_3 = category_path[2] if len(category_path) > 2 else ""
-            category_remaining = "/".join(category_path[3:]) if len(category_path) > 3 else ""
-
-            # Создаем объект SKU с заполненными полями
-            sku = SKU(
-                uuid=uuid.uuid4(),
-                marketplace_id=int(marketplace_id) if marketplace_id is not None else 0,
-                product_id=int(product_id) if product_id is not None else 0,
-                title=elem.findtext("name") or "",
-                description=elem.findtext("description") or "",
-                brand=elem.findtext("vendor") or "",
-                seller_id=int(seller_id) if seller_id is not None else 0,
-                seller_name=elem.findtext("sellerName") or "",
-                first_image_url=elem.findtext("picture") or "",
-                category_id=category_id,
-                category_lvl_1=category_lvl_1,
-                category_lvl_2=category_lvl_2,
-                category_lvl_3=category_lvl_3,
-                category_remaining=category_remaining,
-                features=parse_features(elem),
-                rating_count=(int(elem.findtext("rating_count")) if elem.findtext("rating_count") else 0),
-                rating_value=(float(elem.findtext("rating_value")) if elem.findtext("rating_value") else 0.0),
-                price_before_discounts=(
-                    float(elem.findtext("price_before_discounts")) if elem.findtext("price_before_discounts") else 0.0
-                ),
-                discount=(float(elem.findtext("discount")) if elem.findtext("discount") else 0.0),
-                price_after_discounts=(
-                    float(elem.findtext("price_after_discounts")) if elem.findtext("price_after_discounts") else 0.0
-                ),
-                bonuses=(int(elem.findtext("bonuses")) if elem.findtext("bonuses") else 0),
-                sales=int(elem.findtext("sales")) if elem.findtext("sales") else 0,
-                currency=elem.findtext("currency") or "",
-                barcode=(str(elem.findtext("barcode")) if elem.findtext("barcode") else ""),
-                similar_sku=[],  # Инициализируем пустым списком
-            )
-            yield sku
+            if resume_after is not None:
+                if (int(elem.get("marketplace_id", 0)), int(elem.get("id", 0))) == resume_after:
+                    resume_after = None
+                continue
+            records.append(parse_offer_record(elem, _worker_category_paths))
         except Exception as e:
-            print(f"Error parsing element: {e}")
+            errors += 1
+            logger.warning("Error parsing element: %s", e)
         finally:
-            elem.clear()  # Очищаем элемент для экономии памяти
+            elem.clear()
+    return records, errors, resume_after is None
+
+
+async def parse_xml_parallel(
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    workers: int,
+    chunk_bytes: int = 16 * 1024 * 1024,
+    ordered: bool = True,
+    resume_after: tuple[int, int] | None = None,
+) -> AsyncGenerator[OfferRecord, None]:
+    """
+    Парсит XML-файл в нескольких процессах, разбивая его на куски по границам <offer>.
+
+    Разбор выполняется вне цикла событий. Одновременно в работе находится не более
+    2 * workers кусков, поэтому расход памяти не зависит от размера файла.
+
+    При продолжении загрузки (resume_after) куски, пока не найден оффер resume_after, разбираются
+    в режиме пропуска: у офферов читается только ключ, поля не извлекаются. Куски, отправленные
+    в режиме пропуска после куска с этим оффером, отправляются повторно без пропуска.
+
+    :param file_path: Путь к XML-файлу.
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :param workers: Количество процессов.
+    :param chunk_bytes: Примерный размер куска файла в байтах.
+    :param ordered: Отдавать офферы в порядке файла (True) или по мере готовности кусков (False).
+                    При продолжении загрузки офферы всегда отдаются в порядке файла.
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+    :yield: Записи OfferRecord с данными о товарах.
+    """
+    ordered = ordered or resume_after is not None
+    loop = asyncio.get_running_loop()
+    prolog, chunks = await asyncio.to_thread(find_offer_chunks, file_path, chunk_bytes)
+    pending_chunks = deque(chunks)
+    max_in_flight = 2 * workers
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_parse_worker, initargs=(category_paths,)
+    ) as executor:
+        in_flight: deque[asyncio.Future] = deque()
+        # Диапазон каждого куска в работе, чтобы отправить его повторно
+        chunk_of: dict[asyncio.Future, tuple[int, int]] = {}
+
+        def submit() -> None:
+            while pending_chunks and len(in_flight) < max_in_flight:
+                start, end = pending_chunks.popleft()
+                future = loop.run_in_executor(executor, _parse_chunk, file_path, prolog, start, end, resume_after)
+                in_flight.append(future)
+                chunk_of[future] = (start, end)
+
+        depth = QUEUE_DEPTH.labels("parse_chunks")
+        submit()
+        while in_flight:
+            depth.set(len(in_flight))
+            if ordered:
+                future = in_flight.popleft()
+                await future
+            else:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                future = done.pop()
+                in_flight.remove(future)
+            del chunk_of[future]
+            records, errors, found = future.result()
+            record_errors(STAGE_PARSE, errors)
+            if resume_after is not None and found:
+                # Следующие куски в работе разбирались с пропуском и не содержат оффера resume_after
+                resume_after = None
+                for skipped in reversed(in_flight):
+                    skipped.cancel()
+                    pending_chunks.appendleft(chunk_of.pop(skipped))
+                in_flight.clear()
+            submit()
+            for record in records:
+                yield record
+
+
+async def parse_xml_batches(
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    batch_size: int,
+    options: ParseOptions = ParseOptions(),
+    resume_after: tuple[int, int] | None = None,
+) -> AsyncGenerator[list[OfferRecord], None]:
+    """
+    Парсит XML-файл и отдает записи OfferRecord пачками.
+
+    :param file_path: Путь к XML-файлу (.xml, .xml.gz или .xml.zst).
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :param batch_size: Максимальный размер пачки.
+    :param options: Параметры парсинга (количество процессов, размер кусков, порядок).
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+                         Офферы до него включительно пропускаются без извлечения полей,
+                         остальные отдаются в порядке файла.
+    :yield: Списки записей OfferRecord длиной не более batch_size.
+    """
+    if options.workers == 0 or is_compressed_feed(file_path):
+        # Сжатый фид нельзя разбить на куски по смещениям в файле, он всегда парсится в одном процессе.
+        # Разбор идет в отдельном потоке, чтобы цикл событий тем временем выполнял запросы к БД и Elasticsearch
+        async for batch in aiterate_in_thread(iter_offer_batches(file_path, category_paths, batch_size, resume_after)):
+            yield batch
+        return
+
+    records = parse_xml_parallel(
+        file_path, category_paths, options.workers, options.chunk_bytes, options.ordered, resume_after
+    )
+    started = time.perf_counter()
+    async for batch in abatched(records, batch_size):
+        _observe_batch(batch, category_paths, started)
+        yield batch
+        started = time.perf_counter()
+
+
+def iter_offer_batches(
+    file_path: str,
+    category_paths: dict[int, CategoryPath],
+    batch_size: int,
+    resume_after: tuple[int, int] | None = None,
+) -> Iterator[list[OfferRecord]]:
+    """
+    Парсит XML-файл в текущем потоке и отдает записи OfferRecord пачками.
+
+    :param file_path: Путь к XML-файлу (.xml, .xml.gz или .xml.zst).
+    :param category_paths: Таблица путей категорий (см. build_category_paths).
+    :param batch_size: Максимальный размер пачки.
+    :param resume_after: Ключ (marketplace_id, product_id) последнего уже обработанного оффера.
+                         Офферы до него включительно пропускаются без извлечения полей.
+    :yield: Списки записей OfferRecord длиной не более batch_size.
+    """
+    started = time.perf_counter()
+    for batch in batched(iter_offers(file_path, category_paths, resume_after), batch_size):
+        _observe_batch(batch, category_paths, started)
+        yield batch
+        started = time.perf_counter()
+
+
+def _observe_batch(batch: list[OfferRecord], category_paths: dict[int, CategoryPath], started: float) -> None:
+    """
+    Записывает метрики парсинга пачки: длительность и офферы с неизвестной категорией.
+    """
+    observe(STAGE_PARSE, time.perf_counter() - started, len(batch))
+    misses = sum(1 for record in batch if record.category_id and record.category_id not in category_paths)
+    if misses:
+        CATEGORY_MISSES.inc(misses)
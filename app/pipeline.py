@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import CancelledError
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, NamedTuple
+
+from app.metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Признак конца потока в очереди между этапами
+_END = object()
+
+# Как часто поток-источник проверяет, не остановлен ли конвейер, пока очередь заполнена
+_THREAD_PUT_TIMEOUT = 0.5
+
+
+class Stage(NamedTuple):
+    """
+    Этап конвейера.
+
+    - name: Название этапа (метка очереди перед этапом в метрике ingest_queue_depth).
+    - handler: Асинхронная функция, обрабатывающая один элемент. Ее результат передается
+      следующему этапу; результат последнего этапа отбрасывается.
+    - concurrency: Количество элементов, которые этап обрабатывает одновременно.
+    """
+
+    name: str
+    handler: Callable[[Any], Awaitable[Any]]
+    concurrency: int = 1
+
+
+class PipelineOptions(NamedTuple):
+    """
+    Параметры конвейера поточной загрузки.
+
+    - queue_size: Вместимость очереди перед каждым этапом (в пачках). Когда очередь заполнена,
+      предыдущий этап, а в итоге и парсер, ждет медленный этап.
+    - db_writers: Количество одновременных записей пачек в БД.
+    - es_writers: Количество одновременных bulk-запросов в Elasticsearch.
+    - similarity_workers: Количество пачек, для которых похожие ищутся одновременно.
+    """
+
+    queue_size: int = 4
+    db_writers: int = 2
+    es_writers: int = 2
+    similarity_workers: int = 2
+
+
+async def run_pipeline(source: AsyncIterable | Iterable, stages: list[Stage], queue_size: int = 4) -> None:
+    """
+    Пропускает элементы источника через этапы, соединенные ограниченными очередями asyncio.Queue.
+
+    Все этапы работают одновременно: пока один этап обрабатывает пачку, предыдущий готовит
+    следующую. Очереди ограничены queue_size элементами, поэтому быстрый этап не уходит
+    вперед медленного дальше чем на queue_size элементов, и память не растет с размером фида.
+
+    Синхронный источник (например, парсер XML) читается в отдельном потоке, чтобы не блокировать
+    цикл событий, асинхронный — в цикле событий. Ошибка любого этапа останавливает конвейер
+    и пробрасывается.
+
+    Args:
+        source (AsyncIterable | Iterable): Источник элементов.
+        stages (list[Stage]): Этапы в порядке обработки.
+        queue_size (int): Вместимость очереди перед каждым этапом.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(_feed(source, queues[0], stages[0].name))
+            for position, stage in enumerate(stages):
+                outbox = queues[position + 1] if position + 1 < len(stages) else None
+                outbox_name = stages[position + 1].name if outbox is not None else None
+                group.create_task(_run_stage(stage, queues[position], outbox, outbox_name))
+    except ExceptionGroup as errors:
+        # Первая ошибка останавливает конвейер, остальные задачи только отменяются
+        error = errors
+        while isinstance(error, ExceptionGroup):
+            error = error.exceptions[0]
+        raise error
+
+
+async def _put(queue: asyncio.Queue, item: Any, name: str) -> None:
+    """
+    Кладет элемент в очередь, ожидая свободное место, и обновляет метрику глубины очереди.
+    """
+    await queue.put(item)
+    QUEUE_DEPTH.labels(name).set(queue.qsize())
+
+
+async def _feed(source: AsyncIterable | Iterable, queue: asyncio.Queue, name: str) -> None:
+    """
+    Перекладывает элементы источника в очередь первого этапа.
+    """
+    if isinstance(source, AsyncIterable):
+        async for item in source:
+            await _put(queue, item, name)
+    else:
+        stopped = threading.Event()
+        try:
+            await asyncio.to_thread(_feed_from_thread, source, queue, name, asyncio.get_running_loop(), stopped)
+        finally:
+            # При остановке конвейера поток заканчивает работу, не дожидаясь места в очереди
+            stopped.set()
+    await queue.put(_END)
+
+
+def _feed_from_thread(
+    source: Iterable, queue: asyncio.Queue, name: str, loop: asyncio.AbstractEventLoop, stopped: threading.Event
+) -> None:
+    """
+    Читает синхронный источник в отдельном потоке и кладет элементы в очередь цикла событий.
+    """
+    for item in source:
+        while True:
+            if stopped.is_set():
+                return
+            future = asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(_put(queue, item, name), _THREAD_PUT_TIMEOUT), loop
+            )
+            try:
+                future.result()
+                break
+            except TimeoutError:
+                continue
+            except CancelledError:
+                return
+
+
+async def _run_stage(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue | None, outbox_name: str | None) -> None:
+    """
+    Обрабатывает элементы очереди stage.concurrency обработчиками и передает результаты в следующую очередь.
+    """
+
+    async def worker() -> None:
+        while True:
+            item = await inbox.get()
+            QUEUE_DEPTH.labels(stage.name).set(inbox.qsize())
+            if item is _END:
+                # Признак конца нужен и остальным обработчикам этапа
+                await inbox.put(_END)
+                return
+            result = await stage.handler(item)
+            if outbox is not None:
+                await _put(outbox, result, outbox_name)
+
+    async with asyncio.TaskGroup() as group:
+        for _ in range(max(stage.concurrency, 1)):
+            group.create_task(worker())
+    logger.debug("Pipeline stage %s finished", stage.name)
+    if outbox is not None:
+        await outbox.put(_END)
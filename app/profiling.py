@@ -0,0 +1,102 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+from typing import Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Профилировщик офферов текущего процесса, см. install_offer_profiler
+_offer_profiler: "OfferProfiler | None" = None
+
+
+class OfferProfiler:
+    """
+    Профилирует обработку случайной доли офферов.
+
+    Профилировщик включается только на время обработки выбранных офферов, поэтому остальные
+    офферы обрабатываются без накладных расходов, а результат описывает типичный оффер.
+
+    Поддерживаются бэкенды cprofile (детерминированный, из стандартной библиотеки; результат
+    в формате pstats) и pyinstrument (сэмплирующий, нужен пакет pyinstrument; результат в HTML).
+    """
+
+    def __init__(self, sample_rate: float, output_path: str, backend: str = "cprofile") -> None:
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+        self.sample_rate = sample_rate
+        self.output_path = output_path
+        self.backend = backend
+        self.profiled = 0
+        self._random = random.Random()
+
+        if backend == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._start, self._stop = self._profiler.enable, self._profiler.disable
+        elif backend == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise RuntimeError("pyinstrument profiling backend requires the pyinstrument package") from e
+            self._profiler = Profiler(interval=0.0001, async_mode="disabled")
+            self._start, self._stop = self._profiler.start, self._profiler.stop
+        else:
+            raise ValueError(f"Unknown profiling backend: {backend}")
+
+    def call(self, func: Callable[..., T], *args) -> T:
+        """
+        Вызывает func(*args), профилируя вызов с вероятностью sample_rate.
+        """
+        if self._random.random() >= self.sample_rate:
+            return func(*args)
+        self.profiled += 1
+        self._start()
+        try:
+            return func(*args)
+        finally:
+            self._stop()
+
+    def dump(self) -> None:
+        """
+        Сохраняет результат профилирования в output_path и выводит в лог самые дорогие функции.
+        """
+        if not self.profiled:
+            logger.info("No offers were sampled for profiling")
+            return
+
+        if self.backend == "cprofile":
+            self._profiler.dump_stats(self.output_path)
+            report = io.StringIO()
+            pstats.Stats(self._profiler, stream=report).sort_stats("cumulative").print_stats(20)
+            logger.info("Profile of %d sampled offers:\n%s", self.profiled, report.getvalue())
+        else:
+            with open(self.output_path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        logger.info("Saved profile of %d sampled offers to %s", self.profiled, self.output_path)
+
+
+def install_offer_profiler(sample_rate: float, output_path: str, backend: str = "cprofile") -> OfferProfiler:
+    """
+    Включает профилирование доли офферов при парсинге фида в текущем процессе.
+
+    Args:
+        sample_rate (float): Доля профилируемых офферов (0, 1].
+        output_path (str): Файл для результата профилирования.
+        backend (str): Бэкенд профилирования: cprofile или pyinstrument.
+
+    Returns:
+        OfferProfiler: Установленный профилировщик.
+    """
+    global _offer_profiler
+    _offer_profiler = OfferProfiler(sample_rate, output_path, backend)
+    return _offer_profiler
+
+
+def get_offer_profiler() -> OfferProfiler | None:
+    """
+    Возвращает профилировщик офферов текущего процесса или None, если профилирование выключено.
+    """
+    return _offer_profiler
@@ -0,0 +1,572 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, NamedTuple
+
+import asyncpg
+from aiohttp import web
+from elasticsearch import AsyncElasticsearch
+from environs import Env
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.attributes import ATTRIBUTE_KEYS, MATCH_KEYS
+from app.cache import TTLCache
+from app.es_utils import BlockingOptions, MltOptions, find_similar_skus_batch, init_es
+from app.metrics import SIMILAR_LOOKUPS, SIMILAR_REQUEST_SECONDS
+from app.models import SIMILARITY_CHANNEL, SKU, SKU_DELETED_CHANNEL, SkuSimilarity
+from app.worker import mlt_options_from_env
+
+logger = logging.getLogger(__name__)
+
+# Похожие SKU товара в том виде, в котором они отдаются клиенту: [{"uuid": ..., "score": ...}, ...]
+Similar = list[dict]
+
+# Пауза перед повторным подключением слушателя уведомлений
+LISTEN_RETRY_DELAY = 5.0
+# Количество офферов с совпадающими атрибутами в ответе по умолчанию
+DEFAULT_MATCHES_LIMIT = 50
+
+
+class ServiceOptions(NamedTuple):
+    """
+    Параметры сервиса похожих товаров.
+
+    - cache_size: Максимальное количество товаров в кэше.
+    - cache_ttl: Время жизни записи кэша в секундах.
+    - negative_ttl: Время жизни в кэше пустого результата (похожие не найдены) в секундах.
+    - live_fallback: Искать похожие запросом "more_like_this", если их нет в sku_similarity.
+    - max_batch: Максимальное количество товаров в одном пакетном запросе.
+    - blocking: Параметры блокировки для поиска "more_like_this".
+    - mlt: Параметры запроса "more_like_this".
+    """
+
+    cache_size: int = 100000
+    cache_ttl: float = 300.0
+    negative_ttl: float = 10.0
+    live_fallback: bool = True
+    max_batch: int = 1000
+    blocking: BlockingOptions = BlockingOptions()
+    mlt: MltOptions = MltOptions()
+
+
+class SimilarService:
+    """
+    Отдает похожие SKU товаров, вычисленные загрузкой фида.
+
+    Похожие товары ищутся сначала в кэше процесса, затем одним запросом в таблице sku_similarity,
+    а для товаров, которых там еще нет (загрузка не дошла до поиска похожих), — запросом
+    "more_like_this" в Elasticsearch. Результаты из БД и Elasticsearch кэшируются, пустой результат —
+    на короткое время negative_ttl, чтобы повторные запросы товаров без похожих не доходили до БД
+    и Elasticsearch, а похожие, найденные загрузкой позже, появлялись быстро.
+
+    Загрузка уведомляет об изменении похожих через LISTEN/NOTIFY (см. db.notify_similarity_changed),
+    и сервис удаляет из кэша записи измененных товаров, а об удалении офферов — через канал
+    SKU_DELETED_CHANNEL (см. db.notify_skus_deleted), и сервис забывает их UUID. Пока слушатель
+    не подключен, уведомления теряются, поэтому при каждом подключении кэши очищаются; TTL ограничивает
+    устаревание записей на случай, если уведомления не доходят.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        es_client: AsyncElasticsearch | None,
+        listen: Callable[[], Awaitable[asyncpg.Connection]],
+        options: ServiceOptions = ServiceOptions(),
+    ) -> None:
+        self.pool = pool
+        self.es_client = es_client
+        self.options = options
+        self.cache: TTLCache[uuid.UUID, Similar] = TTLCache(options.cache_size, options.cache_ttl)
+        # Соответствие (marketplace_id, product_id) -> UUID не меняется, пока товар существует
+        self.offer_ids: TTLCache[tuple[int, int], uuid.UUID] = TTLCache(options.cache_size, options.cache_ttl)
+        self._listen = listen
+        self._listener: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """
+        Запускает слушателя уведомлений об изменении похожих товаров.
+        """
+        self._listener = asyncio.create_task(self._listen_forever())
+
+    async def close(self) -> None:
+        """
+        Останавливает слушателя и закрывает соединения.
+        """
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self.pool.close()
+        if self.es_client is not None:
+            await self.es_client.close()
+
+    async def _listen_forever(self) -> None:
+        """
+        Держит отдельное соединение, подписанное на SIMILARITY_CHANNEL, и переподключается при разрыве.
+        """
+        while True:
+            try:
+                conn = await self._listen()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Failed to connect similarity listener: %r", e)
+                await asyncio.sleep(LISTEN_RETRY_DELAY)
+                continue
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _: closed.set())
+            try:
+                await conn.add_listener(SIMILARITY_CHANNEL, self._on_notify)
+                await conn.add_listener(SKU_DELETED_CHANNEL, self._on_sku_deleted)
+                # Уведомления, отправленные до подписки, потеряны
+                self.cache.clear()
+                self.offer_ids.clear()
+                logger.info("Listening for similarity updates on %s", SIMILARITY_CHANNEL)
+                await closed.wait()
+                logger.warning("Similarity listener disconnected")
+            finally:
+                await conn.close()
+            self.cache.clear()
+            self.offer_ids.clear()
+            await asyncio.sleep(LISTEN_RETRY_DELAY)
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        """
+        Удаляет из кэша товары из уведомления; "*" очищает кэш целиком.
+        """
+        if payload == "*":
+            self.cache.clear()
+            return
+        try:
+            sku_ids = [uuid.UUID(value) for value in payload.split(",")]
+        except ValueError:
+            logger.warning("Malformed similarity notification, clearing cache: %r", payload[:100])
+            self.cache.clear()
+            return
+        self.cache.invalidate(sku_ids)
+
+    def _on_sku_deleted(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        """
+        Удаляет из кэша UUID удаленных офферов "marketplace_id:product_id"; "*" очищает кэш целиком.
+        """
+        if payload == "*":
+            self.offer_ids.clear()
+            return
+        try:
+            offers = [tuple(map(int, value.split(":"))) for value in payload.split(",")]
+        except ValueError:
+            logger.warning("Malformed deletion notification, clearing cache: %r", payload[:100])
+            self.offer_ids.clear()
+            return
+        self.offer_ids.invalidate(offers)
+
+    async def resolve_offers(self, offers: list[tuple[int, int]]) -> dict[tuple[int, int], uuid.UUID]:
+        """
+        Находит UUID товаров по ключам офферов (marketplace_id, product_id).
+
+        Параметры:
+        - offers: Список ключей офферов.
+
+        Возвращает:
+        - Словарь ключ оффера -> UUID. Офферов, которых нет в БД, в словаре нет.
+        """
+        resolved = {}
+        missing = []
+        for offer in offers:
+            sku_id = self.offer_ids.get(offer)
+            if sku_id is None:
+                missing.append(offer)
+            else:
+                resolved[offer] = sku_id
+        if missing:
+            # Оффер, удаленный во время запроса, не должен попасть в кэш
+            generation = self.offer_ids.generation
+            rows = await self.pool.fetch(
+                f"""
+                SELECT sku.marketplace_id, sku.product_id, sku.uuid
+                FROM {SKU.__tablename__} AS sku
+                JOIN unnest($1::integer[], $2::bigint[]) AS k(marketplace_id, product_id)
+                  ON sku.marketplace_id = k.marketplace_id AND sku.product_id = k.product_id
+                WHERE sku.deleted_at IS NULL
+                """,
+                [marketplace_id for marketplace_id, _ in missing],
+                [product_id for _, product_id in missing],
+            )
+            for marketplace_id, product_id, sku_id in rows:
+                resolved[(marketplace_id, product_id)] = sku_id
+                self.offer_ids.set((marketplace_id, product_id), sku_id, generation)
+        return resolved
+
+    async def lookup(self, sku_ids: list[uuid.UUID]) -> dict[uuid.UUID, Similar]:
+        """
+        Находит похожие SKU для списка товаров: в кэше, в таблице sku_similarity, запросом "more_like_this".
+
+        Параметры:
+        - sku_ids: Список UUID товаров.
+
+        Возвращает:
+        - Словарь UUID товара -> похожие SKU в порядке выдачи. Для товаров, похожие которых
+          не удалось найти, список пуст. Пустой результат кэшируется на negative_ttl, если поиск
+          не завершился ошибкой.
+        """
+        found: dict[uuid.UUID, Similar] = {}
+        missing = []
+        for sku_id in dict.fromkeys(sku_ids):
+            similar = self.cache.get(sku_id)
+            if similar is None:
+                missing.append(sku_id)
+            else:
+                found[sku_id] = similar
+        SIMILAR_LOOKUPS.labels("cache").inc(len(found))
+        if not missing:
+            return found
+
+        # Запись, прочитанная до уведомления об изменении, не должна попасть в кэш после него
+        generation = self.cache.generation
+        from_db = await self._fetch_similar(missing)
+        SIMILAR_LOOKUPS.labels("db").inc(len(from_db))
+        missing = [sku_id for sku_id in missing if sku_id not in from_db]
+
+        from_es: dict[uuid.UUID, Similar] = {}
+        failed: dict[uuid.UUID, str] = {}
+        if missing and self.es_client is not None and self.options.live_fallback:
+            similar, failed = await find_similar_skus_batch(
+                self.es_client,
+                missing,
+                batch_size=len(missing),
+                blocking=self.options.blocking,
+                mlt=self.options.mlt,
+            )
+            for sku_id, error in failed.items():
+                logger.warning("Failed to search similar SKUs for %s: %s", sku_id, error)
+            from_es = {sku_id: _to_similar(items) for sku_id, items in similar.items()}
+            SIMILAR_LOOKUPS.labels("mlt").inc(len(from_es))
+
+        for sku_id, similar in (*from_db.items(), *from_es.items()):
+            found[sku_id] = similar
+            self.cache.set(sku_id, similar, generation)
+        not_found = [sku_id for sku_id in missing if sku_id not in from_es]
+        SIMILAR_LOOKUPS.labels("none").inc(len(not_found))
+        for sku_id in not_found:
+            found[sku_id] = []
+            if sku_id not in failed:
+                self.cache.set(sku_id, [], generation, ttl=self.options.negative_ttl)
+        return found
+
+    async def matches(self, sku_id: uuid.UUID, keys: tuple[str, ...], limit: int) -> list[dict] | None:
+        """
+        Находит офферы той же категории, у которых атрибуты keys совпадают с атрибутами товара.
+
+        Условие attributes @> {...} выполняется по GIN-индексу sku_attributes_index, поэтому
+        запрос не перебирает всю таблицу. Атрибуты, которых у товара нет, не сравниваются.
+
+        Параметры:
+        - sku_id: UUID товара.
+        - keys: Сравниваемые атрибуты (см. app.attributes).
+        - limit: Максимальное количество офферов в ответе.
+
+        Возвращает:
+        - Список офферов с uuid, marketplace_id, product_id, title и attributes или None, если товара нет.
+          Пустой список, если у товара нет ни одного из атрибутов keys.
+        """
+        source = await self.pool.fetchrow(
+            f"""
+            SELECT category_lvl_1, category_lvl_2, category_lvl_3, attributes FROM {SKU.__tablename__}
+            WHERE uuid = $1 AND deleted_at IS NULL
+            """,
+            sku_id,
+        )
+        if source is None:
+            return None
+        attributes = json.loads(source["attributes"] or "{}")
+        wanted = {key: attributes[key] for key in keys if key in attributes}
+        if not wanted:
+            return []
+        rows = await self.pool.fetch(
+            f"""
+            SELECT uuid, marketplace_id, product_id, title, attributes FROM {SKU.__tablename__}
+            WHERE attributes @> $1::jsonb
+              AND category_lvl_1 IS NOT DISTINCT FROM $2
+              AND category_lvl_2 IS NOT DISTINCT FROM $3
+              AND category_lvl_3 IS NOT DISTINCT FROM $4
+              AND uuid <> $5 AND deleted_at IS NULL
+            ORDER BY uuid
+            LIMIT $6
+            """,
+            json.dumps(wanted, ensure_ascii=False),
+            source["category_lvl_1"],
+            source["category_lvl_2"],
+            source["category_lvl_3"],
+            sku_id,
+            limit,
+        )
+        return [
+            {
+                "uuid": str(row["uuid"]),
+                "marketplace_id": row["marketplace_id"],
+                "product_id": row["product_id"],
+                "title": row["title"],
+                "attributes": json.loads(row["attributes"] or "{}"),
+            }
+            for row in rows
+        ]
+
+    async def _fetch_similar(self, sku_ids: list[uuid.UUID]) -> dict[uuid.UUID, Similar]:
+        """
+        Читает похожие SKU товаров из таблицы sku_similarity одним запросом по первичному ключу.
+        """
+        rows = await self.pool.fetch(
+            f"""
+            SELECT src_uuid, dst_uuid, score FROM {SkuSimilarity.__tablename__}
+            WHERE src_uuid = ANY($1::uuid[])
+            ORDER BY src_uuid, rank
+            """,
+            sku_ids,
+        )
+        similar: dict[uuid.UUID, Similar] = {}
+        for src_uuid, dst_uuid, score in rows:
+            similar.setdefault(src_uuid, []).append({"uuid": str(dst_uuid), "score": score})
+        return similar
+
+
+def _to_similar(items: list[tuple[uuid.UUID, float]]) -> Similar:
+    """
+    Преобразует пары (UUID похожего SKU, оценка) в ответ клиенту.
+    """
+    return [{"uuid": str(sku_id), "score": score} for sku_id, score in items]
+
+
+SERVICE = web.AppKey("service", SimilarService)
+
+
+def _parse_uuid(value) -> uuid.UUID:
+    """
+    Разбирает UUID из запроса, отвечая 400 на некорректное значение.
+    """
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        raise web.HTTPBadRequest(reason=f"Invalid uuid: {value!r}")
+
+
+def _parse_offer(marketplace_id, product_id) -> tuple[int, int]:
+    """
+    Разбирает ключ оффера из запроса, отвечая 400 на некорректное значение.
+    """
+    try:
+        return int(marketplace_id), int(product_id)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason=f"Invalid offer key: {marketplace_id!r}, {product_id!r}")
+
+
+def timed(endpoint: str):
+    """
+    Замеряет длительность обработки запроса в метрике SIMILAR_REQUEST_SECONDS.
+    """
+
+    def decorator(handler):
+        async def wrapper(request: web.Request) -> web.StreamResponse:
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                SIMILAR_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+@timed("sku")
+async def similar_by_uuid(request: web.Request) -> web.Response:
+    """
+    GET /skus/{uuid}/similar — похожие SKU товара.
+    """
+    sku_id = _parse_uuid(request.match_info["uuid"])
+    found = await request.app[SERVICE].lookup([sku_id])
+    return web.json_response({"uuid": str(sku_id), "similar": found[sku_id]})
+
+
+@timed("offer")
+async def similar_by_offer(request: web.Request) -> web.Response:
+    """
+    GET /offers/{marketplace_id}/{product_id}/similar — похожие SKU товара по ключу оффера.
+    """
+    service = request.app[SERVICE]
+    offer = _parse_offer(request.match_info["marketplace_id"], request.match_info["product_id"])
+    sku_id = (await service.resolve_offers([offer])).get(offer)
+    if sku_id is None:
+        raise web.HTTPNotFound(reason="Offer not found")
+    found = await service.lookup([sku_id])
+    return web.json_response(
+        {"marketplace_id": offer[0], "product_id": offer[1], "uuid": str(sku_id), "similar": found[sku_id]}
+    )
+
+
+@timed("matches")
+async def matches_by_uuid(request: web.Request) -> web.Response:
+    """
+    GET /skus/{uuid}/matches — офферы той же категории с теми же атрибутами (точное сопоставление).
+
+    Параметры запроса: keys — сравниваемые атрибуты через запятую (по умолчанию код модели,
+    память и диагональ), limit — максимальное количество офферов.
+    """
+    service = request.app[SERVICE]
+    sku_id = _parse_uuid(request.match_info["uuid"])
+    keys = tuple(key for key in request.query.get("keys", ",".join(MATCH_KEYS)).split(",") if key)
+    unknown = set(keys) - set(ATTRIBUTE_KEYS)
+    if not keys or unknown:
+        raise web.HTTPBadRequest(reason=f"keys must be a subset of {', '.join(ATTRIBUTE_KEYS)}")
+    try:
+        limit = int(request.query.get("limit", DEFAULT_MATCHES_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(reason="limit must be an integer")
+    if not 0 < limit <= service.options.max_batch:
+        raise web.HTTPBadRequest(reason=f"limit must be between 1 and {service.options.max_batch}")
+    found = await service.matches(sku_id, keys, limit)
+    if found is None:
+        raise web.HTTPNotFound(reason="SKU not found")
+    return web.json_response({"uuid": str(sku_id), "keys": list(keys), "matches": found})
+
+
+@timed("batch")
+async def similar_batch(request: web.Request) -> web.Response:
+    """
+    POST /similar — похожие SKU для многих товаров сразу.
+
+    Тело запроса: {"uuids": [...], "offers": [{"marketplace_id": ..., "product_id": ...}, ...]}, оба поля
+    необязательны. Ответ: {"results": [...]} в порядке запроса, сначала товары из uuids, затем из offers;
+    для оффера, которого нет в БД, uuid равен null, а similar пуст.
+    """
+    service = request.app[SERVICE]
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(reason="Request body must be a JSON object")
+    raw_uuids = body.get("uuids") or []
+    raw_offers = body.get("offers") or []
+    if not isinstance(raw_uuids, list) or not isinstance(raw_offers, list):
+        raise web.HTTPBadRequest(reason="uuids and offers must be lists")
+    if len(raw_uuids) + len(raw_offers) > service.options.max_batch:
+        raise web.HTTPRequestEntityTooLarge(
+            max_size=service.options.max_batch, actual_size=len(raw_uuids) + len(raw_offers)
+        )
+
+    sku_ids = [_parse_uuid(value) for value in raw_uuids]
+    try:
+        offers = [_parse_offer(item.get("marketplace_id"), item.get("product_id")) for item in raw_offers]
+    except AttributeError:
+        raise web.HTTPBadRequest(reason="offers must be objects with marketplace_id and product_id")
+    resolved = await service.resolve_offers(offers) if offers else {}
+    found = await service.lookup(sku_ids + list(resolved.values()))
+
+    results = [{"uuid": str(sku_id), "similar": found[sku_id]} for sku_id in sku_ids]
+    for marketplace_id, product_id in offers:
+        sku_id = resolved.get((marketplace_id, product_id))
+        results.append(
+            {
+                "marketplace_id": marketplace_id,
+                "product_id": product_id,
+                "uuid": str(sku_id) if sku_id is not None else None,
+                "similar": found[sku_id] if sku_id is not None else [],
+            }
+        )
+    return web.json_response({"results": results})
+
+
+async def health(request: web.Request) -> web.Response:
+    """
+    GET /health — проверка доступности сервиса и БД.
+    """
+    await request.app[SERVICE].pool.fetchval("SELECT 1")
+    return web.json_response({"status": "ok", "cached": len(request.app[SERVICE].cache)})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """
+    GET /metrics — метрики в формате Prometheus.
+    """
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def create_app(service: SimilarService) -> web.Application:
+    """
+    Создает приложение aiohttp с маршрутами сервиса похожих товаров.
+
+    Параметры:
+    - service: Сервис похожих товаров. Слушатель уведомлений запускается при старте приложения,
+      соединения закрываются при его остановке.
+
+    Возвращает:
+    - Приложение aiohttp.
+    """
+    app = web.Application()
+    app[SERVICE] = service
+    app.router.add_get("/skus/{uuid}/similar", similar_by_uuid)
+    app.router.add_get("/skus/{uuid}/matches", matches_by_uuid)
+    app.router.add_get(r"/offers/{marketplace_id:\d+}/{product_id:\d+}/similar", similar_by_offer)
+    app.router.add_post("/similar", similar_batch)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+
+    async def lifecycle(app: web.Application):
+        await service.start()
+        yield
+        await service.close()
+
+    app.cleanup_ctx.append(lifecycle)
+    return app
+
+
+async def build_service(env: Env) -> SimilarService:
+    """
+    Создает сервис по переменным окружения: пул соединений asyncpg, клиент Elasticsearch и параметры кэша.
+
+    Параметры:
+    - env: Переменные окружения.
+
+    Возвращает:
+    - Сервис похожих товаров.
+    """
+    dsn = (
+        f"postgresql://{env('POSTGRES_USER')}:{env('POSTGRES_PASSWORD')}@"
+        f"{env('POSTGRES_HOST')}:{env('POSTGRES_PORT')}/{env('POSTGRES_DB')}"
+    )
+    pool = await asyncpg.create_pool(
+        dsn, min_size=env.int("SERVICE_DB_POOL_MIN", 2), max_size=env.int("SERVICE_DB_POOL_MAX", 10)
+    )
+    elasticsearch_url = env("ELASTICSEARCH_HOST", None)
+    es_client = await init_es(elasticsearch_url) if elasticsearch_url else None
+    options = ServiceOptions(
+        cache_size=env.int("SIMILAR_CACHE_SIZE", 100000),
+        cache_ttl=env.float("SIMILAR_CACHE_TTL", 300.0),
+        negative_ttl=env.float("SIMILAR_NEGATIVE_TTL", 10.0),
+        live_fallback=env.bool("SIMILAR_LIVE_FALLBACK", True),
+        max_batch=env.int("SIMILAR_MAX_BATCH", 1000),
+        blocking=BlockingOptions(
+            enabled=env.bool("SIMILARITY_BLOCKING", True),
+            price_band=env.float("SIMILARITY_PRICE_BAND", 2.0),
+            min_hits=env.int("SIMILARITY_MIN_HITS", 5),
+        ),
+        mlt=mlt_options_from_env(env),
+    )
+    return SimilarService(pool, es_client, lambda: asyncpg.connect(dsn), options)
+
+
+def main() -> None:
+    """
+    Запускает HTTP-сервис похожих товаров на SERVICE_HOST:SERVICE_PORT.
+    """
+    env = Env()
+    env.read_env()
+    logging.basicConfig(level=env("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    async def make_app() -> web.Application:
+        return create_app(await build_service(env))
+
+    web.run_app(make_app(), host=env("SERVICE_HOST", "0.0.0.0"), port=env.int("SERVICE_PORT", 8080))
+
+
+if __name__ == "__main__":
+    main()
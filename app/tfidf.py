@@ -0,0 +1,195 @@
+import logging
+import multiprocessing
+import re
+import uuid
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+# Токен — последовательность букв и цифр (кириллица поддерживается через \w)
+TOKEN_RE = re.compile(r"\w+")
+
+# Доля документов, при превышении которой термин отбрасывается как неразличающий
+MAX_DF = 0.5
+# Термины, встречающиеся не более чем в стольких документах, не отбрасываются при любом max_df:
+# в небольшом каталоге почти любое общее слово встречается в заметной доле документов
+MAX_DF_MIN_DOCS = 100
+
+# Матрица TF-IDF и ее транспонированная копия в процессе-воркере
+_matrix: csr_matrix | None = None
+_matrix_t: csr_matrix | None = None
+
+
+def sku_to_text(sku) -> str:
+    """
+    Собирает текст SKU для построения TF-IDF: название, описание, бренд и характеристики.
+
+    Args:
+        sku: Объект SKU.
+
+    Returns:
+        str: Текст товара.
+    """
+    features = " ".join(f"{key} {value}" for key, value in (sku.features or {}).items())
+    return " ".join((sku.title or "", sku.description or "", sku.brand or "", features))
+
+
+class TfidfIndex:
+    """
+    Накопитель документов для построения разреженной матрицы TF-IDF.
+
+    Документы добавляются по одному по мере парсинга фида. В памяти хранятся только
+    номера терминов и их частоты, а не исходные тексты.
+    """
+
+    def __init__(self) -> None:
+        self.sku_ids: list[uuid.UUID] = []
+        self.vocabulary: dict[str, int] = {}
+        self._indptr = array("q", [0])
+        self._indices = array("q")
+        self._counts = array("f")
+
+    def __len__(self) -> int:
+        return len(self.sku_ids)
+
+    def add(self, sku_id: uuid.UUID, text: str) -> None:
+        """
+        Добавляет документ в индекс.
+
+        Args:
+            sku_id (uuid.UUID): UUID SKU.
+            text (str): Текст товара.
+        """
+        vocabulary = self.vocabulary
+        for term, count in Counter(TOKEN_RE.findall(text.lower())).items():
+            self._indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            self._counts.append(count)
+        self._indptr.append(len(self._indices))
+        self.sku_ids.append(sku_id)
+
+    def build_matrix(self, max_df: float = MAX_DF) -> csr_matrix:
+        """
+        Строит L2-нормированную матрицу TF-IDF (строка — документ, столбец — термин).
+
+        Используется сублинейный TF (1 + log tf) и сглаженный IDF. Термины, встречающиеся
+        более чем в max_df доле документов, отбрасываются: они почти не влияют на схожесть,
+        но делают произведение матриц плотным. Термины, встречающиеся не более чем
+        в MAX_DF_MIN_DOCS документах, сохраняются всегда, иначе в небольшом каталоге
+        отбрасывались бы все общие слова и похожие не находились.
+
+        Args:
+            max_df (float): Максимальная доля документов, содержащих термин.
+
+        Returns:
+            csr_matrix: Матрица TF-IDF размером (количество документов, размер словаря).
+        """
+        n_docs = len(self.sku_ids)
+        matrix = csr_matrix(
+            (
+                np.array(self._counts, dtype=np.float32),
+                np.array(self._indices, dtype=np.int64),
+                np.array(self._indptr, dtype=np.int64),
+            ),
+            shape=(n_docs, len(self.vocabulary)),
+            dtype=np.float32,
+        )
+
+        df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        idf[df > max(max_df * n_docs, MAX_DF_MIN_DOCS)] = 0
+
+        matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+        matrix.eliminate_zeros()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix.data /= np.repeat(norms, np.diff(matrix.indptr)).astype(np.float32)
+        return matrix
+
+
+def _init_worker(matrix: csr_matrix) -> None:
+    """
+    Инициализирует процесс-воркер: сохраняет матрицу и ее транспонированную копию.
+    """
+    global _matrix, _matrix_t
+    _matrix = matrix
+    _matrix_t = matrix.T.tocsr()
+
+
+def _top_k_block(start: int, end: int, top_k: int) -> tuple[int, np.ndarray, np.ndarray]:
+    """
+    Находит top_k ближайших соседей для строк матрицы с start по end.
+
+    Returns:
+        tuple[int, np.ndarray, np.ndarray]: Номер первой строки блока, номера соседей и их оценки.
+            Недостающие соседи обозначаются номером -1.
+    """
+    similarities = (_matrix[start:end] @ _matrix_t).tocsr()
+    neighbours = np.full((end - start, top_k), -1, dtype=np.int64)
+    scores = np.zeros((end - start, top_k), dtype=np.float32)
+
+    for row in range(end - start):
+        lo, hi = similarities.indptr[row], similarities.indptr[row + 1]
+        columns = similarities.indices[lo:hi]
+        values = similarities.data[lo:hi]
+
+        # Исключаем сам документ
+        mask = columns != start + row
+        columns, values = columns[mask], values[mask]
+
+        if len(columns) > top_k:
+            part = np.argpartition(-values, top_k)[:top_k]
+            columns, values = columns[part], values[part]
+        order = np.argsort(-values, kind="stable")
+        neighbours[row, : len(order)] = columns[order]
+        scores[row, : len(order)] = values[order]
+
+    return start, neighbours, scores
+
+
+def find_similar_skus_tfidf(
+    index: TfidfIndex, top_k: int = 5, block_size: int = 256, workers: int | None = None, max_df: float = MAX_DF
+) -> dict[uuid.UUID, list[tuple[uuid.UUID, float]]]:
+    """
+    Находит похожие SKU для всех документов индекса по косинусной близости TF-IDF.
+
+    Матрица умножается на свою транспонированную копию блоками по block_size строк,
+    блоки распределяются по процессам ProcessPoolExecutor.
+
+    Args:
+        index (TfidfIndex): Индекс с документами всех SKU.
+        top_k (int): Количество похожих SKU для каждого товара.
+        block_size (int): Количество строк матрицы, обрабатываемых за одну задачу.
+        workers (int | None): Количество процессов. По умолчанию — количество ядер.
+        max_df (float): Максимальная доля документов, содержащих термин (см. TfidfIndex.build_matrix).
+
+    Returns:
+        dict[uuid.UUID, list[tuple[uuid.UUID, float]]]: UUID SKU -> список пар (UUID похожего SKU, косинусная
+            близость) по убыванию близости.
+    """
+    if not len(index):
+        return {}
+
+    matrix = index.build_matrix(max_df=max_df)
+    sku_ids = index.sku_ids
+    similar: dict[uuid.UUID, list[tuple[uuid.UUID, float]]] = {}
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(matrix,)
+    ) as executor:
+        starts = range(0, matrix.shape[0], block_size)
+        ends = (min(start + block_size, matrix.shape[0]) for start in starts)
+        for start, neighbours, scores in executor.map(_top_k_block, starts, ends, [top_k] * len(starts)):
+            for offset, row in enumerate(neighbours):
+                similar[sku_ids[start + offset]] = [
+                    (sku_ids[column], float(score)) for column, score in zip(row, scores[offset]) if column >= 0
+                ]
+
+    logger.info("Found similar SKUs for %d SKUs with TF-IDF", len(similar))
+    return similar
@@ -0,0 +1,98 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# Признак конца итератора, читаемого в отдельном потоке
+_END = object()
+
+
+async def abatched(iterable: AsyncIterable[T], size: int) -> AsyncGenerator[list[T], None]:
+    """
+    Разбивает асинхронный поток элементов на пачки фиксированного размера.
+
+    Args:
+        iterable (AsyncIterable[T]): Исходный асинхронный поток элементов.
+        size (int): Максимальный размер пачки.
+
+    Yields:
+        list[T]: Очередная пачка элементов. Последняя пачка может быть меньше size.
+    """
+    if size < 1:
+        raise ValueError("size must be at least 1")
+
+    batch = []
+    async for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """
+    Разбивает поток элементов на пачки фиксированного размера.
+
+    Args:
+        iterable (Iterable[T]): Исходный поток элементов.
+        size (int): Максимальный размер пачки.
+
+    Yields:
+        list[T]: Очередная пачка элементов. Последняя пачка может быть меньше size.
+    """
+    if size < 1:
+        raise ValueError("size must be at least 1")
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def aiterate(items: Iterable[T]) -> AsyncGenerator[T, None]:
+    """
+    Превращает обычную коллекцию в асинхронный поток элементов.
+
+    Args:
+        items (Iterable[T]): Исходная коллекция.
+
+    Yields:
+        T: Очередной элемент коллекции.
+    """
+    for item in items:
+        yield item
+
+
+async def aiterate_in_thread(items: Iterable[T]) -> AsyncGenerator[T, None]:
+    """
+    Превращает обычный итератор в асинхронный поток, получая элементы в отдельном потоке.
+
+    Подходит для итераторов, которые долго считают каждый элемент (например, парсер XML):
+    пока поток готовит следующий элемент, цикл событий обрабатывает текущий и другие корутины.
+    Поэтому элементом лучше делать пачку, а не отдельную запись.
+
+    Args:
+        items (Iterable[T]): Исходный итератор.
+
+    Yields:
+        T: Очередной элемент итератора.
+    """
+    iterator = iter(items)
+    pending = asyncio.ensure_future(asyncio.to_thread(next, iterator, _END))
+    try:
+        while True:
+            item = await pending
+            if item is _END:
+                return
+            pending = asyncio.ensure_future(asyncio.to_thread(next, iterator, _END))
+            yield item
+    finally:
+        # Итератор нельзя закрыть, пока поток получает из него следующий элемент
+        if not pending.done():
+            await asyncio.gather(pending, return_exceptions=True)
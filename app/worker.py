@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import NamedTuple
+
+from elasticsearch import AsyncElasticsearch
+from environs import Env
+from sqlalchemy import Row
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+from app.db import (
+    claim_similarity_job,
+    complete_similarity_job,
+    count_similarity_jobs,
+    fail_similarity_job,
+    get_sku_ids_in_range,
+    heartbeat_similarity_job,
+    save_similar_skus,
+)
+from app.es_utils import BlockingOptions, MltOptions, find_similar_skus_batch, init_es
+from app.metrics import STAGE_SIMILARITY, track
+from app.models import JOB_FAILED, JOB_PENDING, JOB_RUNNING
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerOptions(NamedTuple):
+    """
+    Параметры воркеров поиска похожих.
+
+    - heartbeat_interval: Интервал продления аренды задачи в секундах.
+    - lease_timeout: Таймаут аренды: задачу воркера, не продлевавшего аренду дольше, забирает другой воркер.
+    - max_attempts: Максимальное количество попыток выполнения задачи.
+    - poll_interval: Пауза между проверками очереди, когда свободных задач нет.
+    - search_batch_size: Количество поисковых запросов в одном _msearch.
+    - search_concurrency: Максимальное количество одновременных _msearch-запросов.
+    - blocking: Параметры блокировки при поиске похожих.
+    - mlt: Параметры запроса "more_like_this".
+    """
+
+    heartbeat_interval: float = 10.0
+    lease_timeout: float = 60.0
+    max_attempts: int = 3
+    poll_interval: float = 2.0
+    search_batch_size: int = 100
+    search_concurrency: int = 4
+    blocking: BlockingOptions = BlockingOptions()
+    mlt: MltOptions = MltOptions()
+
+
+def new_worker_id() -> str:
+    """
+    Возвращает уникальный идентификатор воркера: хост, PID процесса и случайный суффикс.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SimilarityWorker:
+    """
+    Воркер поиска похожих: забирает задачи из таблицы similarity_job и ищет похожие для товаров
+    диапазона задачи через Elasticsearch.
+
+    Воркеров может быть сколько угодно, в одном процессе, в разных процессах и на разных узлах:
+    координируются они только через Postgres. Пока задача выполняется, аренда продлевается
+    на отдельном соединении. Похожие товары и отметка о выполнении задачи записываются в одной
+    транзакции; если аренду за это время забрал другой воркер, результат откатывается.
+
+    Воркер с run_id выполняет задачи только этого прохода (воркеры загрузки), воркер без run_id —
+    задачи любого прохода (отдельные воркеры python -m app.worker).
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        es_client: AsyncElasticsearch,
+        options: WorkerOptions = WorkerOptions(),
+        worker_id: str | None = None,
+        run_id: str | None = None,
+    ) -> None:
+        self.engine = engine
+        self.es_client = es_client
+        self.options = options
+        self.worker_id = worker_id or new_worker_id()
+        self.run_id = run_id
+        self.processed = 0
+
+    async def run(self, exit_when_idle: bool = False) -> None:
+        """
+        Выполняет задачи, пока они есть.
+
+        Воркер, который ждет новые задачи, переживает недоступность БД и отсутствие таблицы
+        similarity_job (ее создает и пересоздает загрузка): ошибка БД записывается в лог,
+        и попытка повторяется через poll_interval.
+
+        Параметры:
+        - exit_when_idle: Завершиться, когда свободных задач нет. Иначе воркер ждет новые задачи.
+        """
+        logger.debug("Similarity worker %s started", self.worker_id)
+        while True:
+            try:
+                async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                    job = await claim_similarity_job(
+                        session, self.worker_id, self.options.lease_timeout, self.options.max_attempts, self.run_id
+                    )
+                if job is not None:
+                    await self.process(job)
+            except (OSError, SQLAlchemyError) as e:
+                if exit_when_idle:
+                    raise
+                logger.warning("Similarity worker %s failed to reach the job queue: %r", self.worker_id, e)
+                await asyncio.sleep(self.options.poll_interval)
+                continue
+            if job is None:
+                if exit_when_idle:
+                    break
+                await asyncio.sleep(self.options.poll_interval)
+        logger.debug("Similarity worker %s finished, processed %d jobs", self.worker_id, self.processed)
+
+    async def process(self, job: Row) -> None:
+        """
+        Ищет и сохраняет похожие для товаров задачи. Ошибка, в том числе неудачный поиск
+        хотя бы одного товара, возвращает задачу в очередь.
+        """
+        logger.info("Worker %s took job %d of %s (attempt %d)", self.worker_id, job.id, job.run_id, job.attempts)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                sku_ids = await get_sku_ids_in_range(session, job.first_uuid, job.last_uuid)
+                with track(STAGE_SIMILARITY, len(sku_ids)):
+                    similar, failed = await find_similar_skus_batch(
+                        self.es_client,
+                        sku_ids,
+                        batch_size=self.options.search_batch_size,
+                        max_concurrency=self.options.search_concurrency,
+                        blocking=self.options.blocking,
+                        mlt=self.options.mlt,
+                    )
+                for sku_id, error in failed.items():
+                    logger.warning("Failed to search similar SKUs for %s: %s", sku_id, error)
+                if failed:
+                    # Задача без похожих части товаров не считается выполненной
+                    raise RuntimeError(f"Failed to search similar SKUs for {len(failed)} of {len(sku_ids)} SKUs")
+                await save_similar_skus(session, similar)
+                if await complete_similarity_job(session, job.id, self.worker_id):
+                    await session.commit()
+                    self.processed += 1
+                else:
+                    logger.warning("Job %d was taken over by another worker, discarding results", job.id)
+                    await session.rollback()
+        except Exception as e:
+            logger.exception("Job %d failed", job.id)
+            async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                await fail_similarity_job(session, job.id, self.worker_id, repr(e), self.options.max_attempts)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: int) -> None:
+        """
+        Продлевает аренду задачи каждые heartbeat_interval секунд.
+        """
+        while True:
+            await asyncio.sleep(self.options.heartbeat_interval)
+            try:
+                async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                    if not await heartbeat_similarity_job(session, job_id, self.worker_id):
+                        logger.warning("Worker %s lost the lease of job %d", self.worker_id, job_id)
+                        return
+            except Exception as e:
+                logger.warning("Failed to heartbeat job %d: %r", job_id, e)
+
+
+async def run_similarity_jobs(
+    engine: AsyncEngine, es_client: AsyncElasticsearch, run_id: str, workers: int, options: WorkerOptions
+) -> None:
+    """
+    Выполняет задачи прохода поиска похожих локальными воркерами и ждет завершения всех задач прохода.
+
+    Задачи прохода могут параллельно выполнять воркеры других процессов (python -m app.worker).
+    Когда свободных задач не остается, функция ждет задачи, выполняющиеся у других воркеров,
+    и забирает задачи упавших воркеров по истечении аренды.
+
+    Параметры:
+    - engine: Асинхронный движок SQLAlchemy.
+    - es_client: Клиент Elasticsearch.
+    - run_id: Проход поиска похожих.
+    - workers: Количество локальных воркеров.
+    - options: Параметры воркеров.
+
+    Исключения:
+    - RuntimeError: Часть задач исчерпала попытки. Повторный запуск загрузки вернет их в очередь.
+    """
+    while True:
+        await asyncio.gather(
+            *(
+                SimilarityWorker(engine, es_client, options, run_id=run_id).run(exit_when_idle=True)
+                for _ in range(max(workers, 1))
+            )
+        )
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            counts = await count_similarity_jobs(session, run_id)
+        if not counts.get(JOB_PENDING) and not counts.get(JOB_RUNNING):
+            break
+        logger.info("Waiting for similarity jobs of %s: %s", run_id, counts)
+        await asyncio.sleep(options.poll_interval)
+
+    logger.info("Similarity jobs of %s finished: %s", run_id, counts)
+    if counts.get(JOB_FAILED):
+        raise RuntimeError(f"{counts[JOB_FAILED]} similarity jobs of {run_id} failed")
+
+
+async def main() -> None:
+    """
+    Запускает воркер поиска похожих, который выполняет задачи, пока его не остановят.
+
+    Воркеры масштабируются запуском нескольких процессов или контейнеров
+    (docker-compose up --scale similarity_worker=N); параметры задаются теми же переменными
+    окружения, что и у загрузки.
+    """
+    env = Env()
+    env.read_env()
+    logging.basicConfig(level=env("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    database_url = (
+        f"postgresql+asyncpg://{env('POSTGRES_USER')}:{env('POSTGRES_PASSWORD')}@"
+        f"{env('POSTGRES_HOST')}:{env('POSTGRES_PORT')}/{env('POSTGRES_DB')}"
+    )
+    engine = create_async_engine(database_url)
+    es_client = await init_es(env("ELASTICSEARCH_HOST"))
+    try:
+        await SimilarityWorker(engine, es_client, worker_options_from_env(env)).run()
+    finally:
+        await es_client.close()
+        await engine.dispose()
+
+
+def worker_options_from_env(env: Env) -> WorkerOptions:
+    """
+    Читает параметры воркеров поиска похожих из переменных окружения.
+    """
+    return WorkerOptions(
+        heartbeat_interval=env.float("SIMILARITY_HEARTBEAT_INTERVAL", 10.0),
+        lease_timeout=env.float("SIMILARITY_LEASE_TIMEOUT", 60.0),
+        max_attempts=env.int("SIMILARITY_MAX_ATTEMPTS", 3),
+        search_batch_size=env.int("ES_SEARCH_BATCH_SIZE", 100),
+        search_concurrency=env.int("ES_SEARCH_CONCURRENCY", 4),
+        blocking=BlockingOptions(
+            enabled=env.bool("SIMILARITY_BLOCKING", True),
+            price_band=env.float("SIMILARITY_PRICE_BAND", 2.0),
+            min_hits=env.int("SIMILARITY_MIN_HITS", 5),
+        ),
+        mlt=mlt_options_from_env(env),
+    )
+
+
+def mlt_options_from_env(env: Env) -> MltOptions:
+    """
+    Читает параметры запроса "more_like_this" из переменных окружения.
+    """
+    defaults = MltOptions()
+    return MltOptions(
+        fields=tuple(env.list("MLT_FIELDS", list(defaults.fields))),
+        size=env.int("MLT_SIZE", defaults.size),
+        min_term_freq=env.int("MLT_MIN_TERM_FREQ", defaults.min_term_freq),
+        min_doc_freq=env.int("MLT_MIN_DOC_FREQ", defaults.min_doc_freq),
+        max_doc_freq=env.int("MLT_MAX_DOC_FREQ", defaults.max_doc_freq),
+        max_query_terms=env.int("MLT_MAX_QUERY_TERMS", defaults.max_query_terms),
+        minimum_should_match=env("MLT_MINIMUM_SHOULD_MATCH", defaults.minimum_should_match),
+        attribute_boost=env.float("MLT_ATTRIBUTE_BOOST", defaults.attribute_boost),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""
+Генератор синтетических фидов в формате YML для бенчмарков.
+
+Фид описывается FeedSpec: количество офферов, глубина и ветвистость дерева категорий,
+количество характеристик и длина текстов. Офферы объединяются в семейства — один товар,
+выставленный несколькими продавцами на разных маркетплейсах с небольшими отличиями
+в названии и характеристиках, — чтобы поиск похожих работал на данных, в которых есть что находить.
+
+Генерация детерминирована: одинаковый FeedSpec дает байт-в-байт одинаковый файл.
+
+Запуск:
+    python -m benchmarks.feedgen feed.xml.gz --offers 1000000 --category-depth 5
+"""
+
+import argparse
+import gzip
+import io
+import random
+from typing import NamedTuple, TextIO
+from xml.sax.saxutils import escape
+
+import zstandard
+
+# Слоги для построения псевдослов словаря
+SYLLABLES = ["ка", "ро", "ми", "те", "ла", "но", "сви", "пра", "до", "ги", "зу", "бе", "ло", "ня", "ре", "ст"]
+COLORS = ["черный", "белый", "серый", "синий", "красный", "зеленый", "золотой", "серебристый"]
+
+
+class FeedSpec(NamedTuple):
+    """
+    Параметры синтетического фида.
+
+    - offers: Количество офферов.
+    - category_depth: Глубина дерева категорий.
+    - category_fanout: Количество дочерних категорий у каждой категории.
+    - features: Количество характеристик у оффера.
+    - title_words: Количество слов в названии.
+    - description_words: Количество слов в описании.
+    - family_size: Количество офферов одного товара (семейства) в фиде.
+    - brands: Количество брендов.
+    - vocabulary: Размер словаря псевдослов.
+    - seed: Зерно генератора случайных чисел.
+    """
+
+    offers: int = 10_000
+    category_depth: int = 4
+    category_fanout: int = 4
+    features: int = 10
+    title_words: int = 8
+    description_words: int = 40
+    family_size: int = 3
+    brands: int = 50
+    vocabulary: int = 5_000
+    seed: int = 0
+
+
+def _build_vocabulary(rng: random.Random, size: int) -> list[str]:
+    """
+    Строит словарь уникальных псевдослов из слогов.
+    """
+    words: set[str] = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _build_categories(depth: int, fanout: int) -> tuple[list[tuple[int, int | None]], list[int]]:
+    """
+    Строит дерево категорий заданной глубины и ветвистости.
+
+    :return: Список пар (id категории, id родителя) в порядке обхода в ширину и список листовых категорий.
+    """
+    categories: list[tuple[int, int | None]] = []
+    level: list[int | None] = [None]
+    next_id = 1
+    for _ in range(depth):
+        children = []
+        for parent_id in level:
+            for _ in range(fanout):
+                categories.append((next_id, parent_id))
+                children.append(next_id)
+                next_id += 1
+        level = children
+    return categories, level
+
+
+def _ean13(number: int) -> str:
+    """
+    Формирует EAN-13 из 12 цифр number, дописывая контрольную цифру.
+    """
+    digits = f"{number:012d}"
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _open_output(file_path: str) -> TextIO:
+    """
+    Открывает файл фида на запись, сжимая .gz и .zst на лету.
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "wt", encoding="utf-8")
+    if file_path.endswith(".zst"):
+        writer = zstandard.ZstdCompressor().stream_writer(open(file_path, "wb"), closefd=True)
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return open(file_path, "w", encoding="utf-8")
+
+
+def write_feed(file_path: str, spec: FeedSpec = FeedSpec()) -> None:
+    """
+    Записывает синтетический фид в формате YML.
+
+    :param file_path: Путь к файлу фида (.xml, .xml.gz или .xml.zst).
+    :param spec: Параметры фида.
+    """
+    rng = random.Random(spec.seed)
+    vocabulary = _build_vocabulary(rng, spec.vocabulary)
+    brands = [f"Brand{index}" for index in range(1, spec.brands + 1)]
+    feature_names = [f"Характеристика {index}" for index in range(1, spec.features * 3 + 1)]
+    categories, leaves = _build_categories(spec.category_depth, spec.category_fanout)
+
+    with _open_output(file_path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<yml_catalog><shop><categories>\n')
+        for category_id, parent_id in categories:
+            parent = f' parentId="{parent_id}"' if parent_id is not None else ""
+            f.write(f'<category id="{category_id}"{parent}>Категория {category_id}</category>\n')
+        f.write("</categories><offers>\n")
+
+        product_id = 0
+        family_id = 0
+        while product_id < spec.offers:
+            family_id += 1
+            # Общие для семейства название, бренд, категория, характеристики и штрихкод
+            title = rng.sample(vocabulary, spec.title_words)
+            brand = rng.choice(brands)
+            category_id = rng.choice(leaves)
+            features = {name: rng.choice(vocabulary) for name in rng.sample(feature_names, spec.features)}
+            price = round(rng.uniform(100, 200_000), 2)
+            barcode = _ean13(460000000000 + family_id)
+
+            for member in range(min(spec.family_size, spec.offers - product_id)):
+                product_id += 1
+                member_title = list(title)
+                member_title[rng.randrange(len(member_title))] = rng.choice(vocabulary)
+                member_title.append(rng.choice(COLORS))
+                description = " ".join(rng.choice(vocabulary) for _ in range(spec.description_words))
+                member_features = dict(features)
+                member_features[rng.choice(list(member_features))] = rng.choice(vocabulary)
+                discount = rng.choice((0.0, 0.05, 0.1, 0.2))
+                f.write(
+                    f'<offer id="{product_id}" marketplace_id="{member % 3 + 1}">'
+                    f"<name>{escape(' '.join(member_title))}</name>"
+                    f"<description>{escape(description)}</description>"
+                    f"<vendor>{escape(brand)}</vendor>"
+                    f"<sellerId>{rng.randint(1, 1000)}</sellerId><sellerName>Продавец</sellerName>"
+                    f"<picture>https://example.com/{product_id}.jpg</picture>"
+                    f"<categoryId>{category_id}</categoryId><features>"
+                    + "".join(
+                        f"<feature><name>{escape(name)}</name><value>{escape(value)}</value></feature>"
+                        for name, value in member_features.items()
+                    )
+                    + f"</features><rating_count>{rng.randint(0, 999)}</rating_count>"
+                    f"<rating_value>{rng.uniform(1, 5):.1f}</rating_value>"
+                    f"<price_before_discounts>{price}</price_before_discounts><discount>{discount}</discount>"
+                    f"<price_after_discounts>{round(price * (1 - discount), 2)}</price_after_discounts>"
+                    f"<bonuses>{rng.randint(0, 100)}</bonuses><sales>{rng.randint(0, 500)}</sales>"
+                    f"<currency>RUB</currency><barcode>{barcode}</barcode></offer>\n"
+                )
+        f.write("</offers></shop></yml_catalog>\n")
+
+
+def main() -> None:
+    defaults = FeedSpec()
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("file_path", help="путь к файлу фида (.xml, .xml.gz или .xml.zst)")
+    for field in FeedSpec._fields:
+        arg_parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=getattr(defaults, field))
+    args = arg_parser.parse_args()
+    write_feed(args.file_path, FeedSpec(**{field: getattr(args, field) for field in FeedSpec._fields}))
+
+
+if __name__ == "__main__":
+    main()
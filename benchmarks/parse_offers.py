@@ -0,0 +1,129 @@
+"""
+Микробенчмарк извлечения офферов: скорость (офферов в секунду) до и после перехода
+на однопроходное извлечение в OfferRecord.
+
+- legacy: прежний способ — отдельный findtext() на каждое поле (числовые поля дважды)
+  и ORM-объект SKU на каждый оффер;
+- record: parse_offer_record() — один проход по дочерним элементам, запись OfferRecord;
+- record+orm: parse_offer_record() с последующим OfferRecord.to_sku().
+
+Запуск:
+    python -m benchmarks.parse_offers --offers 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+import lxml.etree as ET
+
+from app.models import SKU
+from app.parser import build_category_hierarchy, build_category_paths, parse_offer_record
+from benchmarks.feedgen import FeedSpec, write_feed
+
+
+def _legacy_get_category_path(category_id: int, categories: dict[int, str], parent_map: dict[int, int]) -> list[str]:
+    path = []
+    current_id = category_id
+    while current_id:
+        category_name = categories.get(current_id)
+        if category_name:
+            path.insert(0, category_name)
+        current_id = parent_map.get(current_id)
+    return path
+
+
+def _legacy_parse_features(elem: ET.Element) -> dict[str, str]:
+    features = {}
+    for feature in elem.findall(".//features/feature"):
+        key = feature.findtext("name")
+        value = feature.findtext("value")
+        if key and value:
+            features[key] = value
+    return features
+
+
+def _legacy_parse_offer(elem: ET.Element, categories: dict[int, str], parent_map: dict[int, int]) -> SKU:
+    marketplace_id = elem.get("marketplace_id")
+    product_id = elem.get("id")
+    seller_id = elem.findtext("sellerId")
+    category_id = elem.findtext("categoryId")
+    category_id = int(category_id) if category_id else 0
+    category_path = _legacy_get_category_path(category_id, categories, parent_map)
+    return SKU(
+        uuid=uuid.uuid4(),
+        marketplace_id=int(marketplace_id) if marketplace_id is not None else 0,
+        product_id=int(product_id) if product_id is not None else 0,
+        title=elem.findtext("name") or "",
+        description=elem.findtext("description") or "",
+        brand=elem.findtext("vendor") or "",
+        seller_id=int(seller_id) if seller_id is not None else 0,
+        seller_name=elem.findtext("sellerName") or "",
+        first_image_url=elem.findtext("picture") or "",
+        category_id=category_id,
+        category_lvl_1=category_path[0] if len(category_path) > 0 else "",
+        category_lvl_2=category_path[1] if len(category_path) > 1 else "",
+        category_lvl_3=category_path[2] if len(category_path) > 2 else "",
+        category_remaining="/".join(category_path[3:]) if len(category_path) > 3 else "",
+        features=_legacy_parse_features(elem),
+        rating_count=(int(elem.findtext("rating_count")) if elem.findtext("rating_count") else 0),
+        rating_value=(float(elem.findtext("rating_value")) if elem.findtext("rating_value") else 0.0),
+        price_before_discounts=(
+            float(elem.findtext("price_before_discounts")) if elem.findtext("price_before_discounts") else 0.0
+        ),
+        discount=(float(elem.findtext("discount")) if elem.findtext("discount") else 0.0),
+        price_after_discounts=(
+            float(elem.findtext("price_after_discounts")) if elem.findtext("price_after_discounts") else 0.0
+        ),
+        bonuses=(int(elem.findtext("bonuses")) if elem.findtext("bonuses") else 0),
+        sales=int(elem.findtext("sales")) if elem.findtext("sales") else 0,
+        currency=elem.findtext("currency") or "",
+        barcode=(str(elem.findtext("barcode")) if elem.findtext("barcode") else ""),
+    )
+
+
+def measure(file_path: str, extract) -> tuple[int, float]:
+    """
+    Прогоняет извлечение по всему файлу и возвращает количество офферов и время в секундах.
+    """
+    count = 0
+    started = time.perf_counter()
+    for _, elem in ET.iterparse(file_path, events=("end",), tag="offer"):
+        extract(elem)
+        elem.clear()
+        count += 1
+    return count, time.perf_counter() - started
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--offers", type=int, default=50_000, help="количество офферов в синтетическом фиде")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="количество повторов, берется лучший")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "feed.xml")
+        write_feed(file_path, FeedSpec(offers=args.offers))
+        categories, parent_map = build_category_hierarchy(file_path)
+        category_paths = build_category_paths(categories, parent_map)
+
+        variants = {
+            "legacy": lambda elem: _legacy_parse_offer(elem, categories, parent_map),
+            "record": lambda elem: parse_offer_record(elem, category_paths),
+            "record+orm": lambda elem: parse_offer_record(elem, category_paths).to_sku(),
+        }
+        baseline = None
+        for name, extract in variants.items():
+            count, elapsed = min(
+                (measure(file_path, extract) for _ in range(args.repeat)),
+                key=lambda result: result[1],
+            )
+            rate = count / elapsed
+            baseline = baseline or rate
+            print(f"{name:<12} {rate:>12,.0f} offers/s  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
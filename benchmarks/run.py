@@ -0,0 +1,389 @@
+"""
+Бенчмарк этапов загрузки фида: категории, парсинг, кластеризация офферов одного товара,
+запись в БД, индексация в Elasticsearch и поиск похожих товаров.
+
+Фид генерируется benchmarks.feedgen. По умолчанию Elasticsearch и Postgres заменяются
+заменителями из benchmarks.standins, поэтому бенчмарк воспроизводим без сети. С --pg-dsn
+и --es-url используются настоящие сервисы. ВНИМАНИЕ: таблицы БД пересоздаются,
+а в индекс sku пишутся синтетические документы — используйте отдельные инстансы.
+
+Для каждого этапа выводятся пропускная способность, задержки p50/p99 одной операции
+(пачки, bulk-запроса, поискового запроса) и пиковый RSS процесса. Результат сохраняется
+в JSON; с --baseline результаты сравниваются с предыдущим прогоном, и если пропускная
+способность какого-либо этапа упала больше чем на --tolerance, процесс завершается с кодом 1.
+
+Запуск:
+    python -m benchmarks.run --offers 100000 --output results.json
+    python -m benchmarks.run --offers 100000 --baseline results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.clustering import ProductClusterer
+from app.db import copy_skus
+from app.es_utils import (
+    BlockingOptions,
+    bulk_index_in_elasticsearch,
+    find_similar_skus,
+    find_similar_skus_batch,
+    init_es,
+    refresh_index,
+)
+from app.models import Base
+from app.parser import (
+    ParseOptions,
+    build_category_hierarchy,
+    build_category_paths,
+    iter_offer_batches,
+    parse_xml_batches,
+)
+from app.pipeline import Stage as PipelineStage
+from app.pipeline import run_pipeline
+from app.utils import aiterate
+from benchmarks.feedgen import FeedSpec, write_feed
+from benchmarks.standins import InMemoryElasticsearch, InMemoryPostgres
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """
+    Возвращает перцентиль q (0..1) выборки методом ближайшего ранга.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    Возвращает пиковый RSS в мегабайтах (ru_maxrss в Linux — в килобайтах, в macOS — в байтах).
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Stage:
+    """
+    Замер одного этапа: общее время, количество обработанных элементов и задержки отдельных операций.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.samples: list[float] = []
+        self.seconds = 0.0
+        self.peak_rss_mb = 0.0
+
+    @contextlib.contextmanager
+    def total(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.peak_rss_mb = peak_rss_mb()
+
+    @contextlib.contextmanager
+    def operation(self, items: int = 1):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.append(time.perf_counter() - started)
+            self.items += items
+
+    def result(self) -> dict:
+        return {
+            "items": self.items,
+            "operations": len(self.samples),
+            "seconds": round(self.seconds, 4),
+            "throughput": round(self.items / self.seconds, 1) if self.seconds else 0.0,
+            "p50_ms": round(percentile(self.samples, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(self.samples, 0.99) * 1000, 3),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+def git_revision() -> str | None:
+    """
+    Возвращает короткий хеш текущего коммита, если бенчмарк запущен из git-репозитория.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(args: argparse.Namespace, file_path: str) -> dict[str, dict]:
+    """
+    Прогоняет все этапы по фиду и возвращает результаты по этапам.
+    """
+    stages: dict[str, Stage] = {}
+
+    def stage(name: str) -> Stage:
+        stages[name] = Stage(name)
+        return stages[name]
+
+    # Заменители или настоящие сервисы
+    if args.es_url:
+        es_client = await init_es(args.es_url)
+    else:
+        es_client = InMemoryElasticsearch(latency=args.latency_ms / 1000)
+    engine = None
+    if args.pg_dsn:
+        engine = create_async_engine(args.pg_dsn)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        connect = engine.connect
+    else:
+        connect = InMemoryPostgres(latency=args.latency_ms / 1000).connect
+
+    # Категории
+    current = stage("categories")
+    with current.total(), current.operation():
+        categories, parent_map = build_category_hierarchy(file_path)
+        category_paths = build_category_paths(categories, parent_map)
+    current.items = len(categories)
+
+    # Парсинг: пачки офферов материализуются, чтобы следующие этапы мерились отдельно от парсинга
+    batches = []
+    options = ParseOptions(workers=args.parse_workers)
+    current = stage("parse")
+    with current.total():
+        records = parse_xml_batches(file_path, category_paths, args.db_batch_size, options)
+        started = time.perf_counter()
+        async for batch in records:
+            # Операция парсинга — время ожидания очередной пачки
+            current.samples.append(time.perf_counter() - started)
+            current.items += len(batch)
+            batches.append(batch)
+            started = time.perf_counter()
+
+    # Кластеризация офферов одного товара: добавление офферов и построение кластеров
+    current = stage("clustering")
+    with current.total(), current.operation(sum(len(batch) for batch in batches)):
+        clusterer = ProductClusterer()
+        for batch in batches:
+            for sku in batch:
+                clusterer.add(sku.uuid, sku.barcode, sku.brand, sku.title, sku.attributes)
+        clusterer.clusters()
+
+    # Запись в БД через COPY
+    async with connect() as conn:
+        current = stage("db_write")
+        with current.total():
+            for batch in batches:
+                with current.operation(len(batch)):
+                    await copy_skus(conn, batch)
+
+    # Индексация в Elasticsearch
+    current = stage("es_index")
+    with current.total():
+        for batch in batches:
+            with current.operation(len(batch)):
+                await bulk_index_in_elasticsearch(
+                    es_client, aiterate(batch), chunk_size=args.es_chunk_size, max_concurrency=args.es_concurrency
+                )
+        await refresh_index(es_client)
+
+    blocking = BlockingOptions(enabled=not args.no_blocking, price_band=args.price_band)
+    sku_ids = [sku.uuid for batch in batches for sku in batch]
+    sample = random.Random(0).sample(sku_ids, min(args.search_sample, len(sku_ids)))
+
+    # Поиск похожих поштучно (режим stream)
+    current = stage("find_similar")
+    with current.total():
+        for sku_id in sample:
+            with current.operation():
+                await find_similar_skus(es_client, sku_id, blocking=blocking)
+
+    # Поиск похожих через _msearch (режим bulk), одна операция — страница из db_batch_size товаров
+    current = stage("find_similar_batch")
+    with current.total():
+        for start in range(0, len(sample), args.db_batch_size):
+            end = start + args.db_batch_size
+            page = sample[start:end]
+            with current.operation(len(page)):
+                await find_similar_skus_batch(
+                    es_client,
+                    page,
+                    batch_size=args.search_batch_size,
+                    max_concurrency=args.search_concurrency,
+                    blocking=blocking,
+                )
+
+    # Конвейер режима stream: парсинг в потоке, запись в БД, индексация и поиск похожих работают
+    # одновременно. Операция — путь пачки от парсера до конца поиска похожих; похожие ищутся
+    # только для SKU из выборки, как и на этапах поиска выше.
+    if engine is not None:
+        # Те же офферы записываются в БД повторно
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql("TRUNCATE sku")
+    sample_ids = set(sample)
+    entered: dict[int, float] = {}
+
+    def source():
+        for batch in iter_offer_batches(file_path, category_paths, args.db_batch_size):
+            entered[id(batch)] = time.perf_counter()
+            yield batch
+
+    async def write_db(batch: list) -> list:
+        async with connect() as conn:
+            await copy_skus(conn, batch)
+        return batch
+
+    async def index_es(batch: list) -> list:
+        await bulk_index_in_elasticsearch(es_client, aiterate(batch), chunk_size=args.es_chunk_size, max_concurrency=1)
+        return batch
+
+    async def search_similar(batch: list) -> None:
+        await refresh_index(es_client)
+        sku_ids = [sku.uuid for sku in batch if sku.uuid in sample_ids]
+        await find_similar_skus_batch(
+            es_client, sku_ids, batch_size=args.search_batch_size, max_concurrency=1, blocking=blocking
+        )
+        current.samples.append(time.perf_counter() - entered.pop(id(batch)))
+        current.items += len(batch)
+
+    current = stage("pipeline")
+    with current.total():
+        await run_pipeline(
+            source(),
+            [
+                PipelineStage("db_write", write_db, args.pipeline_workers),
+                PipelineStage("es_index", index_es, args.pipeline_workers),
+                PipelineStage("similarity", search_similar, args.pipeline_workers),
+            ],
+            queue_size=args.pipeline_queue_size,
+        )
+
+    await es_client.close()
+    if engine is not None:
+        await engine.dispose()
+    return {name: current.result() for name, current in stages.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Сравнивает пропускную способность этапов с базовым прогоном и печатает таблицу.
+
+    :return: True, если ни один этап не замедлился больше чем на tolerance.
+    """
+    ok = True
+    print(f"\n{'stage':<20} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous or not previous["throughput"]:
+            continue
+        ratio = current["throughput"] / previous["throughput"]
+        regressed = ratio < 1 - tolerance
+        ok = ok and not regressed
+        mark = "  REGRESSION" if regressed else ""
+        print(f"{name:<20} {previous['throughput']:>12,.0f} {current['throughput']:>12,.0f} {ratio:>7.2f}x{mark}")
+    return ok
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    feed = arg_parser.add_argument_group("фид")
+    defaults = FeedSpec()
+    for field in FeedSpec._fields:
+        feed.add_argument(f"--{field.replace('_', '-')}", type=int, default=getattr(defaults, field))
+    feed.add_argument("--feed", help="готовый фид вместо синтетического")
+    feed.add_argument("--compression", choices=("none", "gz", "zst"), default="none", help="сжатие синтетического фида")
+
+    ingest = arg_parser.add_argument_group("загрузка")
+    ingest.add_argument("--db-batch-size", type=int, default=5000)
+    ingest.add_argument("--es-chunk-size", type=int, default=500)
+    ingest.add_argument("--es-concurrency", type=int, default=4)
+    ingest.add_argument("--search-batch-size", type=int, default=100)
+    ingest.add_argument("--search-concurrency", type=int, default=4)
+    ingest.add_argument("--search-sample", type=int, default=2000, help="количество SKU для этапов поиска похожих")
+    ingest.add_argument("--parse-workers", type=int, default=0)
+    ingest.add_argument("--no-blocking", action="store_true", help="искать похожие по всему индексу, без блоков")
+    ingest.add_argument("--price-band", type=float, default=BlockingOptions().price_band)
+    ingest.add_argument("--pipeline-queue-size", type=int, default=4, help="вместимость очередей конвейера")
+    ingest.add_argument("--pipeline-workers", type=int, default=2, help="одновременные операции этапа конвейера")
+
+    services = arg_parser.add_argument_group("сервисы")
+    services.add_argument("--pg-dsn", help="DSN настоящего Postgres (postgresql+asyncpg://...)")
+    services.add_argument("--es-url", help="URL настоящего Elasticsearch")
+    services.add_argument("--latency-ms", type=float, default=0.0, help="задержка запроса к заменителям")
+
+    output = arg_parser.add_argument_group("результаты")
+    output.add_argument("--output", help="файл для сохранения результатов в JSON")
+    output.add_argument("--baseline", help="JSON с результатами предыдущего прогона для сравнения")
+    output.add_argument("--tolerance", type=float, default=0.1, help="допустимое падение пропускной способности")
+    output.add_argument("--verbose", action="store_true", help="выводить лог приложения уровня INFO")
+    args = arg_parser.parse_args()
+
+    spec = FeedSpec(**{field: getattr(args, field) for field in FeedSpec._fields})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = args.feed
+        if file_path is None:
+            suffix = "" if args.compression == "none" else f".{args.compression}"
+            file_path = os.path.join(tmp_dir, f"feed.xml{suffix}")
+            write_feed(file_path, spec)
+        feed_bytes = os.path.getsize(file_path)
+
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+        stages = asyncio.run(run_benchmarks(args, file_path))
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "feed": args.feed or spec._asdict(),
+            "feed_bytes": feed_bytes,
+            "services": {
+                "postgres": "real" if args.pg_dsn else "standin",
+                "elasticsearch": "real" if args.es_url else "standin",
+            },
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        },
+        "stages": stages,
+    }
+
+    print(f"{'stage':<20} {'items':>9} {'items/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8}")
+    for name, result in stages.items():
+        print(
+            f"{name:<20} {result['items']:>9} {result['throughput']:>12,.0f} "
+            f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['peak_rss_mb']:>8.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
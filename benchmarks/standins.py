@@ -0,0 +1,474 @@
+"""
+Заменители Elasticsearch и Postgres, работающие в памяти процесса.
+
+Реализуют только ту часть API клиентов, которой пользуется приложение, и позволяют
+воспроизводить бенчмарки на ноутбуке без сети и без запущенных сервисов. Абсолютные
+цифры с заменителями не совпадают с боевыми, но сравнение версий кода между собой
+на одном и том же заменителе корректно.
+
+- InMemoryElasticsearch: bulk, index, mget, search, msearch, indices и алиасы. Запрос "more_like_this"
+  (в том числе внутри bool с filter-условиями term и range и should-условиями constant_score
+  с term) выполняется по инвертированному
+  индексу с весами IDF, документы становятся видимыми для поиска только после refresh,
+  как в Elasticsearch.
+- InMemoryPostgres: соединение с интерфейсом AsyncConnection, отдающее через
+  get_raw_connection() заменитель соединения asyncpg (transaction, copy_records_to_table,
+  execute, executemany, fetch, fetchval).
+"""
+
+import asyncio
+import contextlib
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, AsyncIterator
+
+TOKEN_RE = re.compile(r"\w+")
+# Поддерживаемые части запроса bool и их значения по умолчанию
+BOOL_CLAUSES = (("must", {}), ("filter", []), ("should", []))
+
+
+def _field_text(value: Any) -> str:
+    """
+    Преобразует значение поля документа в текст для индексации.
+    """
+    if isinstance(value, dict):
+        return " ".join(f"{key} {item}" for key, item in value.items())
+    if value is None:
+        return ""
+    return str(value)
+
+
+def _keyword_items(document: dict) -> list[tuple[str, Any]]:
+    """
+    Возвращает точные значения полей документа для условий term: строковые поля и строковые
+    и числовые подполя объектов (например, ("attributes.storage_gb", 256)).
+    """
+    items = []
+    for field, value in document.items():
+        if isinstance(value, str):
+            items.append((field, value))
+        elif isinstance(value, dict):
+            items.extend(
+                (f"{field}.{key}", item)
+                for key, item in value.items()
+                if isinstance(item, (str, int, float)) and not isinstance(item, bool)
+            )
+    return items
+
+
+def _minimum_should_match(value: int | str, terms: int) -> int:
+    """
+    Возвращает количество терминов запроса, которое должно совпасть, для minimum_should_match
+    в виде числа или процента (как в Elasticsearch, процент округляется вниз, отрицательное
+    значение задает количество терминов, которые могут не совпасть).
+    """
+    text = str(value).strip()
+    if text.endswith("%"):
+        required = int(terms * abs(float(text[:-1])) / 100)
+        negative = text.startswith("-")
+    else:
+        required = abs(int(text))
+        negative = required != int(text)
+    if negative:
+        required = terms - required
+    return min(max(required, 0), terms)
+
+
+class _Index:
+    """
+    Индекс заменителя Elasticsearch: документы и инвертированный индекс по видимым документам.
+    """
+
+    def __init__(self, settings: dict | None = None, mappings: dict | None = None) -> None:
+        self.settings = dict(settings or {})
+        self.mappings = mappings or {}
+        self.documents: dict[str, dict] = {}
+        self.pending: set[str] = set()
+        self.terms: dict[tuple[str, str], set[str]] = defaultdict(set)
+        self.doc_terms: dict[str, Counter] = {}
+        # Точные значения полей для условий term (см. _keyword_items)
+        self.keywords: dict[tuple[str, Any], set[str]] = defaultdict(set)
+
+    def put(self, doc_id: str, document: dict) -> None:
+        self.remove(doc_id)
+        self.documents[doc_id] = document
+        self.pending.add(doc_id)
+
+    def remove(self, doc_id: str) -> bool:
+        self.pending.discard(doc_id)
+        for key in self.doc_terms.pop(doc_id, ()):
+            self.terms[key].discard(doc_id)
+        for key in _keyword_items(self.documents.get(doc_id, {})):
+            self.keywords.get(key, set()).discard(doc_id)
+        return self.documents.pop(doc_id, None) is not None
+
+    def refresh(self) -> None:
+        for doc_id in self.pending:
+            counts: Counter = Counter()
+            for field, value in self.documents[doc_id].items():
+                for term in TOKEN_RE.findall(_field_text(value).lower()):
+                    counts[(field, term)] += 1
+            self.doc_terms[doc_id] = counts
+            for key in counts:
+                self.terms[key].add(doc_id)
+            for key in _keyword_items(self.documents[doc_id]):
+                self.keywords[key].add(doc_id)
+        self.pending.clear()
+
+    def filter(self, filters: list[dict]) -> set[str]:
+        """
+        Возвращает видимые документы, удовлетворяющие filter-условиям term и range.
+        """
+        terms, ranges = [], []
+        for clause in filters:
+            ((kind, params),) = clause.items()
+            ((field, condition),) = params.items()
+            # Подполе keyword хранит то же значение, что и само поле
+            field = field.removesuffix(".keyword")
+            if kind == "term":
+                terms.append(self.keywords.get((field, condition), set()))
+            elif kind == "range":
+                ranges.append((field, condition.get("gte", -math.inf), condition.get("lte", math.inf)))
+            else:
+                raise NotImplementedError(f"Unsupported filter: {kind}")
+
+        terms.sort(key=len)
+        allowed = set(terms[0]).intersection(*terms[1:]) if terms else set(self.doc_terms)
+        for field, low, high in ranges:
+            allowed = {
+                doc_id
+                for doc_id in allowed
+                if self.documents[doc_id].get(field) is not None and low <= self.documents[doc_id][field] <= high
+            }
+        return allowed
+
+    def more_like_this(
+        self, mlt: dict, size: int, filters: list[dict] | None = None, should: list[dict] | None = None
+    ) -> list[dict]:
+        fields = set(mlt.get("fields", ()))
+        max_query_terms = mlt.get("max_query_terms", 25)
+        min_term_freq = mlt.get("min_term_freq", 2)
+        min_doc_freq = mlt.get("min_doc_freq", 5)
+        n_docs = max(len(self.doc_terms), 1)
+        # Термины, встречающиеся больше чем в половине документов, почти не влияют на оценку,
+        # но их перебор занимает почти все время поиска
+        max_doc_freq = mlt.get("max_doc_freq", n_docs // 2 or 1)
+
+        like_ids = {like["_id"] for like in mlt.get("like", ()) if isinstance(like, dict) and "_id" in like}
+        counts: Counter = Counter()
+        for doc_id in like_ids:
+            counts.update(self.doc_terms.get(doc_id, {}))
+
+        # Отбираем термины с наибольшим tf-idf, как это делает "more_like_this"
+        weighted = []
+        for key, tf in counts.items():
+            doc_freq = len(self.terms[key])
+            if (fields and key[0] not in fields) or tf < min_term_freq or not min_doc_freq <= doc_freq <= max_doc_freq:
+                continue
+            idf = math.log(1 + n_docs / doc_freq)
+            weighted.append((tf * idf, idf, key))
+        weighted.sort(reverse=True)
+
+        # Как и в Lucene, с фильтрами оцениваются только документы из пересечения
+        # списков документов термина и фильтра, перебирается меньший из них
+        allowed = self.filter(filters) if filters else None
+        scores: Counter = Counter()
+        matched: Counter = Counter()
+        query_terms = weighted[:max_query_terms]
+        for _, idf, key in query_terms:
+            postings = self.terms[key]
+            if allowed is not None:
+                postings = allowed & postings
+            for doc_id in postings:
+                scores[doc_id] += idf
+                matched[doc_id] += 1
+        for doc_id in like_ids:
+            scores.pop(doc_id, None)
+        required = _minimum_should_match(mlt.get("minimum_should_match", "30%"), len(query_terms))
+        if required > 1:
+            scores = Counter({doc_id: score for doc_id, score in scores.items() if matched[doc_id] >= required})
+        # Условия should только повышают оценку документов, найденных "more_like_this"
+        for clause in should or ():
+            constant_score = clause["constant_score"]
+            ((field, value),) = constant_score["filter"]["term"].items()
+            for doc_id in self.keywords.get((field, value), set()) & scores.keys():
+                scores[doc_id] += constant_score.get("boost", 1.0)
+        return [{"_id": doc_id, "_score": score} for doc_id, score in scores.most_common(size)]
+
+
+class _Indices:
+    """
+    Заменитель пространства имен indices клиента Elasticsearch.
+    """
+
+    def __init__(self, es: "InMemoryElasticsearch") -> None:
+        self._es = es
+
+    async def refresh(self, index: str, **kwargs) -> dict:
+        await self._es._roundtrip()
+        self._es._index(index).refresh()
+        return {}
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        await self._es._roundtrip()
+        return index in self._es.indices_data or index in self._es.aliases
+
+    async def create(self, index: str, settings: dict | None = None, mappings: dict | None = None, **kwargs) -> dict:
+        await self._es._roundtrip()
+        if index in self._es.indices_data or index in self._es.aliases:
+            raise ValueError(f"resource_already_exists_exception: index [{index}] already exists")
+        self._es.indices_data[index] = _Index(settings, mappings)
+        return {"acknowledged": True, "index": index}
+
+    async def delete(self, index: str, **kwargs) -> dict:
+        await self._es._roundtrip()
+        for name in index.split(","):
+            self._es.indices_data.pop(name, None)
+            for indices in self._es.aliases.values():
+                indices.discard(name)
+        return {"acknowledged": True}
+
+    async def put_settings(self, index: str, settings: dict, **kwargs) -> dict:
+        await self._es._roundtrip()
+        self._es._index(index).settings.update(settings.get("index", settings))
+        return {"acknowledged": True}
+
+    async def forcemerge(self, index: str, **kwargs) -> dict:
+        await self._es._roundtrip()
+        self._es._index(index).refresh()
+        return {}
+
+    async def exists_alias(self, name: str, **kwargs) -> bool:
+        await self._es._roundtrip()
+        return bool(self._es.aliases.get(name))
+
+    async def get_alias(self, name: str, **kwargs) -> dict:
+        await self._es._roundtrip()
+        return {index: {"aliases": {name: {}}} for index in self._es.aliases.get(name, ())}
+
+    async def update_aliases(self, actions: list[dict], **kwargs) -> dict:
+        await self._es._roundtrip()
+        for action in actions:
+            (op, params), *_ = action.items()
+            if op == "add":
+                self._es.aliases.setdefault(params["alias"], set()).add(params["index"])
+            elif op == "remove":
+                self._es.aliases.get(params["alias"], set()).discard(params["index"])
+            elif op == "remove_index":
+                self._es.indices_data.pop(params["index"], None)
+        return {"acknowledged": True}
+
+
+class InMemoryElasticsearch:
+    """
+    Заменитель AsyncElasticsearch, хранящий индексы в памяти процесса.
+
+    :param latency: Задержка каждого запроса в секундах, имитирующая сетевой round-trip.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.indices_data: dict[str, _Index] = {}
+        self.aliases: dict[str, set[str]] = {}
+        self.indices = _Indices(self)
+        self.requests: Counter = Counter()
+
+    def _index(self, name: str) -> _Index:
+        # Алиас разрешается в единственный индекс, несуществующий индекс создается при первой записи
+        if self.aliases.get(name):
+            (name,) = self.aliases[name]
+        if name not in self.indices_data:
+            self.indices_data[name] = _Index()
+        return self.indices_data[name]
+
+    def options(self, **kwargs) -> "InMemoryElasticsearch":
+        return self
+
+    async def _roundtrip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    async def index(self, index: str, id: str, document: dict, **kwargs) -> dict:
+        self.requests["index"] += 1
+        await self._roundtrip()
+        self._index(index).put(id, document)
+        return {"_id": id, "result": "created"}
+
+    async def bulk(self, operations: list[dict], index: str | None = None, **kwargs) -> dict:
+        self.requests["bulk"] += 1
+        await self._roundtrip()
+        items = []
+        operations = iter(operations)
+        for action in operations:
+            op, meta = next(iter(action.items()))
+            target = self._index(meta.get("_index", index))
+            if op == "delete":
+                found = target.remove(meta["_id"])
+                items.append({op: {"_id": meta["_id"], "status": 200 if found else 404}})
+            else:
+                target.put(meta["_id"], next(operations))
+                items.append({op: {"_id": meta["_id"], "status": 201}})
+        return {"errors": False, "items": items}
+
+    async def reindex(self, source: dict, dest: dict, **kwargs) -> dict:
+        self.requests["reindex"] += 1
+        await self._roundtrip()
+        source_index, target = self._index(source["index"]), self._index(dest["index"])
+        for doc_id, document in source_index.documents.items():
+            target.put(doc_id, document)
+        target.refresh()
+        return {"total": len(source_index.documents), "created": len(source_index.documents), "failures": []}
+
+    def _search(self, index: str, body: dict) -> dict:
+        query = body.get("query", {})
+        filters = should = None
+        if "bool" in query:
+            query, filters, should = (query["bool"].get(key, default) for key, default in BOOL_CLAUSES)
+        if "more_like_this" not in query:
+            raise NotImplementedError(f"Unsupported query: {list(query)}")
+        hits = self._index(index).more_like_this(query["more_like_this"], body.get("size", 10), filters, should)
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+    async def mget(self, index: str, ids: list[str], source_includes: list[str] | None = None, **kwargs) -> dict:
+        self.requests["mget"] += 1
+        await self._roundtrip()
+        # Как и в Elasticsearch, _mget читает документы в реальном времени, без ожидания refresh
+        target = self._index(index)
+        docs = []
+        for doc_id in ids:
+            document = target.documents.get(doc_id)
+            if document is None:
+                docs.append({"_id": doc_id, "found": False})
+                continue
+            if source_includes is not None:
+                document = {field: document[field] for field in source_includes if field in document}
+            docs.append({"_id": doc_id, "found": True, "_source": document})
+        return {"docs": docs}
+
+    async def search(self, index: str, body: dict | None = None, **kwargs) -> dict:
+        self.requests["search"] += 1
+        await self._roundtrip()
+        return self._search(index, body if body is not None else kwargs)
+
+    async def msearch(self, searches: list[dict], index: str | None = None, **kwargs) -> dict:
+        self.requests["msearch"] += 1
+        await self._roundtrip()
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            try:
+                responses.append(self._search(header.get("index", index), body))
+            except Exception as e:
+                responses.append({"error": repr(e), "status": 400})
+        return {"responses": responses}
+
+    async def close(self) -> None:
+        pass
+
+
+class _Transaction:
+    """
+    Заменитель транзакции asyncpg: изменения таблиц применяются только при успешном выходе из блока.
+    """
+
+    def __init__(self, driver: "_DriverConnection") -> None:
+        self._driver = driver
+
+    async def __aenter__(self) -> "_Transaction":
+        self._driver._staged.append(defaultdict(list))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        staged = self._driver._staged.pop()
+        if exc_type is not None:
+            return
+        target = self._driver._staged[-1] if self._driver._staged else self._driver.db.tables
+        for table, rows in staged.items():
+            target[table].extend(rows)
+
+
+class _DriverConnection:
+    """
+    Заменитель соединения asyncpg. COPY кодирует строки в текстовый формат COPY, чтобы
+    стоимость подготовки данных была сопоставима с настоящей, и сохраняет их в таблицу в памяти.
+    Прочие команды только учитываются в счетчике запросов.
+    """
+
+    def __init__(self, db: "InMemoryPostgres") -> None:
+        self.db = db
+        self._staged: list[dict[str, list]] = []
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self)
+
+    def _rows(self, table: str) -> list:
+        return self._staged[-1][table] if self._staged else self.db.tables[table]
+
+    async def copy_records_to_table(
+        self, table_name: str, *, records, columns=None, schema_name: str | None = None, **kwargs
+    ) -> str:
+        self.db.requests["copy"] += 1
+        await self.db._roundtrip()
+        rows = self._rows(table_name)
+        count = 0
+        for record in records:
+            self.db.copied_bytes += len("\t".join("\\N" if value is None else str(value) for value in record).encode())
+            rows.append(record)
+            count += 1
+        return f"COPY {count}"
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        self.db.requests["execute"] += 1
+        await self.db._roundtrip()
+        return "OK"
+
+    async def executemany(self, query: str, args, **kwargs) -> None:
+        self.db.requests["executemany"] += 1
+        await self.db._roundtrip()
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        self.db.requests["fetch"] += 1
+        await self.db._roundtrip()
+        return []
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        self.db.requests["fetchval"] += 1
+        await self.db._roundtrip()
+        return None
+
+
+class _RawConnection:
+    def __init__(self, driver: _DriverConnection) -> None:
+        self.driver_connection = driver
+
+
+class InMemoryConnection:
+    """
+    Заменитель AsyncConnection SQLAlchemy для функций app.db, работающих через get_driver_connection().
+    """
+
+    def __init__(self, db: "InMemoryPostgres") -> None:
+        self._raw = _RawConnection(_DriverConnection(db))
+
+    async def get_raw_connection(self) -> _RawConnection:
+        return self._raw
+
+
+class InMemoryPostgres:
+    """
+    Заменитель Postgres: таблицы — списки строк в памяти процесса.
+
+    :param latency: Задержка каждой команды в секундах, имитирующая сетевой round-trip.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.tables: dict[str, list] = defaultdict(list)
+        self.requests: Counter = Counter()
+        self.copied_bytes = 0
+
+    async def _roundtrip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    @contextlib.asynccontextmanager
+    async def connect(self) -> AsyncIterator[InMemoryConnection]:
+        yield InMemoryConnection(self)
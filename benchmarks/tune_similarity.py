@@ -0,0 +1,450 @@
+"""
+Подбор параметров поиска похожих товаров: качество против скорости.
+
+Перебирает сетку параметров запроса "more_like_this" (MltOptions) и поиска (блокировка,
+размер и параллельность _msearch) на загруженном индексе и для каждой настройки измеряет
+по размеченным парам заведомо похожих товаров:
+
+- recall@k — доля известных похожих товара, найденных в первых k результатах (среднее по товарам);
+- precision@k — доля известных похожих среди первых k результатов (среднее по товарам);
+- пропускную способность — товаров в секунду;
+- задержки p50/p99 одного запроса к Elasticsearch (_msearch пачки из --search-batch-size
+  поисков или _mget полей блоков). Для задержки одного поиска задайте --search-batch-size 1.
+
+Настройки, которые не хуже остальных одновременно по recall@k и пропускной способности,
+образуют фронт Парето и отмечаются в таблице. С --min-qps и --max-p99-ms отмечаются
+настройки, укладывающиеся в бюджет, и среди них выбирается настройка с лучшим recall@k.
+
+Разметка (--pairs) — CSV без заголовка или с заголовком, по паре товаров в строке. Товар
+задается UUID или парой marketplace_id:product_id. Пары симметричны: товар считается похожим
+на каждого, с кем он встречается в паре. Без --pairs генерируется синтетический фид
+(benchmarks.feedgen), загружается в индекс, и похожими считаются офферы одного семейства
+(с одинаковым штрихкодом). ВНИМАНИЕ: с --es-url и без --pairs синтетические документы
+загружаются в новый индекс, на который переключается алиас sku, — используйте отдельный инстанс.
+
+Запуск:
+    python -m benchmarks.tune_similarity --offers 20000 --max-query-terms 6,12,25 --min-doc-freq 1,5
+    python -m benchmarks.tune_similarity --es-url http://localhost:9200 --pairs pairs.csv \\
+        --fields title,description,brand,features --fields title,brand --blocking on,off --output tuning.json
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from app.es_utils import (
+    BlockingOptions,
+    MltOptions,
+    bulk_index_in_elasticsearch,
+    create_sku_index,
+    find_similar_skus_batch,
+    finish_index_load,
+    init_es,
+    new_sku_index_name,
+    swap_alias,
+)
+from app.parser import build_category_hierarchy, build_category_paths, iter_offer_batches, sku_uuid
+from app.utils import aiterate
+from benchmarks.feedgen import FeedSpec, write_feed
+from benchmarks.run import git_revision, percentile
+from benchmarks.standins import InMemoryElasticsearch
+
+
+class Setting(NamedTuple):
+    """
+    Одна точка сетки параметров.
+    """
+
+    mlt: MltOptions
+    blocking: BlockingOptions
+    search_batch_size: int
+    search_concurrency: int
+
+    def describe(self) -> dict:
+        return {
+            "fields": ",".join(self.mlt.fields),
+            "size": self.mlt.size,
+            "min_term_freq": self.mlt.min_term_freq,
+            "min_doc_freq": self.mlt.min_doc_freq,
+            "max_doc_freq": self.mlt.max_doc_freq,
+            "max_query_terms": self.mlt.max_query_terms,
+            "minimum_should_match": self.mlt.minimum_should_match,
+            "attribute_boost": self.mlt.attribute_boost,
+            "blocking": self.blocking.enabled,
+            "price_band": self.blocking.price_band,
+            "search_batch_size": self.search_batch_size,
+            "search_concurrency": self.search_concurrency,
+        }
+
+
+class TimedClient:
+    """
+    Обертка клиента Elasticsearch, замеряющая длительность запросов _msearch и _mget.
+    """
+
+    def __init__(self, es_client) -> None:
+        self.es_client = es_client
+        self.samples: list[float] = []
+
+    def __getattr__(self, name: str):
+        return getattr(self.es_client, name)
+
+    async def _timed(self, call, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    async def msearch(self, *args, **kwargs):
+        return await self._timed(self.es_client.msearch, *args, **kwargs)
+
+    async def mget(self, *args, **kwargs):
+        return await self._timed(self.es_client.mget, *args, **kwargs)
+
+
+def parse_item(value: str) -> uuid.UUID:
+    """
+    Разбирает товар из разметки: UUID или marketplace_id:product_id.
+
+    :raise ValueError: Значение не UUID и не пара чисел.
+    """
+    value = value.strip()
+    if ":" in value:
+        marketplace_id, product_id = value.split(":", 1)
+        return sku_uuid(int(marketplace_id), int(product_id))
+    return uuid.UUID(value)
+
+
+def load_pairs(file_path: str) -> dict[uuid.UUID, set[uuid.UUID]]:
+    """
+    Читает размеченные пары похожих товаров.
+
+    :param file_path: Путь к CSV-файлу с парами. Строки, начинающиеся с #, пропускаются.
+    :return: UUID товара -> UUID известных похожих товаров.
+    :raise ValueError: Строка файла не разбирается (кроме заголовка).
+    """
+    relevant: dict[uuid.UUID, set[uuid.UUID]] = defaultdict(set)
+    with open(file_path, newline="", encoding="utf-8") as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                left, right = parse_item(row[0]), parse_item(row[1])
+            except (ValueError, IndexError):
+                if line_number == 1:
+                    continue  # Заголовок
+                raise ValueError(f"{file_path}:{line_number}: expected two items, got {row!r}")
+            if left != right:
+                relevant[left].add(right)
+                relevant[right].add(left)
+    return dict(relevant)
+
+
+async def load_synthetic(es_client, args: argparse.Namespace, tmp_dir: str) -> dict[uuid.UUID, set[uuid.UUID]]:
+    """
+    Генерирует синтетический фид, загружает его в новый индекс под алиасом sku и возвращает
+    разметку: похожими считаются офферы одного семейства.
+    """
+    spec = FeedSpec(**{field: getattr(args, field) for field in FeedSpec._fields})
+    file_path = os.path.join(tmp_dir, "feed.xml")
+    write_feed(file_path, spec)
+    categories, parent_map = build_category_hierarchy(file_path)
+    category_paths = build_category_paths(categories, parent_map)
+
+    index = new_sku_index_name()
+    await create_sku_index(es_client, index, loading=True)
+    families: dict[str, list[uuid.UUID]] = defaultdict(list)
+    for batch in iter_offer_batches(file_path, category_paths, 5000):
+        for sku in batch:
+            families[sku.barcode].append(sku.uuid)
+        await bulk_index_in_elasticsearch(es_client, aiterate(batch), index=index)
+    await finish_index_load(es_client, index)
+    await swap_alias(es_client, index, delete_old=False)
+
+    relevant: dict[uuid.UUID, set[uuid.UUID]] = {}
+    for members in families.values():
+        for sku_id in members:
+            others = set(members) - {sku_id}
+            if others:
+                relevant[sku_id] = others
+    return relevant
+
+
+def build_grid(args: argparse.Namespace) -> list[Setting]:
+    """
+    Строит сетку настроек — декартово произведение значений параметров.
+    """
+    grid = []
+    for values in itertools.product(
+        args.fields or [",".join(MltOptions().fields)],
+        args.size,
+        args.min_term_freq,
+        args.min_doc_freq,
+        args.max_doc_freq,
+        args.max_query_terms,
+        args.minimum_should_match,
+        args.attribute_boost,
+        args.blocking,
+        args.price_band,
+        args.search_batch_size,
+        args.search_concurrency,
+    ):
+        fields, size, min_tf, min_df, max_df, max_terms, should_match, boost, blocking, band, batch, concurrency = (
+            values
+        )
+        mlt = MltOptions(
+            fields=tuple(field.strip() for field in fields.split(",") if field.strip()),
+            size=size,
+            min_term_freq=min_tf,
+            min_doc_freq=min_df,
+            max_doc_freq=max_df,
+            max_query_terms=max_terms,
+            minimum_should_match=should_match,
+            attribute_boost=boost,
+        )
+        blocking_options = BlockingOptions(
+            enabled=blocking, price_band=band, min_hits=min(size, BlockingOptions().min_hits)
+        )
+        grid.append(Setting(mlt, blocking_options, batch, concurrency))
+    return grid
+
+
+async def evaluate(
+    es_client, setting: Setting, queries: list[uuid.UUID], relevant: dict[uuid.UUID, set[uuid.UUID]], k: int
+) -> dict:
+    """
+    Ищет похожие для queries с настройкой setting и считает метрики качества и скорости.
+
+    :param es_client: Клиент Elasticsearch.
+    :param setting: Настройка поиска.
+    :param queries: UUID товаров, для которых ищутся похожие.
+    :param relevant: Разметка: UUID товара -> UUID известных похожих товаров.
+    :param k: Количество первых результатов, по которым считаются recall@k и precision@k.
+    :return: Параметры настройки и метрики.
+    """
+    timed = TimedClient(es_client)
+    started = time.perf_counter()
+    similar, failed = await find_similar_skus_batch(
+        timed,
+        queries,
+        batch_size=setting.search_batch_size,
+        max_concurrency=setting.search_concurrency,
+        blocking=setting.blocking,
+        mlt=setting.mlt,
+    )
+    seconds = time.perf_counter() - started
+
+    recall = precision = 0.0
+    for sku_id in queries:
+        found = [similar_id for similar_id, _ in similar.get(sku_id, [])[:k]]
+        hits = len(relevant[sku_id].intersection(found))
+        recall += hits / len(relevant[sku_id])
+        precision += hits / k
+    return {
+        **setting.describe(),
+        "recall": round(recall / len(queries), 4),
+        "precision": round(precision / len(queries), 4),
+        "qps": round(len(queries) / seconds, 1),
+        "p50_ms": round(percentile(timed.samples, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(timed.samples, 0.99) * 1000, 3),
+        "requests": len(timed.samples),
+        "failed": len(failed),
+    }
+
+
+def mark_pareto(results: list[dict]) -> None:
+    """
+    Отмечает настройки фронта Парето по recall@k и пропускной способности (pareto=True):
+    нет другой настройки, которая не хуже по обоим показателям и лучше хотя бы по одному.
+    """
+    for result in results:
+        result["pareto"] = not any(
+            other["recall"] >= result["recall"]
+            and other["qps"] >= result["qps"]
+            and (other["recall"] > result["recall"] or other["qps"] > result["qps"])
+            for other in results
+        )
+
+
+def mark_budget(results: list[dict], min_qps: float | None, max_p99_ms: float | None) -> dict | None:
+    """
+    Отмечает настройки, укладывающиеся в бюджет (in_budget=True), и возвращает среди них
+    настройку с лучшим recall@k (при равенстве — с большей пропускной способностью).
+    """
+    best = None
+    for result in results:
+        result["in_budget"] = (min_qps is None or result["qps"] >= min_qps) and (
+            max_p99_ms is None or result["p99_ms"] <= max_p99_ms
+        )
+        if result["in_budget"] and (best is None or (result["recall"], result["qps"]) > (best["recall"], best["qps"])):
+            best = result
+    return best
+
+
+def print_table(results: list[dict], k: int, best: dict | None) -> None:
+    """
+    Печатает настройки по убыванию recall@k с отметками фронта Парето и бюджета.
+
+    В столбцы выносятся только параметры, которые меняются в сетке, остальные печатаются одной строкой.
+    """
+    keys = list(results[0])
+    params = keys[: keys.index("recall")]
+    varying = [param for param in params if len({str(result[param]) for result in results}) > 1]
+    fixed = ", ".join(f"{param}={results[0][param]}" for param in params if param not in varying)
+    print(f"fixed: {fixed}")
+
+    widths = {param: max(len(param), *(len(str(result[param])) for result in results)) for param in varying}
+    header = " ".join(f"{param:>{widths[param]}}" for param in varying)
+    print(f"{header} {f'R@{k}':>6} {f'P@{k}':>6} {'qps':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for result in sorted(results, key=lambda item: (-item["recall"], -item["qps"])):
+        marks = ("P" if result["pareto"] else " ") + ("B" if result["in_budget"] else " ")
+        marks += " <- best" if result is best else ""
+        row = " ".join(f"{str(result[param]):>{widths[param]}}" for param in varying)
+        print(
+            f"{row} {result['recall']:>6.3f} {result['precision']:>6.3f} {result['qps']:>9,.0f} "
+            f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}  {marks}"
+        )
+    print("\nP — фронт Парето по recall и qps, B — в пределах бюджета")
+    if best is None:
+        print("Ни одна настройка не укладывается в бюджет")
+
+
+async def run(args: argparse.Namespace, tmp_dir: str) -> tuple[list[dict], int]:
+    """
+    Загружает разметку (и синтетический индекс), перебирает сетку и возвращает результаты
+    настроек и количество товаров-запросов.
+    """
+    if args.es_url:
+        es_client = await init_es(args.es_url)
+    else:
+        es_client = InMemoryElasticsearch(latency=args.latency_ms / 1000)
+    try:
+        if args.pairs:
+            relevant = load_pairs(args.pairs)
+        else:
+            relevant = await load_synthetic(es_client, args, tmp_dir)
+        if not relevant:
+            raise SystemExit("No labelled pairs")
+
+        labelled = sorted(relevant)
+        queries = random.Random(args.seed).sample(labelled, min(args.queries, len(labelled)))
+        grid = build_grid(args)
+        logging.getLogger(__name__).info("Evaluating %d settings on %d queries", len(grid), len(queries))
+
+        # Прогрев кэшей индекса, чтобы первая настройка не измерялась на холодном кэше
+        if args.warmup:
+            await evaluate(es_client, grid[0], queries[: args.warmup], relevant, args.k)
+
+        results = []
+        for number, setting in enumerate(grid, start=1):
+            result = await evaluate(es_client, setting, queries, relevant, args.k)
+            print(
+                f"[{number}/{len(grid)}] R@{args.k}={result['recall']:.3f} qps={result['qps']:,.0f} "
+                f"p99={result['p99_ms']:.2f} ms",
+                flush=True,
+            )
+            results.append(result)
+        return results, len(queries)
+    finally:
+        await es_client.close()
+
+
+def main() -> None:
+    def ints(value: str) -> list[int]:
+        return [int(item) for item in value.split(",")]
+
+    def optional_ints(value: str) -> list[int | None]:
+        return [None if item in ("", "none") else int(item) for item in value.split(",")]
+
+    def floats(value: str) -> list[float]:
+        return [float(item) for item in value.split(",")]
+
+    def strings(value: str) -> list[str]:
+        return value.split(",")
+
+    def switches(value: str) -> list[bool]:
+        return [item.strip().lower() in ("on", "true", "1", "yes") for item in value.split(",")]
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data = arg_parser.add_argument_group("данные")
+    data.add_argument("--pairs", help="CSV с размеченными парами похожих товаров (по умолчанию — синтетический фид)")
+    data.add_argument("--es-url", help="URL настоящего Elasticsearch (по умолчанию — заменитель в памяти)")
+    data.add_argument("--latency-ms", type=float, default=0.0, help="задержка запроса к заменителю")
+    data.add_argument("--queries", type=int, default=1000, help="количество товаров-запросов из разметки")
+    data.add_argument("--warmup", type=int, default=200, help="количество запросов прогрева перед перебором")
+    data.add_argument("--seed", type=int, default=0)
+    defaults = FeedSpec()
+    for field in FeedSpec._fields:
+        if field != "seed":
+            data.add_argument(f"--{field.replace('_', '-')}", type=int, default=getattr(defaults, field))
+
+    grid = arg_parser.add_argument_group("сетка параметров (значения через запятую)")
+    mlt = MltOptions()
+    grid.add_argument(
+        "--fields", action="append", help=f"поля через запятую, можно повторять (по умолчанию {','.join(mlt.fields)})"
+    )
+    grid.add_argument("--size", type=ints, default=[mlt.size])
+    grid.add_argument("--min-term-freq", type=ints, default=[mlt.min_term_freq])
+    grid.add_argument("--min-doc-freq", type=ints, default=[mlt.min_doc_freq])
+    grid.add_argument("--max-doc-freq", type=optional_ints, default=[mlt.max_doc_freq], help="none — без ограничения")
+    grid.add_argument("--max-query-terms", type=ints, default=[mlt.max_query_terms])
+    grid.add_argument("--minimum-should-match", type=strings, default=[mlt.minimum_should_match])
+    grid.add_argument("--attribute-boost", type=floats, default=[mlt.attribute_boost], help="0 — без атрибутов")
+    grid.add_argument("--blocking", type=switches, default=[BlockingOptions().enabled], help="on, off или on,off")
+    grid.add_argument("--price-band", type=floats, default=[BlockingOptions().price_band])
+    grid.add_argument("--search-batch-size", type=ints, default=[100])
+    grid.add_argument("--search-concurrency", type=ints, default=[4])
+
+    output = arg_parser.add_argument_group("результаты")
+    output.add_argument("--k", type=int, default=mlt.size, help="k для recall@k и precision@k")
+    output.add_argument("--min-qps", type=float, help="бюджет: минимальная пропускная способность")
+    output.add_argument("--max-p99-ms", type=float, help="бюджет: максимальная задержка p99 запроса")
+    output.add_argument("--output", help="файл для сохранения результатов в JSON")
+    output.add_argument("--verbose", action="store_true", help="выводить лог приложения уровня INFO")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results, queries = asyncio.run(run(args, tmp_dir))
+
+    mark_pareto(results)
+    best = mark_budget(results, args.min_qps, args.max_p99_ms)
+    print()
+    print_table(results, args.k, best)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "revision": git_revision(),
+                        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                        "labels": args.pairs or "synthetic",
+                        "elasticsearch": "real" if args.es_url else "standin",
+                        "queries": queries,
+                        "k": args.k,
+                        "budget": {"min_qps": args.min_qps, "max_p99_ms": args.max_p99_ms},
+                    },
+                    "results": results,
+                    "best": best,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
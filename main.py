@@ -1,11 +1,32 @@
 import asyncio
+import logging
+import time
 
 from environs import Env
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-from app.es_utils import find_similar_skus, index_in_elasticsearch, init_es
+from app.clustering import ClusteringOptions
+from app.db import save_category_paths
+from app.es_utils import BlockingOptions, MltOptions, init_es
+from app.ingest import (
+    cluster_products,
+    discard_checkpoint_indices,
+    find_resumable_checkpoint,
+    ingest_bulk,
+    ingest_incremental,
+    ingest_stream,
+)
+from app.metrics import STAGE_CATEGORIES, log_summary, observe, start_metrics_server, write_metrics
 from app.models import Base
-from app.parser import build_category_hierarchy, parse_xml
+from app.parser import ParseOptions, build_category_hierarchy, build_category_paths
+from app.pipeline import PipelineOptions
+from app.profiling import install_offer_profiler
+from app.worker import mlt_options_from_env, worker_options_from_env
+
+logger = logging.getLogger(__name__)
+
+INGEST_MODES = ("bulk", "incremental", "stream")
+SIMILARITY_BACKENDS = ("es", "tfidf")
 
 
 async def drop_tables(engine: AsyncEngine) -> None:
@@ -44,7 +65,38 @@ async def main() -> None:
     3. Удаляет и создает таблицы в базе данных.
     4. Инициализирует клиент Elasticsearch.
     5. Получает категории из XML файла и парсит офферы.
-    6. Индексирует офферы в Elasticsearch и обновляет поле similar_sku.
+    6. Индексирует офферы в Elasticsearch и сохраняет похожие товары в таблицу sku_similarity.
+
+    Режим загрузки задается переменной окружения INGEST_MODE:
+    - stream: пачки офферов проходят конвейер парсинг -> БД -> Elasticsearch -> поиск похожих, этапы работают
+      одновременно и соединены ограниченными очередями (STREAM_BATCH_SIZE, PIPELINE_*);
+    - bulk: сначала все офферы загружаются bulk-запросами, затем отдельным этапом ищутся похожие;
+    - incremental: таблицы не пересоздаются, загружаются и переиндексируются только измененные офферы.
+      Похожие пересчитываются для измененных товаров, ссылающихся на них товаров и INCREMENTAL_NEIGHBOURS
+      первых похожих каждого нового и измененного товара; у остальных неизменных товаров новый оффер
+      появится в похожих только после полной загрузки.
+
+    В режиме bulk бэкенд поиска похожих задается переменной SIMILARITY_BACKEND:
+    es (Elasticsearch "more_like_this") или tfidf (вычисление в процессе, без Elasticsearch).
+    С бэкендом es прерванная загрузка того же файла продолжается с последней записанной пачки,
+    таблицы при этом не пересоздаются.
+
+    Похожие товары через Elasticsearch ищутся среди товаров той же категории, бренда и ценового
+    диапазона с расширением блока, если в нем мало кандидатов (SIMILARITY_BLOCKING,
+    SIMILARITY_PRICE_BAND, SIMILARITY_MIN_HITS).
+
+    В режиме bulk поиск похожих разбит на задачи в таблице similarity_job, которые выполняют
+    SIMILARITY_WORKERS воркеров этого процесса и воркеры python -m app.worker в других контейнерах
+    (SIMILARITY_HEARTBEAT_INTERVAL, SIMILARITY_LEASE_TIMEOUT, SIMILARITY_MAX_ATTEMPTS).
+
+    После загрузки офферы одного товара объединяются в кластеры по штрихкоду, бренду и коду модели
+    и почти совпадающим названиям (PRODUCT_CLUSTERING, CLUSTER_TITLE_THRESHOLD).
+
+    PATH_TO_FILE может указывать на несжатый фид или на сжатый (.xml.gz, .xml.zst).
+
+    Метрики этапов загрузки отдаются в формате Prometheus на порту METRICS_PORT (0 — выключено)
+    и по завершении сохраняются в METRICS_FILE, если он задан. PROFILE_SAMPLE_RATE > 0 включает
+    профилирование такой доли офферов при парсинге (бэкенд PROFILE_BACKEND, результат в PROFILE_OUTPUT).
 
     Исключения:
     - Вызываются при ошибках соединения с базой данных, выполнения операций или обработки данных.
@@ -61,41 +113,164 @@ async def main() -> None:
     DATABASE_URL: str = (
         f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@" f"{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
     )
-    ELASTICSEARCH_URL: str = env("ELASTICSEARCH_HOST")
+    ELASTICSEARCH_URL: str = env("ELASTICSEARCH_HOST", None)
+    PATH_TO_FILE: str = env("PATH_TO_FILE")
+    INGEST_MODE: str = env("INGEST_MODE", "stream")
+    ES_BULK_CHUNK_SIZE: int = env.int("ES_BULK_CHUNK_SIZE", 500)
+    ES_BULK_CONCURRENCY: int = env.int("ES_BULK_CONCURRENCY", 4)
+    DB_BATCH_SIZE: int = env.int("DB_BATCH_SIZE", 5000)
+    ES_SEARCH_BATCH_SIZE: int = env.int("ES_SEARCH_BATCH_SIZE", 100)
+    ES_SEARCH_CONCURRENCY: int = env.int("ES_SEARCH_CONCURRENCY", 4)
+    SIMILARITY_BACKEND: str = env("SIMILARITY_BACKEND", "es")
+    TFIDF_BLOCK_SIZE: int = env.int("TFIDF_BLOCK_SIZE", 256)
+    TFIDF_WORKERS: int | None = env.int("TFIDF_WORKERS", None)
+    TFIDF_MAX_DF: float = env.float("TFIDF_MAX_DF", 0.5)
+    ES_REPLICAS: int = env.int("ES_REPLICAS", 0)
+    BLOCKING: BlockingOptions = BlockingOptions(
+        enabled=env.bool("SIMILARITY_BLOCKING", True),
+        price_band=env.float("SIMILARITY_PRICE_BAND", 2.0),
+        min_hits=env.int("SIMILARITY_MIN_HITS", 5),
+    )
+    MLT: MltOptions = mlt_options_from_env(env)
+    PARSE_OPTIONS: ParseOptions = ParseOptions(
+        workers=env.int("PARSE_WORKERS", 0),
+        chunk_bytes=env.int("PARSE_CHUNK_MB", 16) * 1024 * 1024,
+        ordered=env.bool("PARSE_ORDERED", True),
+    )
+    SIMILARITY_WORKERS: int = env.int("SIMILARITY_WORKERS", 1)
+    STREAM_BATCH_SIZE: int = env.int("STREAM_BATCH_SIZE", 1000)
+    INCREMENTAL_NEIGHBOURS: int = env.int("INCREMENTAL_NEIGHBOURS", 5)
+    PIPELINE_OPTIONS: PipelineOptions = PipelineOptions(
+        queue_size=env.int("PIPELINE_QUEUE_SIZE", 4),
+        db_writers=env.int("PIPELINE_DB_WRITERS", 2),
+        es_writers=env.int("PIPELINE_ES_WRITERS", 2),
+        similarity_workers=env.int("PIPELINE_SIMILARITY_WORKERS", 2),
+    )
+    CLUSTERING: ClusteringOptions = ClusteringOptions(
+        enabled=env.bool("PRODUCT_CLUSTERING", True),
+        title_threshold=env.float("CLUSTER_TITLE_THRESHOLD", 0.8),
+    )
+    SQL_ECHO: bool = env.bool("SQL_ECHO", False)
+    LOG_LEVEL: str = env("LOG_LEVEL", "INFO")
+    METRICS_PORT: int = env.int("METRICS_PORT", 8000)
+    METRICS_FILE: str | None = env("METRICS_FILE", None)
+    PROFILE_SAMPLE_RATE: float = env.float("PROFILE_SAMPLE_RATE", 0.0)
+    PROFILE_BACKEND: str = env("PROFILE_BACKEND", "cprofile")
+    PROFILE_OUTPUT: str = env("PROFILE_OUTPUT", "offers.prof")
 
-    # Создание асинхронного движка SQLAlchemy
-    engine = create_async_engine(DATABASE_URL, echo=True)
-    async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    # Проверка режимов до любых разрушающих действий (удаление таблиц и индексов)
+    if INGEST_MODE not in INGEST_MODES:
+        raise ValueError(f"Unknown INGEST_MODE: {INGEST_MODE}")
+    if SIMILARITY_BACKEND not in SIMILARITY_BACKENDS:
+        raise ValueError(f"Unknown SIMILARITY_BACKEND: {SIMILARITY_BACKEND}")
 
-    # Пересоздание таблиц
-    await drop_tables(engine)
-    await create_tables(engine)
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    profiler = None
+    if PROFILE_SAMPLE_RATE > 0:
+        profiler = install_offer_profiler(PROFILE_SAMPLE_RATE, PROFILE_OUTPUT, PROFILE_BACKEND)
+        if PARSE_OPTIONS.workers > 0:
+            logger.warning("Offer profiling covers in-process parsing only, set PARSE_WORKERS=0 to profile offers")
 
-    # Инициализация клиента Elasticsearch
-    es_client = await init_es(ELASTICSEARCH_URL)
+    # Создание асинхронного движка SQLAlchemy
+    engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+
+    # Поиск чекпоинта прерванной загрузки того же фида
+    checkpoint = None
+    if INGEST_MODE == "bulk" and SIMILARITY_BACKEND == "es":
+        checkpoint = await find_resumable_checkpoint(engine, PATH_TO_FILE)
 
-    # Получение категорий из XML файла
-    categories, parent_map = build_category_hierarchy(env("PATH_TO_FILE"))
+    # Инициализация клиента Elasticsearch (бэкенду tfidf он не нужен)
+    es_client = None
+    if INGEST_MODE != "bulk" or SIMILARITY_BACKEND == "es":
+        es_client = await init_es(ELASTICSEARCH_URL)
 
-    async with async_session() as session:
-        # Парсинг офферов
-        async for sku in parse_xml(env("PATH_TO_FILE"), categories, parent_map):
-            session.add(sku)
-            # Индексирование товара в Elasticsearch
-            await index_in_elasticsearch(es_client, sku)
+    # Пересоздание таблиц (инкрементальная и продолжаемая загрузки работают поверх данных прошлых запусков).
+    # Вместе с таблицами теряются чекпоинты прерванных загрузок, поэтому их индексы удаляются заранее
+    if INGEST_MODE != "incremental" and checkpoint is None:
+        if es_client is not None:
+            await discard_checkpoint_indices(engine, es_client)
+        await drop_tables(engine)
+    await create_tables(engine)
 
-            # Поиск похожих товаров
-            similar_skus = await find_similar_skus(es_client, sku)
+    # Получение категорий из XML файла и построение таблицы путей категорий
+    started = time.perf_counter()
+    categories, parent_map = build_category_hierarchy(PATH_TO_FILE)
+    category_paths = build_category_paths(categories, parent_map)
+    observe(STAGE_CATEGORIES, time.perf_counter() - started, len(categories))
+    async with engine.connect() as conn:
+        await save_category_paths(conn, categories, parent_map, category_paths)
 
-            # Обновление поля similar_sku
-            sku.similar_sku = similar_skus
-            print(f"{'_' * 29} Updating SKU {sku.uuid} with similar SKUs: {similar_skus}")  # Вывод информации
+    if INGEST_MODE == "bulk":
+        await ingest_bulk(
+            engine,
+            es_client,
+            PATH_TO_FILE,
+            category_paths,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            max_concurrency=ES_BULK_CONCURRENCY,
+            db_batch_size=DB_BATCH_SIZE,
+            search_batch_size=ES_SEARCH_BATCH_SIZE,
+            search_concurrency=ES_SEARCH_CONCURRENCY,
+            similarity_backend=SIMILARITY_BACKEND,
+            tfidf_block_size=TFIDF_BLOCK_SIZE,
+            tfidf_workers=TFIDF_WORKERS,
+            tfidf_max_df=TFIDF_MAX_DF,
+            parse_options=PARSE_OPTIONS,
+            checkpoint=checkpoint,
+            es_replicas=ES_REPLICAS,
+            blocking=BLOCKING,
+            mlt=MLT,
+            similarity_workers=SIMILARITY_WORKERS,
+            worker_options=worker_options_from_env(env),
+        )
+    elif INGEST_MODE == "incremental":
+        await ingest_incremental(
+            engine,
+            es_client,
+            PATH_TO_FILE,
+            category_paths,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            max_concurrency=ES_BULK_CONCURRENCY,
+            db_batch_size=DB_BATCH_SIZE,
+            search_batch_size=ES_SEARCH_BATCH_SIZE,
+            search_concurrency=ES_SEARCH_CONCURRENCY,
+            parse_options=PARSE_OPTIONS,
+            blocking=BLOCKING,
+            mlt=MLT,
+            neighbours=INCREMENTAL_NEIGHBOURS,
+        )
+    else:
+        await ingest_stream(
+            engine,
+            es_client,
+            PATH_TO_FILE,
+            category_paths,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            db_batch_size=STREAM_BATCH_SIZE,
+            search_batch_size=ES_SEARCH_BATCH_SIZE,
+            parse_options=PARSE_OPTIONS,
+            pipeline_options=PIPELINE_OPTIONS,
+            blocking=BLOCKING,
+            mlt=MLT,
+        )
 
-            await session.commit()
+    # Кластеризация офферов одного товара
+    if CLUSTERING.enabled:
+        await cluster_products(engine, DB_BATCH_SIZE, CLUSTERING)
 
     # Закрытие соединения с базой данных и клиентом Elasticsearch
     await engine.dispose()
-    await es_client.close()
+    if es_client is not None:
+        await es_client.close()
+
+    # Сводка по этапам и результаты профилирования
+    log_summary()
+    if METRICS_FILE:
+        write_metrics(METRICS_FILE)
+    if profiler is not None:
+        profiler.dump()
 
 
 if __name__ == "__main__":
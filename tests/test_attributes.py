@@ -0,0 +1,97 @@
+import pytest
+
+from app.attributes import extract_attributes, extract_model_codes, parse_color, parse_size_gb
+
+
+@pytest.mark.parametrize(
+    "title, features, expected",
+    [
+        (
+            "Смартфон Apple iPhone 15 Pro 1 ТБ, Dual: nano SIM + eSIM, серый титан",
+            {},
+            {"storage_gb": 1024, "color": "серый"},
+        ),
+        (
+            "Смартфон Samsung Galaxy S21 FE 8/256 ГБ, Dual nano SIM, зеленый",
+            {},
+            {"ram_gb": 8, "storage_gb": 256, "color": "зеленый"},
+        ),
+        (
+            'HISENSE Телевизор QLED Hisense 55" 55E7KQ черный 4K Ultra HD 60Hz',
+            {},
+            {"screen_in": 55, "model_code": "55E7KQ", "color": "черный"},
+        ),
+        (
+            '32" Телевизор TELEFUNKEN TF-LED32S71T2 2021 VA, черный',
+            {},
+            {"screen_in": 32, "model_code": "TFLED32S71T2", "color": "черный"},
+        ),
+        (
+            "Ноутбук 15,6 дюйма 16 ГБ 512 ГБ",
+            {},
+            {"screen_in": 15.6, "ram_gb": 16, "storage_gb": 512},
+        ),
+        # Характеристики важнее названия, диагональ в сантиметрах переводится в дюймы
+        (
+            "Телевизор LG 50 дюймов",
+            {"Диагональ": "139 см", "Цвет": "Темно-синий"},
+            {"screen_in": 54.7, "color": "синий"},
+        ),
+        (
+            "Смартфон Xiaomi",
+            {"Встроенная память, ГБ": "128", "Оперативная память": "6 ГБ", "Модель": "23053RN02Y"},
+            {"storage_gb": 128, "ram_gb": 6, "model_code": "23053RN02Y"},
+        ),
+        # Сантиметры и дюймы в названиях товаров без экрана — не диагональ
+        ("Кабель HDMI 2.0 150 см черный", {}, {"color": "черный"}),
+        ("Полка настенная 60 см", {}, {}),
+        (
+            'NordFolk ICE-5WP bl настенная влагозащищенная АС, 60 Вт, 5,25"/1", IP-54, 100V, черная (1шт)',
+            {},
+            {"model_code": "ICE5WP", "color": "черный"},
+        ),
+        ("Шины летние 17 дюймов", {}, {}),
+        # Объем видеокарты и карты памяти не считается встроенной памятью
+        ("Ноутбук", {"Объем видеопамяти, ГБ": "8", "Встроенная память": "1 ТБ"}, {"storage_gb": 1024}),
+        ("", None, {}),
+    ],
+)
+def test_extract_attributes(title, features, expected):
+    assert extract_attributes(title, features) == expected
+
+
+@pytest.mark.parametrize(
+    "text, default_unit, expected",
+    [
+        ("256 ГБ", None, 256),
+        ("1TB", None, 1024),
+        ("512 МБ", None, 0.5),
+        ("0,5 Тб", None, 512),
+        ("128", "гб", 128),
+        ("128", None, None),
+        ("USB 3.0", None, None),
+    ],
+)
+def test_parse_size_gb(text, default_unit, expected):
+    assert parse_size_gb(text, default_unit) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Серый титан", "серый"),
+        ("темно-синяя", "синий"),
+        ("Black", "черный"),
+        ("Сервер Dell", None),
+        ("Синтезатор Casio", None),
+    ],
+)
+def test_parse_color(text, expected):
+    assert parse_color(text) == expected
+
+
+def test_extract_model_codes():
+    assert extract_model_codes("Тыловой канал BEHRINGER Eurolive B210D, 1 колонка") == {"B210D"}
+    assert extract_model_codes("Телевизор 4K 60Hz 2021") == set()
+    # Кириллические буквы, похожие на латинские, приводятся к латинице
+    assert extract_model_codes("Телевизор 55Е7КQ") == {"55E7KQ"}
@@ -0,0 +1,56 @@
+from app.cache import TTLCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_set_after_invalidation_is_dropped():
+    cache = TTLCache(10, 60.0)
+    generation = cache.generation
+
+    # Запись прочитана до инвалидации и не должна попасть в кэш после нее
+    cache.invalidate(["a"])
+    cache.set("a", 1, generation)
+    assert cache.get("a") is None
+
+    cache.set("a", 2, cache.generation)
+    assert cache.get("a") == 2
+
+
+def test_clear_advances_generation():
+    cache = TTLCache(10, 60.0)
+    generation = cache.generation
+    cache.clear()
+    cache.set("a", 1, generation)
+    assert len(cache) == 0
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = TTLCache(10, 60.0, clock=clock)
+    cache.set("long", 1)
+    cache.set("short", 2, ttl=5.0)
+
+    clock.now = 5.0
+    assert cache.get("short") is None
+    assert cache.get("long") == 1
+
+    clock.now = 60.0
+    assert cache.get("long") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(2, 60.0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
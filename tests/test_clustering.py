@@ -0,0 +1,94 @@
+import uuid
+
+import pytest
+
+from app.clustering import ProductClusterer, normalize_barcodes
+
+KETTLE = "Чайник электрический Polaris PWK 1803 стальной 1.8 л 2200 Вт быстрый"
+
+
+@pytest.mark.parametrize(
+    "barcode, expected",
+    [
+        ("4006381333931", ["04006381333931"]),
+        # UPC-A и EAN-13 с ведущим нулем — один GTIN
+        ("036000291452", ["00036000291452"]),
+        ("0036000291452", ["00036000291452"]),
+        ("00036000291452", ["00036000291452"]),
+        ("96385074", ["00000096385074"]),
+        ("4006381333931, 96385074; мусор 123", ["04006381333931", "00000096385074"]),
+        # Неверная контрольная цифра, одни нули, неподходящая длина, не цифры
+        ("4006381333932", []),
+        ("0000000000000", []),
+        ("40063813339", []),
+        ("40063813339-31", []),
+        ("нет", []),
+        ("", []),
+        (None, []),
+    ],
+)
+def test_normalize_barcodes(barcode, expected):
+    assert normalize_barcodes(barcode) == expected
+
+
+def cluster(*offers) -> list[int]:
+    """
+    Кластеризует офферы (штрихкод, бренд, название[, атрибуты]) и возвращает номер кластера
+    каждого оффера: номер первого оффера кластера.
+    """
+    clusterer = ProductClusterer()
+    for index, offer in enumerate(offers):
+        clusterer.add(uuid.UUID(int=index), *offer)
+    clusters = clusterer.clusters()
+    return [clusters[uuid.UUID(int=index)].int for index in range(len(offers))]
+
+
+@pytest.mark.parametrize(
+    "offers, expected",
+    [
+        # Почти совпадающие названия (коэффициент Жаккара 12/13) объединяются
+        ([(None, None, KETTLE), (None, None, KETTLE + " новинка")], [0, 0]),
+        # Регистр и "ё" не различаются
+        ([(None, None, KETTLE), (None, None, KETTLE.upper().replace("Е", "Ё"))], [0, 0]),
+        # Половина общих слов — разные товары
+        (
+            [(None, None, "Чайник Polaris PWK 1803 стальной"), (None, None, "Чайник Polaris PWK 1803 белый матовый")],
+            [0, 1],
+        ),
+        ([(None, None, KETTLE), (None, None, "Кабель HDMI 2 м")], [0, 1]),
+        # Без названия оффер остается один
+        ([(None, None, ""), (None, None, "")], [0, 1]),
+    ],
+)
+def test_title_merging(offers, expected):
+    assert cluster(*offers) == expected
+
+
+def test_merges_are_transitive():
+    title = "Смартфон Samsung Galaxy A55 SM-A556E синий"
+    offers = [
+        ("4006381333931", None, "Смартфон"),
+        # Тот же штрихкод, что у первого, и та же модель, что у третьего
+        ("4006381333931", "Samsung", "Телефон SM-A556E"),
+        (None, "SAMSUNG", title),
+        # Название почти совпадает с третьим (7/8 слов), а пятое — только с четвертым (8/9 слов, с третьим 7/9)
+        (None, None, title + " eSIM"),
+        (None, None, title + " eSIM nano"),
+        (None, "Apple", "iPhone 15"),
+    ]
+    assert cluster(*offers) == [0, 0, 0, 0, 0, 5]
+
+
+def test_variants_are_not_merged_by_model_or_title():
+    offers = [
+        (None, "Apple", "iPhone 15 Pro MTUV3 128 ГБ", {"storage_gb": 128}),
+        (None, "Apple", "iPhone 15 Pro MTUV3 256 ГБ", {"storage_gb": 256}),
+        (None, "Apple", "iPhone 15 Pro MTUV3", {}),
+        # Совпадающий штрихкод объединяет даже разные модификации
+        ("4006381333931", None, "iPhone 128", {"storage_gb": 128}),
+        ("4006381333931", None, "iPhone 256", {"storage_gb": 256}),
+    ]
+    clusters = cluster(*offers)
+    assert clusters[0] != clusters[1]
+    assert clusters[2] in (clusters[0], clusters[1])
+    assert clusters[3] == clusters[4]
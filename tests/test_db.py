@@ -0,0 +1,155 @@
+import asyncio
+import os
+import uuid
+
+import lxml.etree as ET
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.db import claim_similarity_job, create_staging_tables, save_similar_skus, soft_delete_missing_skus, upsert_skus
+from app.models import SKU, SimilarityJob, SkuSimilarity
+from app.parser import CategoryPath, parse_offer_record
+
+# Тесты записи в Postgres запускаются, только если задана тестовая база:
+# TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost:5432/postgres
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+SRC = uuid.UUID(int=1)
+OLD = [(uuid.UUID(int=2), 1.0)]
+NEW = [(uuid.UUID(int=3), 2.0), (uuid.UUID(int=4), 1.5)]
+
+
+def run(check):
+    """
+    Выполняет check(engine) на чистой таблице sku_similarity.
+    """
+
+    async def main():
+        engine = create_async_engine(DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(SkuSimilarity.__table__.create, checkfirst=True)
+                await conn.execute(SkuSimilarity.__table__.delete().where(SkuSimilarity.src_uuid == SRC))
+            async with AsyncSession(engine) as session:
+                await save_similar_skus(session, {SRC: OLD})
+                await session.commit()
+            await check(engine)
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(SkuSimilarity.__table__.delete().where(SkuSimilarity.src_uuid == SRC))
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+async def edges(engine) -> list[tuple[uuid.UUID, float]]:
+    async with AsyncSession(engine) as session:
+        rows = await session.execute(
+            select(SkuSimilarity.dst_uuid, SkuSimilarity.score)
+            .where(SkuSimilarity.src_uuid == SRC)
+            .order_by(SkuSimilarity.rank)
+        )
+        return [tuple(row) for row in rows]
+
+
+def test_save_similar_skus_replaces_edges():
+    async def check(engine):
+        async with AsyncSession(engine) as session:
+            await save_similar_skus(session, {SRC: NEW})
+            await session.commit()
+        assert await edges(engine) == NEW
+
+    run(check)
+
+
+def test_save_similar_skus_rolls_back_with_session():
+    async def check(engine):
+        async with AsyncSession(engine) as session:
+            await save_similar_skus(session, {SRC: NEW})
+            await session.rollback()
+        # Откат сессии отменяет и DELETE, и COPY: прежние ребра на месте
+        assert await edges(engine) == OLD
+
+    run(check)
+
+
+def test_claim_similarity_job_filters_run():
+    runs = ("test-run-a", "test-run-b")
+
+    async def main():
+        engine = create_async_engine(DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(SimilarityJob.__table__.create, checkfirst=True)
+                await conn.execute(delete(SimilarityJob).where(SimilarityJob.run_id.in_(runs)))
+                await conn.execute(
+                    SimilarityJob.__table__.insert(),
+                    [{"run_id": run_id, "first_uuid": SRC, "last_uuid": SRC} for run_id in runs],
+                )
+            async with AsyncSession(engine) as session:
+                job = await claim_similarity_job(session, "worker", 60.0, 3, run_id=runs[1])
+                assert job.run_id == runs[1]
+                # Задач прохода больше нет, задача другого прохода не забирается
+                assert await claim_similarity_job(session, "worker", 60.0, 3, run_id=runs[1]) is None
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(delete(SimilarityJob).where(SimilarityJob.run_id.in_(runs)))
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def offer(product_id: int, title: str):
+    elem = ET.fromstring(f'<offer id="{product_id}" marketplace_id="1"><name>{title}</name></offer>')
+    return parse_offer_record(elem, {0: CategoryPath()})
+
+
+def test_upsert_skus_writes_changes_and_soft_deletes():
+    phone, case = offer(1, "Смартфон"), offer(2, "Чехол")
+    case_renamed = offer(2, "Чехол кожаный")
+
+    async def feed(conn, *skus):
+        # Каждый вызов — отдельная инкрементальная загрузка фида из skus
+        await create_staging_tables(conn)
+        changed = await upsert_skus(conn, list(skus))
+        return changed, await soft_delete_missing_skus(conn)
+
+    async def deleted_at(conn, sku):
+        return await conn.scalar(select(SKU.deleted_at).where(SKU.uuid == sku.uuid))
+
+    async def main():
+        engine = create_async_engine(DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(SKU.__table__.drop, checkfirst=True)
+                await conn.run_sync(SKU.__table__.create)
+            async with engine.connect() as conn:
+                changed, deleted = await feed(conn, phone, case)
+                assert changed == {(1, 1): phone.uuid, (1, 2): case.uuid}
+                assert deleted == []
+
+                # Неизменный оффер пропускается, измененный сохраняет uuid
+                changed, deleted = await feed(conn, phone, case_renamed)
+                assert changed == {(1, 2): case.uuid}
+                assert await conn.scalar(select(SKU.title).where(SKU.uuid == case.uuid)) == "Чехол кожаный"
+
+                # Пропавший из фида оффер мягко удаляется
+                changed, deleted = await feed(conn, phone)
+                assert (changed, deleted) == ({}, [case.uuid])
+                assert await deleted_at(conn, case) is not None
+                assert await deleted_at(conn, phone) is None
+
+                # Вернувшийся оффер восстанавливается, даже если не изменился
+                changed, deleted = await feed(conn, phone, case_renamed)
+                assert (changed, deleted) == ({(1, 2): case.uuid}, [])
+                assert await deleted_at(conn, case) is None
+                await conn.commit()
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(SKU.__table__.drop, checkfirst=True)
+            await engine.dispose()
+
+    asyncio.run(main())
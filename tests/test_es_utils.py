@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.es_utils import (
+    SKU_ALIAS,
+    BlockingOptions,
+    MltOptions,
+    build_block_levels,
+    build_mlt_query,
+    create_sku_index,
+    delete_stale_indices,
+    ensure_sku_index,
+    swap_alias,
+)
+from benchmarks.standins import InMemoryElasticsearch
+
+
+def test_delete_stale_indices_keeps_aliased_index():
+    async def main():
+        es = InMemoryElasticsearch()
+        for index in ("sku_1", "sku_2", "sku_3"):
+            await create_sku_index(es, index)
+        await swap_alias(es, "sku_2")
+
+        deleted = await delete_stale_indices(es, ["sku_1", "sku_2", "sku_missing", "sku_1"])
+
+        assert deleted == ["sku_1"]
+        assert sorted(es.indices_data) == ["sku_2", "sku_3"]
+
+    asyncio.run(main())
+
+
+def test_ensure_sku_index_migrates_concrete_index():
+    async def main():
+        es = InMemoryElasticsearch()
+        # Индекс sku, созданный до перехода на алиасы
+        await es.indices.create(index=SKU_ALIAS)
+        await es.index(index=SKU_ALIAS, id="1", document={"title": "Смартфон"})
+
+        await ensure_sku_index(es)
+
+        (index,) = es.aliases[SKU_ALIAS]
+        assert index != SKU_ALIAS
+        assert sorted(es.indices_data) == [index]
+        assert (await es.mget(index=SKU_ALIAS, ids=["1"]))["docs"][0]["found"]
+
+        # Повторный вызов ничего не меняет
+        await ensure_sku_index(es)
+        assert es.aliases[SKU_ALIAS] == {index}
+
+    asyncio.run(main())
+
+
+LVL_1 = {"term": {"category_lvl_1": "Электроника"}}
+LVL_2 = {"term": {"category_lvl_2": "Телефоны"}}
+LVL_3 = {"term": {"category_lvl_3": "Смартфоны"}}
+BRAND = {"term": {"brand.keyword": "Samsung"}}
+BAND = {"range": {"price_after_discounts": {"gte": 500.0, "lte": 2000.0}}}
+PHONE = {
+    "category_lvl_1": "Электроника",
+    "category_lvl_2": "Телефоны",
+    "category_lvl_3": "Смартфоны",
+    "brand": "Samsung",
+    "price_after_discounts": 1000.0,
+}
+
+
+@pytest.mark.parametrize(
+    "document, expected",
+    [
+        # Листовая категория с брендом и ценой, без бренда, без цены, затем категория первого уровня
+        (PHONE, [[LVL_1, LVL_2, LVL_3, BRAND, BAND], [LVL_1, LVL_2, LVL_3, BAND], [LVL_1, LVL_2, LVL_3], [LVL_1]]),
+        # Путь категории обрывается на первом пустом уровне
+        ({**PHONE, "category_lvl_2": ""}, [[LVL_1, BRAND, BAND], [LVL_1, BAND], [LVL_1]]),
+        # Без цены (и с нулевой ценой) ценового диапазона нет, одинаковые уровни объединяются
+        ({**PHONE, "price_after_discounts": None}, [[LVL_1, LVL_2, LVL_3, BRAND], [LVL_1, LVL_2, LVL_3], [LVL_1]]),
+        ({**PHONE, "price_after_discounts": 0.0}, [[LVL_1, LVL_2, LVL_3, BRAND], [LVL_1, LVL_2, LVL_3], [LVL_1]]),
+        # Без категории остаются бренд и цена, последний уровень — весь индекс
+        ({"brand": "Samsung", "price_after_discounts": 1000.0}, [[BRAND, BAND], [BAND], []]),
+        ({"price_after_discounts": 1000.0}, [[BAND], []]),
+        ({}, [[]]),
+        # Документ неизвестен: поиск по всему индексу
+        (None, [[]]),
+    ],
+)
+def test_build_block_levels(document, expected):
+    assert build_block_levels(document) == expected
+
+
+def test_build_block_levels_price_band_and_disabled():
+    levels = build_block_levels({"price_after_discounts": 999.99}, BlockingOptions(price_band=3.0))
+    assert levels[0] == [{"range": {"price_after_discounts": {"gte": 333.33, "lte": 2999.97}}}]
+
+    assert build_block_levels(PHONE, BlockingOptions(enabled=False)) == [[]]
+
+
+def test_build_mlt_query_filters_and_attributes():
+    sku_id = uuid.UUID(int=1)
+    mlt = MltOptions(max_doc_freq=1000)
+
+    plain = build_mlt_query(sku_id, [], mlt)
+    assert plain["size"] == mlt.size
+    assert plain["query"]["more_like_this"]["like"] == [{"_id": str(sku_id)}]
+    assert plain["query"]["more_like_this"]["max_doc_freq"] == 1000
+
+    query = build_mlt_query(sku_id, [LVL_1, BAND], mlt, {"storage_gb": 256, "unknown": 1})["query"]["bool"]
+    assert query["must"] == plain["query"]
+    assert query["filter"] == [LVL_1, BAND]
+    # Атрибуты повышают оценку, но не отбрасывают кандидатов; неизвестные атрибуты пропускаются
+    assert query["should"] == [
+        {"constant_score": {"filter": {"term": {"attributes.storage_gb": 256}}, "boost": mlt.attribute_boost}}
+    ]
+
+    unboosted = build_mlt_query(sku_id, [LVL_1], mlt._replace(attribute_boost=0), {"storage_gb": 256})
+    assert "should" not in unboosted["query"]["bool"]
@@ -0,0 +1,135 @@
+import asyncio
+
+import lxml.etree as ET
+import pytest
+
+import app.parser
+from app.parser import (
+    CategoryPath,
+    ParseOptions,
+    build_category_hierarchy,
+    build_category_paths,
+    compute_content_hash,
+    parse_offer_record,
+    parse_xml_batches,
+)
+from benchmarks.feedgen import FeedSpec, write_feed
+
+
+@pytest.fixture(scope="module")
+def feed(tmp_path_factory) -> tuple[str, dict]:
+    file_path = str(tmp_path_factory.mktemp("feed") / "feed.xml")
+    write_feed(file_path, FeedSpec(offers=600, description_words=5, features=2))
+    return file_path, build_category_paths(*build_category_hierarchy(file_path))
+
+
+def test_build_category_paths_levels():
+    categories = {1: "Электроника", 2: "Телефоны", 3: "Смартфоны", 4: "Android", 5: "Samsung", 6: "Бытовая техника"}
+    parent_map = {2: 1, 3: 2, 4: 3, 5: 4}
+
+    paths = build_category_paths(categories, parent_map)
+
+    assert paths[1] == CategoryPath("Электроника")
+    assert paths[3] == CategoryPath("Электроника", "Телефоны", "Смартфоны")
+    assert paths[5] == CategoryPath("Электроника", "Телефоны", "Смартфоны", "Android/Samsung")
+    assert paths[6] == CategoryPath("Бытовая техника")
+
+
+def test_build_category_paths_unknown_parent_and_empty_name():
+    categories = {1: "Электроника", 2: "", 3: "Смартфоны", 4: "Аксессуары"}
+    parent_map = {2: 1, 3: 2, 4: 99}
+
+    paths = build_category_paths(categories, parent_map)
+
+    # Категория без названия пропускается в пути, неизвестный родитель — корень
+    assert paths[3] == CategoryPath("Электроника", "Смартфоны")
+    assert paths[4] == CategoryPath("Аксессуары")
+    assert set(paths) == set(categories)
+
+
+def test_build_category_paths_breaks_cycles():
+    categories = {1: "A", 2: "B", 3: "C", 4: "D"}
+    # 1 -> 2 -> 1 — цикл, 3 ссылается сам на себя, 4 — потомок цикла
+    parent_map = {1: 2, 2: 1, 3: 3, 4: 1}
+
+    paths = build_category_paths(categories, parent_map)
+
+    # Категория, замыкающая цикл при обходе от категории 1, считается корнем
+    assert paths[2] == CategoryPath("B")
+    assert paths[1] == CategoryPath("B", "A")
+    assert paths[3] == CategoryPath("C")
+    assert paths[4] == CategoryPath("B", "A", "D")
+
+
+def test_content_hash_covers_attributes(monkeypatch):
+    elem = ET.fromstring(
+        '<offer id="7" marketplace_id="1"><name>Смартфон Galaxy A55 8/256 ГБ</name><category_id>1</category_id></offer>'
+    )
+    paths = {1: CategoryPath("Электроника")}
+
+    record = parse_offer_record(elem, paths)
+    assert compute_content_hash(record) == record.content_hash
+
+    # Исправление экстрактора атрибутов меняет хеш неизменного оффера
+    monkeypatch.setattr(app.parser, "extract_attributes", lambda title, features: {"storage_gb": 512})
+    fixed = parse_offer_record(elem, paths)
+    assert fixed.content_hash != record.content_hash
+    assert compute_content_hash(fixed) == fixed.content_hash
+
+
+def parse_keys(file_path, category_paths, options, resume_after=None) -> list[tuple[int, int]]:
+    async def collect():
+        keys = []
+        async for batch in parse_xml_batches(file_path, category_paths, 100, options, resume_after):
+            keys.extend((record.marketplace_id, record.product_id) for record in batch)
+        return keys
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("position", [0, 250, 599])
+def test_in_process_resume_matches_sequential(feed, position):
+    file_path, category_paths = feed
+    sequential = parse_keys(file_path, category_paths, ParseOptions())
+
+    assert parse_keys(file_path, category_paths, ParseOptions(), sequential[position]) == sequential[position:][1:]
+
+
+def test_in_process_parse_does_not_block_event_loop(feed):
+    file_path, category_paths = feed
+
+    async def main():
+        ticks = 0
+        parsing = True
+
+        async def ticker():
+            nonlocal ticks
+            while parsing:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        batches = 0
+        async for _ in parse_xml_batches(file_path, category_paths, 600, ParseOptions()):
+            batches += 1
+        parsing = False
+        await task
+        return batches, ticks
+
+    batches, ticks = asyncio.run(main())
+    assert batches == 1
+    # Пока единственная пачка разбирается в потоке, цикл событий выполняет другие корутины
+    assert ticks > 10
+
+
+@pytest.mark.parametrize("position", [0, 250, 599])
+def test_parallel_resume_matches_sequential(feed, position):
+    file_path, category_paths = feed
+    sequential = parse_keys(file_path, category_paths, ParseOptions())
+    # Мелкие куски, чтобы оффер resume_after оказался в середине файла, а в работе было несколько кусков
+    options = ParseOptions(workers=2, chunk_bytes=4096, ordered=False)
+
+    resumed = parse_keys(file_path, category_paths, options, sequential[position])
+
+    assert len(sequential) == 600
+    assert resumed == sequential[position:][1:]
@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+
+import pytest
+
+from app.pipeline import Stage, run_pipeline
+
+
+async def endless():
+    for item in itertools.count():
+        yield item
+        await asyncio.sleep(0)
+
+
+def endless_sync():
+    yield from itertools.count()
+
+
+@pytest.mark.parametrize("source", [endless, endless_sync])
+def test_stage_error_cancels_pipeline(source):
+    started, cancelled = [], []
+
+    async def slow(item):
+        started.append(item)
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+
+    async def fail(item):
+        if item == 3:
+            # Ошибка возникает, когда оба обработчика последнего этапа заняты
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+            raise ValueError("bad item")
+        return item
+
+    stages = [Stage("first", lambda item: asyncio.sleep(0, item)), Stage("fail", fail), Stage("slow", slow, 2)]
+
+    # Ошибка доходит до вызывающего кода сама по себе, без ExceptionGroup, и конвейер не зависает
+    with pytest.raises(ValueError, match="bad item"):
+        asyncio.run(asyncio.wait_for(run_pipeline(source(), stages, queue_size=2), 5))
+    # Обработчики других этапов, ждавшие в момент ошибки, отменены
+    assert sorted(cancelled) == [0, 1]
+
+
+def test_slow_stage_limits_items_in_flight():
+    produced = []
+    done = []
+
+    def source():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocked(item):
+            await release.wait()
+            done.append(item)
+
+        stages = [Stage("first", lambda item: asyncio.sleep(0, item)), Stage("blocked", blocked)]
+        pipeline = asyncio.create_task(run_pipeline(source(), stages, queue_size=2))
+        await asyncio.sleep(0.5)
+        # Элемент в последнем этапе, 2 в очереди перед ним, 1 в первом этапе, 2 в очереди перед ним
+        # и 1 у потока-источника: остальной источник не читается, пока последний этап стоит
+        assert len(produced) <= 7
+        release.set()
+        await asyncio.wait_for(pipeline, 5)
+
+    asyncio.run(main())
+    assert done == list(range(100))
@@ -0,0 +1,116 @@
+import asyncio
+import uuid
+
+import pytest
+
+import app.service as service_module
+from app.cache import TTLCache
+from app.models import SIMILARITY_CHANNEL, SKU_DELETED_CHANNEL
+from app.service import ServiceOptions, SimilarService
+
+CACHED, STORED, LIVE, MISSING = (uuid.UUID(int=value) for value in range(1, 5))
+NEIGHBOUR = uuid.UUID(int=100)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakePool:
+    """
+    Заменитель пула asyncpg: похожие из sku_similarity и UUID офферов из словарей.
+    """
+
+    def __init__(self, similar: dict, offers: dict) -> None:
+        self.similar = similar
+        self.offers = offers
+        self.similar_queries = []
+        self.offer_queries = []
+        self.on_fetch = None
+
+    async def fetch(self, query, *args):
+        if self.on_fetch is not None:
+            self.on_fetch()
+        if "unnest" in query:
+            keys = list(zip(*args))
+            self.offer_queries.append(keys)
+            return [(*key, self.offers[key]) for key in keys if key in self.offers]
+        self.similar_queries.append(list(args[0]))
+        return [(sku_id, dst, score) for sku_id in args[0] for dst, score in self.similar.get(sku_id, [])]
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def service(monkeypatch, clock) -> SimilarService:
+    searches = []
+
+    async def find_similar_skus_batch(es_client, sku_ids, **kwargs):
+        searches.append(list(sku_ids))
+        return {sku_id: [(NEIGHBOUR, 1.0)] for sku_id in sku_ids if sku_id == LIVE}, {}
+
+    monkeypatch.setattr(service_module, "find_similar_skus_batch", find_similar_skus_batch)
+    pool = FakePool({STORED: [(NEIGHBOUR, 2.0)]}, {(1, 42): STORED})
+    service = SimilarService(pool, object(), None, ServiceOptions(cache_ttl=300.0, negative_ttl=10.0))
+    service.cache = TTLCache(100, 300.0, clock=clock)
+    service.cache.set(CACHED, [{"uuid": str(NEIGHBOUR), "score": 3.0}])
+    service.searches = searches
+    return service
+
+
+def test_lookup_order(service):
+    found = asyncio.run(service.lookup([CACHED, STORED, LIVE, MISSING]))
+
+    assert found == {
+        CACHED: [{"uuid": str(NEIGHBOUR), "score": 3.0}],
+        STORED: [{"uuid": str(NEIGHBOUR), "score": 2.0}],
+        LIVE: [{"uuid": str(NEIGHBOUR), "score": 1.0}],
+        MISSING: [],
+    }
+    # Кэш, затем БД для всех промахов кэша, затем Elasticsearch для того, чего нет в БД
+    assert service.pool.similar_queries == [[STORED, LIVE, MISSING]]
+    assert service.searches == [[LIVE, MISSING]]
+
+
+def test_empty_result_is_cached_for_negative_ttl(service, clock):
+    asyncio.run(service.lookup([MISSING]))
+    asyncio.run(service.lookup([MISSING]))
+    assert service.pool.similar_queries == [[MISSING]]
+
+    clock.now = 10.0
+    asyncio.run(service.lookup([MISSING]))
+    assert service.pool.similar_queries == [[MISSING], [MISSING]]
+
+
+def test_failed_search_is_not_cached(service, monkeypatch):
+    async def find_similar_skus_batch(es_client, sku_ids, **kwargs):
+        return {}, {sku_id: "ConnectionError()" for sku_id in sku_ids}
+
+    monkeypatch.setattr(service_module, "find_similar_skus_batch", find_similar_skus_batch)
+    assert asyncio.run(service.lookup([MISSING])) == {MISSING: []}
+    assert service.cache.get(MISSING) is None
+
+
+def test_notification_during_lookup_wins(service):
+    # Уведомление пришло, пока результат читался из БД: прочитанное значение не кэшируется
+    service.pool.on_fetch = lambda: service._on_notify(None, 0, SIMILARITY_CHANNEL, str(STORED))
+    asyncio.run(service.lookup([STORED]))
+    assert service.cache.get(STORED) is None
+
+
+def test_deleted_offer_is_forgotten(service):
+    assert asyncio.run(service.resolve_offers([(1, 42)])) == {(1, 42): STORED}
+    assert asyncio.run(service.resolve_offers([(1, 42)])) == {(1, 42): STORED}
+    assert len(service.pool.offer_queries) == 1
+
+    service._on_sku_deleted(None, 0, SKU_DELETED_CHANNEL, "1:42,2:7")
+    del service.pool.offers[(1, 42)]
+    assert asyncio.run(service.resolve_offers([(1, 42)])) == {}
+    assert len(service.pool.offer_queries) == 2
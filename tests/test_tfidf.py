@@ -0,0 +1,33 @@
+import uuid
+
+from app.tfidf import MAX_DF_MIN_DOCS, TfidfIndex, find_similar_skus_tfidf
+
+KETTLE, KETTLE_WHITE, CABLE = (uuid.UUID(int=value) for value in range(1, 4))
+
+
+def test_small_corpus_keeps_common_terms():
+    index = TfidfIndex()
+    index.add(KETTLE, "Чайник Polaris PWK 1803 стальной")
+    index.add(KETTLE_WHITE, "Чайник Polaris PWK 1803 белый")
+    index.add(CABLE, "Кабель HDMI 2 м")
+
+    similar = find_similar_skus_tfidf(index, top_k=2, workers=1)
+
+    # Общие слова чайников встречаются в 2 из 3 документов, но в небольшом каталоге не отбрасываются
+    assert [sku_id for sku_id, _ in similar[KETTLE]] == [KETTLE_WHITE]
+    assert [sku_id for sku_id, _ in similar[KETTLE_WHITE]] == [KETTLE]
+    assert similar[CABLE] == []
+
+
+def test_large_corpus_drops_common_terms():
+    index = TfidfIndex()
+    n_docs = 4 * MAX_DF_MIN_DOCS
+    for value in range(n_docs):
+        index.add(uuid.UUID(int=value), f"товар {value} {value % 3}")
+
+    matrix = index.build_matrix(max_df=0.5).tocsc()
+    columns = {term: matrix[:, column].nnz for term, column in index.vocabulary.items()}
+
+    # "товар" есть во всех документах, "0" — в трети из них
+    assert columns["товар"] == 0
+    assert columns["0"] == n_docs // 3 + 1
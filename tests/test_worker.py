@@ -0,0 +1,175 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+from app import worker
+from app.models import JOB_DONE, JOB_FAILED, JOB_PENDING, JOB_RUNNING
+from app.worker import SimilarityWorker, WorkerOptions
+
+SKU_IDS = [uuid.UUID(int=1), uuid.UUID(int=2)]
+
+
+class FakeSession:
+    """
+    Сессия, которая только считает фиксации и откаты.
+    """
+
+    def __init__(self, queue: "FakeQueue") -> None:
+        self.queue = queue
+
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+    async def commit(self) -> None:
+        self.queue.commits += 1
+
+    async def rollback(self) -> None:
+        self.queue.rollbacks += 1
+
+
+class FakeQueue:
+    """
+    Таблица similarity_job из одной задачи с тем же жизненным циклом, что и в app.db.
+    """
+
+    def __init__(self) -> None:
+        self.status = JOB_PENDING
+        self.attempts = 0
+        self.errors = []
+        self.saved = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def claim(self, session, worker_id, lease_timeout, max_attempts, run_id=None):
+        if run_id not in (None, "run") or self.status != JOB_PENDING or self.attempts >= max_attempts:
+            return None
+        self.status = JOB_RUNNING
+        self.attempts += 1
+        return SimpleNamespace(id=1, run_id="run", first_uuid=SKU_IDS[0], last_uuid=SKU_IDS[-1], attempts=self.attempts)
+
+    async def complete(self, session, job_id, worker_id):
+        self.status = JOB_DONE
+        return True
+
+    async def fail(self, session, job_id, worker_id, error, max_attempts):
+        self.errors.append(error)
+        self.status = JOB_FAILED if self.attempts >= max_attempts else JOB_PENDING
+
+    async def save(self, session, similar):
+        self.saved.append(similar)
+
+
+@pytest.fixture
+def queue(monkeypatch) -> FakeQueue:
+    queue = FakeQueue()
+    monkeypatch.setattr(worker, "AsyncSession", lambda *args, **kwargs: FakeSession(queue))
+    monkeypatch.setattr(worker, "claim_similarity_job", queue.claim)
+    monkeypatch.setattr(worker, "complete_similarity_job", queue.complete)
+    monkeypatch.setattr(worker, "fail_similarity_job", queue.fail)
+    monkeypatch.setattr(worker, "save_similar_skus", queue.save)
+
+    async def get_sku_ids_in_range(session, first_uuid, last_uuid):
+        return SKU_IDS
+
+    monkeypatch.setattr(worker, "get_sku_ids_in_range", get_sku_ids_in_range)
+    return queue
+
+
+def search_results(*results):
+    """
+    Подменяет find_similar_skus_batch: каждый вызов возвращает следующий результат.
+    """
+    results = iter(results)
+
+    async def find_similar_skus_batch(es_client, sku_ids, **kwargs):
+        return next(results)
+
+    return find_similar_skus_batch
+
+
+def test_job_done_when_all_searches_succeed(queue, monkeypatch):
+    similar = {sku_id: [] for sku_id in SKU_IDS}
+    monkeypatch.setattr(worker, "find_similar_skus_batch", search_results((similar, {})))
+
+    asyncio.run(SimilarityWorker(None, None, WorkerOptions(max_attempts=3)).run(exit_when_idle=True))
+
+    assert queue.status == JOB_DONE
+    assert queue.saved == [similar]
+    assert queue.commits == 1
+
+
+def test_worker_takes_jobs_of_its_run_only(queue, monkeypatch):
+    monkeypatch.setattr(worker, "find_similar_skus_batch", search_results(({}, {})))
+
+    asyncio.run(SimilarityWorker(None, None, WorkerOptions(), run_id="other").run(exit_when_idle=True))
+    assert queue.status == JOB_PENDING
+
+    asyncio.run(SimilarityWorker(None, None, WorkerOptions(), run_id="run").run(exit_when_idle=True))
+    assert queue.status == JOB_DONE
+
+
+def test_failed_searches_return_job_to_queue(queue, monkeypatch):
+    outage = ({}, {sku_id: "ConnectionError()" for sku_id in SKU_IDS})
+    similar = {sku_id: [] for sku_id in SKU_IDS}
+    monkeypatch.setattr(worker, "find_similar_skus_batch", search_results(outage, (similar, {})))
+
+    asyncio.run(SimilarityWorker(None, None, WorkerOptions(max_attempts=3)).run(exit_when_idle=True))
+
+    assert queue.status == JOB_DONE
+    assert queue.attempts == 2
+    assert len(queue.errors) == 1
+    # Результат неудачной попытки не записывается
+    assert queue.saved == [similar]
+    assert queue.commits == 1
+
+
+def test_job_failed_after_max_attempts(queue, monkeypatch):
+    outage = ({}, {SKU_IDS[0]: "ConnectionError()"})
+    monkeypatch.setattr(worker, "find_similar_skus_batch", search_results(*[outage] * 3))
+
+    asyncio.run(SimilarityWorker(None, None, WorkerOptions(max_attempts=3)).run(exit_when_idle=True))
+
+    assert queue.status == JOB_FAILED
+    assert queue.attempts == 3
+    assert queue.saved == []
+    assert queue.commits == 0
+
+
+def test_waiting_worker_survives_missing_job_table(queue, monkeypatch):
+    calls = 0
+    claim = queue.claim
+
+    async def claim_after_table_created(*args):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ProgrammingError("SELECT", {}, Exception('relation "similarity_job" does not exist'))
+        return await claim(*args)
+
+    monkeypatch.setattr(worker, "claim_similarity_job", claim_after_table_created)
+    monkeypatch.setattr(worker, "find_similar_skus_batch", search_results(({}, {})))
+
+    async def run_until_done():
+        task = asyncio.create_task(SimilarityWorker(None, None, WorkerOptions(poll_interval=0.01)).run())
+        while queue.status != JOB_DONE:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run_until_done(), 5))
+    assert calls >= 2
+
+
+def test_local_worker_raises_database_errors(queue, monkeypatch):
+    async def claim(*args):
+        raise ProgrammingError("SELECT", {}, Exception('relation "similarity_job" does not exist'))
+
+    monkeypatch.setattr(worker, "claim_similarity_job", claim)
+
+    with pytest.raises(ProgrammingError):
+        asyncio.run(SimilarityWorker(None, None, WorkerOptions()).run(exit_when_idle=True))